@@ -1,11 +1,226 @@
-from flask import Flask, render_template, request
-from vector_search import search, load_document_vectors, load_doc_urls
+import os
+import threading
+import time
+from collections import deque
+from flask import Flask, Response, jsonify, render_template, request
+import boolean_search
+import metrics
+from query_analyzer import reload_query_analyzer
+from query_cache import QueryCache
+from segments import index_segments
+from vector_search import search_index, load_vector_index, index_generation, query_key
 
 app = Flask(__name__)
+app.json.ensure_ascii = False  # Сообщения об ошибках в JSON — по-русски, без \uXXXX
 
-# Загружаем данные при старте
-doc_urls = load_doc_urls()
-doc_vectors, idf_values = load_document_vectors()
+# Режим индекса: lazy — бинарный индекс через mmap, в память читаются только
+# списки документов лемм из запросов; memory — все векторы загружаются в память;
+# sparse — разреженная матрица numpy/scipy (нужны эти пакеты)
+INDEX_MODE = os.environ.get("INDEX_MODE", "lazy")
+
+# Сколько памяти можно занять под кеш списков документов в режиме lazy (байт)
+INDEX_MEMORY_BUDGET = int(os.environ.get("INDEX_MEMORY_BUDGET", 64 * 1024 * 1024))
+
+# Как часто (сек) проверять, не появился ли на диске новый индекс; 0 — не проверять
+INDEX_RELOAD_INTERVAL = float(os.environ.get("INDEX_RELOAD_INTERVAL", 5))
+
+# Сколько последних запросов прогнать по новому индексу перед переключением на него
+WARMUP_QUERIES = 20
+
+# Кеш результатов: число запросов, память (байт), время жизни (сек); 0 записей — без кеша
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", 10000))
+QUERY_CACHE_MEMORY = int(os.environ.get("QUERY_CACHE_MEMORY", 32 * 1024 * 1024))
+QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", 300))
+
+# Сколько результатов показывать по умолчанию и максимум
+DEFAULT_K = 10
+MAX_K = 100
+
+# Виды поиска: векторный и булев
+SEARCH_MODES = ("vector", "boolean")
+
+# Индексы открываются при первом запросе, а не при импорте, поэтому сервер стартует сразу
+# (под gunicorn — заранее, в главном процессе: см. gunicorn.conf.py).
+# _snapshots[вид поиска] — пара (индекс, поколение индекса на диске)
+_snapshots = {}
+_index_lock = threading.Lock()
+_reloader = None
+_recent_queries = deque(maxlen=WARMUP_QUERIES)  # (вид поиска, запрос)
+_result_cache = QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_MEMORY, QUERY_CACHE_TTL)
+
+# Под gunicorn рабочих процессов несколько: метрики складываются через общую папку
+# (её задаёт gunicorn.conf.py), иначе /metrics отдавал бы метрики одного процесса
+if os.environ.get(metrics.MULTIPROC_DIR_ENV):
+    metrics.REGISTRY.enable_multiprocess(os.environ[metrics.MULTIPROC_DIR_ENV])
+
+
+def open_vector_index():
+    return load_vector_index(lazy=INDEX_MODE in ("lazy", "sparse"),
+                             memory_budget=INDEX_MEMORY_BUDGET,
+                             backend="sparse" if INDEX_MODE == "sparse" else "python")
+
+
+# Вид поиска -> (поколение индекса на диске, загрузка индекса)
+INDEX_LOADERS = {
+    "vector": (index_generation, open_vector_index),
+    "boolean": (boolean_search.index_generation, boolean_search.load_index),
+}
+
+
+# Текущий индекс и его поколение (читаются вместе, чтобы не смешать их при замене)
+def get_search_snapshot(mode="vector"):
+    snapshot = _snapshots.get(mode)
+
+    if snapshot is None:
+        with _index_lock:
+            snapshot = _snapshots.get(mode)
+            if snapshot is None:
+                # Поколение берётся до загрузки: если индекс сменится во время неё,
+                # следующая проверка загрузит его ещё раз
+                generation_of, load = INDEX_LOADERS[mode]
+                generation = generation_of()
+                snapshot = _snapshots[mode] = (load(), generation)
+
+    return snapshot
+
+
+def get_search_index(mode="vector"):
+    return get_search_snapshot(mode)[0]
+
+
+# Снимок для запроса: (индекс, поколение, сегменты или None). Сегменты индекса
+# остаются открытыми, пока запрос их не отпустит (segments.release()), даже если
+# индекс за это время заменили новым
+def acquire_snapshot(mode="vector"):
+    while True:
+        index, generation = get_search_snapshot(mode)
+        segments = index_segments(index)
+        # Снимок успели заменить и закрыть — берём новый
+        if segments is None or segments.acquire():
+            return index, generation, segments
+
+
+# Загрузка индексов заранее: под gunicorn с preload_app индексы читаются один раз
+# в главном процессе, и рабочие процессы после fork делят их страницы памяти
+def preload_indexes(modes=SEARCH_MODES):
+    for mode in modes:
+        get_search_snapshot(mode)
+
+
+# Поток проверки индекса на диске. Запускается при первом запросе, а не при загрузке:
+# потоки не переживают fork, поэтому у каждого рабочего процесса gunicorn свой поток,
+# а в главном процессе его нет
+def start_reloader():
+    global _reloader
+
+    if INDEX_RELOAD_INTERVAL <= 0 or (_reloader is not None and _reloader.is_alive()):
+        return
+
+    with _index_lock:
+        if _reloader is None or not _reloader.is_alive():
+            _reloader = threading.Thread(target=reload_loop, daemon=True)
+            _reloader.start()
+
+
+# Загрузка нового индекса, если он изменился на диске.
+# Новый индекс строится и прогревается рядом со старым, пока запросы идут по старому,
+# затем ссылка на него подменяется одним присваиванием. Запросы, уже взявшие старый
+# индекс, дорабатывают по нему; старый индекс закрывается сборщиком мусора, когда
+# на него больше нет ссылок (mmap заменённых файлов остаётся доступным до закрытия)
+def reload_index_if_changed(mode="vector"):
+    snapshot = _snapshots.get(mode)
+    generation_of, load = INDEX_LOADERS[mode]
+
+    generation = generation_of()
+    if snapshot is None or generation == snapshot[1]:
+        return False
+
+    started = time.perf_counter()
+    index = load()
+    reload_query_analyzer()
+
+    for query_mode, query in list(_recent_queries):
+        if query_mode == mode:
+            search(query, index, mode)
+
+    with _index_lock:
+        _snapshots[mode] = (index, generation)
+
+    # Старые сегменты закрываются, когда по ним закончатся начатые запросы
+    old_segments = index_segments(snapshot[0])
+    if old_segments is not None:
+        old_segments.retire()
+
+    # Результаты старого индекса больше не нужны (ключи с его поколением уже не совпадут)
+    _result_cache.clear()
+    metrics.inc("index_reloads_total", mode=mode)
+
+    print(f"[+] Индекс перечитан ({mode}): {time.perf_counter() - started:.2f} с")
+    return True
+
+
+def reload_loop():
+    while True:
+        time.sleep(INDEX_RELOAD_INTERVAL)
+        for mode in list(_snapshots):
+            try:
+                reload_index_if_changed(mode)
+            except Exception as error:
+                # Индекс мог быть в процессе записи (ошибки разбора файлов бывают любыми:
+                # struct.error, KeyError, IndexError...) — поток не должен завершиться,
+                # попробуем при следующей проверке
+                print(f"[!] Не удалось перечитать индекс ({mode}): {error!r}")
+
+
+# Поиск по индексу: список (doc_id, URL, score) k лучших документов.
+# У булева поиска нет score: первые k найденных документов в порядке индекса, score — None
+def search(query, index, mode="vector", k=DEFAULT_K):
+    if mode == "boolean":
+        return [(doc_id, index.doc_urls.get(doc_id, "URL не найден"), None)
+                for doc_id in boolean_search.boolean_search(query, index)[:k]]
+
+    return [(index.doc_id(doc), index.doc_url(doc) or "URL не найден", score)
+            for doc, score in search_index(query, index, k=k)]
+
+
+# Нормализованный запрос для ключа кеша: одинаковые ключи дают одинаковую выдачу
+def search_key(query, mode):
+    if mode == "boolean":
+        return tuple(boolean_search.tokenize_query(query))
+    return query_key(query)
+
+
+# Поиск с кешем: повторные запросы (с тем же нормализованным текстом и k) берутся из кеша
+def run_search(query, k=DEFAULT_K, mode="vector"):
+    started = time.perf_counter()
+    start_reloader()
+    index, generation, segments = acquire_snapshot(mode)
+    _recent_queries.append((mode, query))
+
+    try:
+        key = (mode, generation, search_key(query, mode), k)
+        results = _result_cache.get(key)
+        cache = "hit" if results is not None else "miss"
+
+        if results is None:
+            results = search(query, index, mode, k)
+            _result_cache.put(key, results)
+    finally:
+        if segments is not None:
+            segments.release()
+
+    metrics.inc("search_queries_total", mode=mode, cache=cache)
+    metrics.observe("search_latency_seconds", time.perf_counter() - started, mode=mode)
+    return results
+
+
+# Параметр k из запроса (?k=20 или поле формы), ограниченный 1..MAX_K
+def get_k():
+    try:
+        k = int(request.values.get("k", DEFAULT_K))
+    except ValueError:
+        k = DEFAULT_K
+    return max(1, min(k, MAX_K))
 
 
 @app.route("/", methods=["GET", "POST"])
@@ -16,13 +231,74 @@ def index():
     if request.method == "POST":
         query = request.form.get("query", "").strip()
         if query:
-            search_results = search(query, doc_vectors, idf_values)
-            # Берём топ 10
-            results = [(doc_urls.get(doc_id, "URL не найден"), score)
-                       for doc_id, score in search_results[:10]]
+            # Берём топ k (по умолчанию 10): поиск сразу отбирает только k лучших
+            results = [(url, score) for _, url, score in run_search(query, k=get_k())]
 
     return render_template("index.html", query=query, results=results)
 
 
+# JSON API: /api/search?query=...&k=10&mode=vector|boolean (или те же поля в JSON-теле POST)
+@app.route("/api/search", methods=["GET", "POST"])
+def api_search():
+    params = dict(request.values)
+    if request.is_json:
+        body = request.get_json(silent=True)
+        if body is not None and not isinstance(body, dict):
+            return jsonify({"error": "тело запроса должно быть JSON-объектом"}), 400
+        params.update(body or {})
+
+    query = params.get("query", "")
+    mode = params.get("mode", "vector")
+
+    if not isinstance(query, str):
+        return jsonify({"error": "query должен быть строкой"}), 400
+    query = query.strip()
+    if not query:
+        return jsonify({"error": "пустой запрос"}), 400
+    if mode not in SEARCH_MODES:
+        return jsonify({"error": f"неизвестный вид поиска: {mode}"}), 400
+
+    try:
+        k = int(params.get("k", DEFAULT_K))
+    except (TypeError, ValueError):
+        return jsonify({"error": "k должно быть числом"}), 400
+    if k < 1:
+        return jsonify({"error": "k должно быть положительным"}), 400
+    k = min(k, MAX_K)
+
+    started = time.perf_counter()
+    try:
+        results = run_search(query, k=k, mode=mode)
+    except boolean_search.QueryError as error:
+        return jsonify({"error": f"ошибка в запросе: {error}"}), 400
+
+    return jsonify({
+        "query": query,
+        "mode": mode,
+        "k": k,
+        "results": [{"doc_id": doc_id, "url": url, "score": score} for doc_id, url, score in results],
+        "took_ms": round((time.perf_counter() - started) * 1000, 3),
+    })
+
+
+# Текущие значения процесса: обновляются перед выдачей и сохранением метрик
+def collect_metrics():
+    stats = _result_cache.stats()
+    metrics.set_value("query_cache_entries", stats["entries"])
+    metrics.set_value("query_cache_memory_bytes", stats["memory"])
+
+    for mode, (index, _) in list(_snapshots.items()):
+        metrics.set_value("index_documents", index.doc_count, mode=mode)
+
+
+metrics.REGISTRY.add_collector(collect_metrics)
+
+
+# Метрики в формате Prometheus (под gunicorn — сумма по всем рабочим процессам)
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,182 @@
+import argparse
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import boolean_search
+import metrics
+import vector_search
+
+# Настройки
+
+WORKERS = os.cpu_count() or 1  # Количество процессов для выполнения запросов
+CHUNK_SIZE = 32  # Сколько запросов отдавать процессу за раз
+TOP_K = 10  # Сколько результатов векторного поиска сохранять
+
+# Индекс процесса-воркера: загружается один раз при старте процесса
+_worker = {}
+
+
+def init_worker(mode, k, backend, postings="list"):
+    _worker["mode"] = mode
+    _worker["k"] = k
+
+    if mode == "vector":
+        _worker["index"] = vector_search.load_vector_index(backend=backend)
+    else:
+        _worker["index"] = boolean_search.load_index(postings)
+
+
+# Выполнение одного запроса в воркере: результаты и время в миллисекундах
+def run_query(query):
+    started = time.perf_counter()
+
+    error = None
+
+    if _worker["mode"] == "vector":
+        results = [[doc_id, round(score, 6)]
+                   for doc_id, score in vector_search.search(query, _worker["index"], k=_worker["k"])]
+    else:
+        try:
+            results = boolean_search.boolean_search(query, _worker["index"])
+        except boolean_search.QueryError as e:
+            results = []
+            error = str(e)
+
+    latency_ms = (time.perf_counter() - started) * 1000
+    record = {"query": query, "results": results, "latency_ms": round(latency_ms, 3)}
+    if error is not None:
+        record["error"] = error
+    return record
+
+
+# Перцентиль по методу ближайшего ранга
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def load_queries(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+# Пакетное выполнение запросов в нескольких процессах, порядок ответов = порядку запросов
+def run_batch(queries, mode="vector", k=TOP_K, workers=WORKERS, chunksize=CHUNK_SIZE,
+              backend="python", postings="list"):
+    workers = max(1, min(workers, len(queries)))
+
+    if workers == 1:
+        init_worker(mode, k, backend, postings)
+        return [run_query(query) for query in queries]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(mode, k, backend, postings)) as executor:
+        return list(executor.map(run_query, queries, chunksize=chunksize))
+
+
+# Сводка по задержкам и пропускной способности
+def summarize(records, elapsed):
+    latencies = [record["latency_ms"] for record in records]
+
+    return {
+        "queries": len(records),
+        "elapsed_s": round(elapsed, 3),
+        "qps": round(len(records) / elapsed, 1) if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies, default=0.0),
+        },
+        "empty_results": sum(1 for record in records if not record["results"]),
+    }
+
+
+# Сравнение выдачи с предыдущим запуском (например, с другой сборкой индекса)
+def compare_results(records, previous_path):
+    previous = {}
+    with open(previous_path, "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            previous[record["query"]] = record["results"]
+
+    # Сравниваются документы и их порядок, score не учитывается
+    def ranking(results):
+        return [item[0] if isinstance(item, list) else item for item in results]
+
+    changed = []
+    missing = 0
+
+    for record in records:
+        if record["query"] not in previous:
+            missing += 1
+        elif ranking(record["results"]) != ranking(previous[record["query"]]):
+            changed.append(record["query"])
+
+    return {"compared": len(records) - missing, "changed": len(changed),
+            "missing": missing, "changed_queries": changed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетное выполнение поисковых запросов")
+    parser.add_argument("queries", help="файл с запросами, по одному в строке")
+    parser.add_argument("--mode", choices=("vector", "boolean"), default="vector")
+    parser.add_argument("--output", default="../batch_results.jsonl",
+                        help="файл для результатов (JSON Lines)")
+    parser.add_argument("--k", type=int, default=TOP_K, help="результатов на запрос (vector)")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--backend", choices=("python", "sparse"), default="python",
+                        help="реализация векторного поиска")
+    parser.add_argument("--postings", choices=("list", "bitmap"), default=boolean_search.POSTINGS_FORMAT,
+                        help="формат списков документов булева поиска")
+    parser.add_argument("--compare", help="результаты прошлого запуска для проверки выдачи")
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries)
+
+    started = time.perf_counter()
+    records = run_batch(queries, args.mode, args.k, args.workers, args.chunksize, args.backend,
+                        args.postings)
+    elapsed = time.perf_counter() - started
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    summary = summarize(records, elapsed)
+    latency = summary["latency_ms"]
+
+    print(f"[+] Выполнено запросов: {summary['queries']} за {summary['elapsed_s']} с "
+          f"({summary['qps']} запросов/с)")
+    print(f"[+] Задержка, мс: p50={latency['p50']:.3f} p95={latency['p95']:.3f} "
+          f"p99={latency['p99']:.3f} max={latency['max']:.3f}")
+    print(f"[+] Результаты сохранены: {args.output}")
+
+    if args.compare:
+        comparison = compare_results(records, args.compare)
+        summary["comparison"] = comparison
+
+        print(f"[+] Сравнение с {args.compare}: сравнено {comparison['compared']}, "
+              f"выдача изменилась у {comparison['changed']}, нет в старом файле {comparison['missing']}")
+        for query in comparison["changed_queries"][:20]:
+            print(f"[!] Изменилась выдача: {query}")
+
+    with open(args.output + ".summary.json", "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    # Задержки измерены в процессах-воркерах и пришли вместе с результатами
+    for record in records:
+        metrics.inc("search_queries_total", mode=args.mode, cache="none")
+        metrics.observe("search_latency_seconds", record["latency_ms"] / 1000, mode=args.mode)
+    metrics.write_summary("batch_search", {"summary": summary})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import time
+from itertools import accumulate
+
+from batch_search import load_queries, percentile
+
+try:
+    import resource
+except ImportError:  # Windows: пиковая память не измеряется
+    resource = None
+
+# Бенчмарк всех этапов на синтетической коллекции.
+# Коллекция HTML-страниц генерируется без сети: слова выбираются из искусственного
+# словаря по закону Ципфа, как в настоящих текстах. Каждый этап запускается
+# в отдельном процессе (чтобы пиковая память относилась только к нему) в рабочей папке
+# WORK_DIR, которая для модулей проекта выглядит как корень репозитория: pages/,
+# index.txt и т. д. Результаты сохраняются в JSON, который можно сравнить
+# с результатами другой версии кода (--compare).
+
+WORK_DIR = "../benchmark_data"  # Папка с коллекцией и результатами этапов
+OUTPUT_FILE = "../benchmark.json"  # Результаты бенчмарка
+CORPUS_FILE = "corpus.json"  # Параметры коллекции в WORK_DIR: по ним она переиспользуется
+
+DOCS = 1000  # Документов в коллекции
+VOCABULARY = 50000  # Разных слов в словаре
+ZIPF_S = 1.0  # Показатель закона Ципфа: частота слова ~ 1 / ранг^s
+DOC_WORDS = 300  # Средняя длина документа в словах
+QUERIES = 1000  # Запросов каждого вида
+TOP_K = 10  # Результатов на запрос векторного поиска
+WARMUP_QUERIES = 50  # Сколько запросов выполнить до замеров (прогрев mmap и кешей)
+SEED = 42
+
+# Этапы по порядку: каждый следующий использует результаты предыдущих
+STAGES = ("text_processing", "tfidf", "build_index", "boolean_queries", "vector_queries")
+
+CONSONANTS = "bcdfghklmnprstvz"
+VOWELS = "aeiou"
+# Окончания, которые снимает лемматизатор: у одной основы бывает несколько форм
+SUFFIXES = ("", "", "", "s", "es", "ed", "ing", "er")
+PARAGRAPH_WORDS = 60
+
+# Шаблоны запросов булева поиска
+BOOLEAN_TEMPLATES = ("{0} AND {1}", "{0} OR {1}", "{0} AND NOT {1}", '"{0} {1}"', "{0} NEAR/3 {1}")
+
+
+# Словарь из vocabulary разных псевдослов (латиница, длиннее двух букв); номер — ранг
+def make_vocabulary(rng, vocabulary):
+    from text_processing import STOP_WORDS
+
+    words = []
+    seen = set()
+
+    while len(words) < vocabulary:
+        syllables = rng.randint(1, 4)
+        word = "".join(rng.choice(CONSONANTS) + rng.choice(VOWELS) for _ in range(syllables))
+        word += rng.choice(SUFFIXES)
+
+        if len(word) > 2 and word not in seen and word not in STOP_WORDS:
+            seen.add(word)
+            words.append(word)
+
+    return words
+
+
+def generate_corpus(work_dir, docs, vocabulary, zipf_s, doc_words, queries, seed):
+    rng = random.Random(seed)
+    words = make_vocabulary(rng, vocabulary)
+    cum_weights = list(accumulate(1 / (rank + 1) ** zipf_s for rank in range(vocabulary)))
+
+    def sample(count):
+        return rng.choices(words, cum_weights=cum_weights, k=count)
+
+    pages_dir = os.path.join(work_dir, "pages")
+    os.makedirs(pages_dir, exist_ok=True)
+    total_bytes = 0
+
+    with open(os.path.join(work_dir, "index.txt"), "w", encoding="utf-8") as index_file:
+        for doc_id in range(1, docs + 1):
+            text = sample(rng.randint(doc_words // 2, doc_words * 3 // 2))
+            paragraphs = "".join(f"<p>{' '.join(text[i:i + PARAGRAPH_WORDS])}</p>"
+                                 for i in range(0, len(text), PARAGRAPH_WORDS))
+            title = " ".join(text[:5])
+            html = (f"<html><head><title>{title}</title></head>"
+                    f"<body><h1>{title}</h1>{paragraphs}</body></html>")
+
+            with open(os.path.join(pages_dir, f"{doc_id}.txt"), "w", encoding="utf-8") as f:
+                f.write(html)
+            total_bytes += len(html)
+
+            index_file.write(f"{doc_id} https://example.com/doc/{doc_id}\n")
+
+    # Запросы из того же распределения слов
+    with open(os.path.join(work_dir, "queries_vector.txt"), "w", encoding="utf-8") as f:
+        for _ in range(queries):
+            f.write(" ".join(sample(rng.randint(1, 3))) + "\n")
+
+    with open(os.path.join(work_dir, "queries_boolean.txt"), "w", encoding="utf-8") as f:
+        for _ in range(queries):
+            f.write(rng.choice(BOOLEAN_TEMPLATES).format(*sample(2)) + "\n")
+
+    return total_bytes
+
+
+# Подготовка рабочей папки: коллекция с теми же параметрами переиспользуется.
+# clean — удалить результаты прошлых запусков этапов (при прогоне с text_processing);
+# иначе отдельные этапы работают с тем, что оставили предыдущие
+def prepare_work_dir(work_dir, corpus, regenerate=False, clean=True):
+    corpus_path = os.path.join(work_dir, CORPUS_FILE)
+
+    if os.path.isdir(work_dir) and os.listdir(work_dir) and not os.path.exists(corpus_path):
+        raise SystemExit(f"[!] Папка {work_dir} не пуста и не похожа на папку бенчмарка")
+
+    previous = None
+    if os.path.exists(corpus_path):
+        with open(corpus_path, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+
+    reuse = not regenerate and previous is not None and previous["params"] == corpus
+    keep = {CORPUS_FILE, "pages", "index.txt", "queries_vector.txt", "queries_boolean.txt"} if reuse else set()
+
+    if os.path.isdir(work_dir) and (clean or not reuse):
+        for name in os.listdir(work_dir):
+            if name in keep:
+                continue
+            path = os.path.join(work_dir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+    # Модули проекта читают файлы по путям "../...": запускаем их из подпапки
+    os.makedirs(os.path.join(work_dir, "run"), exist_ok=True)
+
+    if reuse:
+        print(f"[+] Коллекция уже сгенерирована: {corpus['docs']} документов")
+        return previous
+
+    print(f"[+] Генерация коллекции: {corpus['docs']} документов, словарь {corpus['vocabulary']} слов")
+    started = time.perf_counter()
+    total_bytes = generate_corpus(work_dir, **corpus)
+    info = {"params": corpus, "bytes": total_bytes,
+            "generate_s": round(time.perf_counter() - started, 3)}
+
+    with open(corpus_path, "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+
+    print(f"[+] Коллекция: {total_bytes / 1024 / 1024:.1f} МБ за {info['generate_s']} с")
+    return info
+
+
+# Пиковая память процесса и дочерних процессов (МБ)
+def peak_memory_mb():
+    if resource is None:
+        return None
+
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux отдаёт килобайты, macOS — байты
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(peak / scale, 1)
+
+
+def run_queries(queries, search, warmup=WARMUP_QUERIES):
+    for query in queries[:warmup]:
+        search(query)
+
+    latencies = []
+    empty = 0
+
+    started = time.perf_counter()
+    for query in queries:
+        query_started = time.perf_counter()
+        if not search(query):
+            empty += 1
+        latencies.append((time.perf_counter() - query_started) * 1000)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "queries": len(queries),
+        "elapsed_s": round(elapsed, 3),
+        "qps": round(len(queries) / elapsed, 1) if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "max": round(max(latencies, default=0.0), 3),
+        },
+        "empty_results": empty,
+    }
+
+
+# Выполнение одного этапа (в дочернем процессе, текущая папка — WORK_DIR/run)
+def run_stage(stage, workers, external, k):
+    result = {}
+    started = time.perf_counter()
+
+    if stage == "text_processing":
+        import text_processing
+        text_processing.main(workers)
+
+    elif stage == "tfidf":
+        import tfidf
+        tfidf.main()
+
+    elif stage == "build_index":
+        import build_index
+        build_index.build(workers, external=external)
+
+    elif stage == "boolean_queries":
+        import boolean_search
+        index = boolean_search.load_index()
+        result["load_s"] = round(time.perf_counter() - started, 3)
+        result.update(run_queries(load_queries("../queries_boolean.txt"),
+                                  lambda query: boolean_search.boolean_search(query, index)))
+
+    elif stage == "vector_queries":
+        import vector_search
+        index = vector_search.load_vector_index()
+        result["load_s"] = round(time.perf_counter() - started, 3)
+        result.update(run_queries(load_queries("../queries_vector.txt"),
+                                  lambda query: vector_search.search_index(query, index, k=k)))
+
+    else:
+        raise ValueError(f"Неизвестный этап: {stage}")
+
+    result.setdefault("elapsed_s", round(time.perf_counter() - started, 3))
+    result["peak_memory_mb"] = peak_memory_mb()
+    return result
+
+
+# Запуск этапа в отдельном процессе; вывод этапа пишется в WORK_DIR/<этап>.log
+def run_stage_process(stage, work_dir, args):
+    result_path = os.path.join(work_dir, f"{stage}.result.json")
+    command = [sys.executable, os.path.abspath(__file__), "--stage", stage,
+               "--stage-result", os.path.abspath(result_path),
+               "--workers", str(args.workers), "--k", str(args.k)]
+    if args.external:
+        command.append("--external")
+
+    with open(os.path.join(work_dir, f"{stage}.log"), "w", encoding="utf-8") as log:
+        completed = subprocess.run(command, cwd=os.path.join(work_dir, "run"),
+                                   stdout=log, stderr=subprocess.STDOUT)
+
+    if completed.returncode != 0:
+        raise SystemExit(f"[!] Этап {stage} завершился с ошибкой, см. {work_dir}/{stage}.log")
+
+    with open(result_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# Версия кода: коммит репозитория, "-dirty" — есть незакоммиченные изменения
+def git_commit():
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=repo_dir,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repo_dir,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+
+# Числовые показатели этапов: "этап.показатель" -> значение
+def flatten(stages, prefix=""):
+    values = {}
+    for name, value in stages.items():
+        key = f"{prefix}{name}"
+        if isinstance(value, dict):
+            values.update(flatten(value, key + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[key] = value
+    return values
+
+
+# Сравнение с результатами прошлого запуска: изменение каждого показателя в процентах
+def compare_results(results, previous_path):
+    with open(previous_path, "r", encoding="utf-8") as f:
+        previous = json.load(f)
+
+    if previous.get("corpus", {}).get("params") != results["corpus"]["params"]:
+        print("[!] Коллекции различаются — сравнение может быть некорректным")
+
+    old = flatten(previous["stages"])
+    new = flatten(results["stages"])
+
+    print(f"\nСравнение с {previous_path} ({previous.get('commit')} -> {results['commit']}):")
+    for key in new:
+        if key in old:
+            change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            print(f"  {key:<40} {old[key]:>12} -> {new[key]:>12} ({change:+.1f}%)")
+
+
+def print_results(results):
+    for stage, result in results["stages"].items():
+        line = f"[+] {stage:<16} {result['elapsed_s']:8.2f} с"
+        if "docs_per_s" in result:
+            line += f", {result['docs_per_s']} документов/с"
+        if "qps" in result:
+            latency = result["latency_ms"]
+            line += f", {result['qps']} запросов/с, p50={latency['p50']} p95={latency['p95']} мс"
+        if result["peak_memory_mb"] is not None:
+            line += f", память {result['peak_memory_mb']} МБ"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк этапов на синтетической коллекции")
+    parser.add_argument("--docs", type=int, default=DOCS)
+    parser.add_argument("--vocabulary", type=int, default=VOCABULARY)
+    parser.add_argument("--zipf", type=float, default=ZIPF_S, help="показатель закона Ципфа")
+    parser.add_argument("--doc-words", type=int, default=DOC_WORDS)
+    parser.add_argument("--queries", type=int, default=QUERIES)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--k", type=int, default=TOP_K)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--external", action="store_true", help="build_index во внешней памяти")
+    parser.add_argument("--stages", default=",".join(STAGES), help="этапы через запятую")
+    parser.add_argument("--work-dir", default=WORK_DIR)
+    parser.add_argument("--regenerate", action="store_true", help="сгенерировать коллекцию заново")
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--compare", help="результаты прошлого запуска для сравнения")
+    parser.add_argument("--stage", help=argparse.SUPPRESS)
+    parser.add_argument("--stage-result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Дочерний процесс: один этап
+    if args.stage:
+        result = run_stage(args.stage, args.workers, args.external, args.k)
+        with open(args.stage_result, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return
+
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        print(f"[!] Неизвестные этапы: {', '.join(unknown)}")
+        return
+
+    corpus = {"docs": args.docs, "vocabulary": args.vocabulary, "zipf_s": args.zipf,
+              "doc_words": args.doc_words, "queries": args.queries, "seed": args.seed}
+    corpus_info = prepare_work_dir(args.work_dir, corpus, args.regenerate,
+                                   clean="text_processing" in stages)
+
+    results = {
+        "commit": git_commit(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "workers": args.workers,
+        "external": args.external,
+        "corpus": corpus_info,
+        "stages": {},
+    }
+
+    for stage in STAGES:
+        if stage not in stages:
+            continue
+
+        print(f"[+] Этап {stage}...")
+        result = run_stage_process(stage, args.work_dir, args)
+
+        if "qps" not in result and result["elapsed_s"] > 0:
+            result["docs_per_s"] = round(args.docs / result["elapsed_s"], 1)
+            result["mb_per_s"] = round(corpus_info["bytes"] / 1024 / 1024 / result["elapsed_s"], 2)
+
+        results["stages"][stage] = result
+
+    print_results(results)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"[+] Результаты сохранены: {args.output}")
+
+    if args.compare:
+        compare_results(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+from array import array
+from bisect import bisect_left
+
+# Сжатая битовая карта номеров документов (по схеме Roaring).
+#
+# Номер документа делится на старшие 16 бит (номер контейнера) и младшие 16 бит.
+# Контейнер с малым числом документов хранится отсортированным массивом
+# array("H") по 2 байта на документ, плотный контейнер — битовой маской
+# на 65536 бит (целое Python), над которой AND/OR/ANDNOT выполняются
+# сразу по машинным словам.
+
+CONTAINER_BITS = 16
+CONTAINER_SIZE = 1 << CONTAINER_BITS
+LOW_MASK = CONTAINER_SIZE - 1
+ARRAY_LIMIT = 4096  # Больше документов в контейнере — переходим на битовую маску
+
+# Позиции единичных битов для каждого значения байта
+_BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+
+def _bits_from_array(values):
+    data = bytearray(CONTAINER_SIZE // 8)
+    for value in values:
+        data[value >> 3] |= 1 << (value & 7)
+    return int.from_bytes(data, "little")
+
+
+# Проверка отдельных битов маски: сдвиг целого на 65536 бит дорог, байты — нет
+def _bytes_from_bits(bits):
+    return bits.to_bytes(CONTAINER_SIZE // 8, "little")
+
+
+def _array_from_bits(bits):
+    values = array("H")
+    data = _bytes_from_bits(bits)
+    for position, byte in enumerate(data):
+        if byte:
+            base = position << 3
+            values.extend(base + bit for bit in _BYTE_BITS[byte])
+    return values
+
+
+# Приведение контейнера к компактному виду по числу документов
+def _pack(values):
+    if isinstance(values, int):
+        if not values:
+            return None
+        if values.bit_count() <= ARRAY_LIMIT:
+            return _array_from_bits(values)
+        return values
+
+    if not values:
+        return None
+    if len(values) > ARRAY_LIMIT:
+        return _bits_from_array(values)
+    return values if isinstance(values, array) else array("H", values)
+
+
+def _container_len(container):
+    if isinstance(container, int):
+        return container.bit_count()
+    return len(container)
+
+
+def _and(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        return _pack(a & b)
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        data = _bytes_from_bits(b)
+        return _pack(array("H", (value for value in a if data[value >> 3] >> (value & 7) & 1)))
+    return _pack(sorted(set(a).intersection(b)))
+
+
+def _or(a, b):
+    if isinstance(a, int) or isinstance(b, int):
+        a = a if isinstance(a, int) else _bits_from_array(a)
+        b = b if isinstance(b, int) else _bits_from_array(b)
+        return a | b
+    return _pack(sorted(set(a).union(b)))
+
+
+def _andnot(a, b):
+    if isinstance(a, int):
+        b = b if isinstance(b, int) else _bits_from_array(b)
+        return _pack(a & ~b)
+    if isinstance(b, int):
+        data = _bytes_from_bits(b)
+        return _pack(array("H", (value for value in a if not data[value >> 3] >> (value & 7) & 1)))
+    return _pack(sorted(set(a).difference(b)))
+
+
+class Bitmap:
+    """
+    Множество номеров документов. Поддерживает &, |, - (AND NOT), len()
+    и перебор номеров по возрастанию, поэтому заменяет отсортированный
+    список документов в булевом поиске.
+    """
+
+    __slots__ = ("containers",)
+
+    def __init__(self, containers=None):
+        self.containers = containers or {}  # старшие 16 бит -> контейнер
+
+    # Из возрастающей последовательности номеров
+    @classmethod
+    def from_sorted(cls, docs):
+        containers = {}
+        current = None
+        values = None
+
+        for doc in docs:
+            key = doc >> CONTAINER_BITS
+            if key != current:
+                if values:
+                    containers[current] = _pack(values)
+                current = key
+                values = array("H")
+            values.append(doc & LOW_MASK)
+
+        if values:
+            containers[current] = _pack(values)
+
+        return cls(containers)
+
+    # Все документы 0..count-1 (для NOT без AND)
+    @classmethod
+    def from_range(cls, count):
+        containers = {}
+        for key in range((count + LOW_MASK) >> CONTAINER_BITS):
+            size = min(CONTAINER_SIZE, count - (key << CONTAINER_BITS))
+            containers[key] = _pack((1 << size) - 1)
+        return cls(containers)
+
+    # Объединение нескольких карт без промежуточных копий
+    @classmethod
+    def union_all(cls, bitmaps):
+        containers = {}
+        for bitmap in bitmaps:
+            for key, container in bitmap.containers.items():
+                current = containers.get(key)
+                containers[key] = container if current is None else _or(current, container)
+        return cls({key: _pack(container) for key, container in containers.items()})
+
+    def __and__(self, other):
+        containers = {}
+        for key, container in self.containers.items():
+            if key in other.containers:
+                result = _and(container, other.containers[key])
+                if result is not None:
+                    containers[key] = result
+        return Bitmap(containers)
+
+    def __or__(self, other):
+        return Bitmap.union_all((self, other))
+
+    def __sub__(self, other):
+        containers = {}
+        for key, container in self.containers.items():
+            result = _andnot(container, other.containers[key]) if key in other.containers else container
+            if result is not None:
+                containers[key] = result
+        return Bitmap(containers)
+
+    def __len__(self):
+        return sum(_container_len(container) for container in self.containers.values())
+
+    def __bool__(self):
+        return bool(self.containers)
+
+    def __iter__(self):
+        for key in sorted(self.containers):
+            base = key << CONTAINER_BITS
+            container = self.containers[key]
+            if isinstance(container, int):
+                container = _array_from_bits(container)
+            for value in container:
+                yield base + value
+
+    def __contains__(self, doc):
+        container = self.containers.get(doc >> CONTAINER_BITS)
+        if container is None:
+            return False
+        low = doc & LOW_MASK
+        if isinstance(container, int):
+            return bool(container >> low & 1)
+        position = bisect_left(container, low)
+        return position < len(container) and container[position] == low
+
+    # Примерный объём данных контейнеров (байт)
+    def memory_size(self):
+        return sum(CONTAINER_SIZE // 8 if isinstance(container, int) else 2 * len(container)
+                   for container in self.containers.values())
@@ -1,37 +1,32 @@
 import re
 import os
-from collections import defaultdict
+import heapq
+import threading
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from bitmap import Bitmap
+from index_format import INDEX_BIN_FILE, IndexReader, doc_sort_key, file_version
+from positional_index import POSITIONS_FILE, PositionalIndexReader, build_positional_index
+from query_analyzer import build_lexicon, get_query_analyzer, save_lexicon
+from segments import SegmentedIndex, manifest_path, reset_segments, segments_are_current
+from text_processing import tokenize_with_positions
 
 PAGES_DIR = "../pages"  # Папка с сохранёнными текстовыми документами
 PAGE_TERMS_DIR = "../page_terms"  # Файлы с леммами (лемма -> токены)
 INDEX_DOCS_FILE = "../index.txt"  # Файл с соответствием doc_id -> URL
 INDEX_FILE = "../inverted_index.txt"  # Файл для сохранения инвертированного индекса
 
+# Формат списков документов в памяти: "list" — отсортированные номера,
+# "bitmap" — сжатые битовые карты (bitmap.py), в разы компактнее для частых лемм
+POSTINGS_FORMAT = os.environ.get("BOOLEAN_POSTINGS", "list")
 
-def load_token_to_lemma():
-    token_to_lemma = {}
-
-    for filename in os.listdir(PAGE_TERMS_DIR):
-        if filename.endswith("_lemmas.txt"):
-
-            file_path = os.path.join(PAGE_TERMS_DIR, filename)
-
-            with open(file_path, "r", encoding="utf-8") as f:
-                for line in f:
-                    parts = line.strip().split()
-                    if not parts:
-                        continue
-
-                    lemma = parts[0]
-                    tokens = parts[1:]
-
-                    token_to_lemma[lemma] = lemma
-
-                    for token in tokens:
-                        token_to_lemma[token] = lemma
-
-    return token_to_lemma
+# Сколько памяти можно занять битовыми картами лемм, прочитанных из index.bin
+# или сегментов (байт); 0 — не кешировать, карта строится при каждом запросе
+BITMAP_MEMORY_BUDGET = int(os.environ.get("BITMAP_MEMORY_BUDGET", 64 * 1024 * 1024))
 
+# Наибольшая вложенность скобок и NOT в запросе: разбор и вычисление рекурсивные,
+# и слишком глубокий запрос исчерпал бы стек
+MAX_QUERY_DEPTH = 64
 
 
 # Загрузка index.txt
@@ -90,60 +85,565 @@ def save_index(index):
             f.write(lemma + " " + " ".join(sorted(index[lemma])) + "\n")
 
 
+# Инвертированный индекс в памяти. Документы пронумерованы по порядку doc_id,
+# списки документов лемм — отсортированные номера
+class InvertedIndex:
+    positions = None  # Позиционный индекс (PositionalIndexReader) для фраз и NEAR
+    doc_urls = {}  # doc_id -> URL (заполняет load_index)
+
+    def __init__(self, postings, doc_ids=(), postings_format=POSTINGS_FORMAT):
+        all_doc_ids = set(doc_ids)
+        for docs in postings.values():
+            all_doc_ids.update(docs)
+
+        self.doc_ids = sorted(all_doc_ids, key=doc_sort_key)
+        self.doc_count = len(self.doc_ids)
+        self.doc_numbers = {doc_id: number for number, doc_id in enumerate(self.doc_ids)}
+
+        pack = Bitmap.from_sorted if postings_format == "bitmap" else list
+
+        self._postings = {
+            lemma: pack(sorted(self.doc_numbers[doc_id] for doc_id in docs))
+            for lemma, docs in postings.items()
+        }
+
+    def postings(self, lemma):
+        return self._postings.get(lemma, [])
+
+    def doc_id(self, number):
+        return self.doc_ids[number]
+
+    def all_docs(self):
+        return range(self.doc_count)
+
+    def terms(self):
+        return iter(self._postings)
+
+    def refresh(self):
+        return self
+
+
+# LRU-кеш битовых карт лемм в пределах memory_budget (байт): индексы на диске
+# хранят списки номеров, и без кеша карта заново строилась бы при каждом запросе
+class BitmapCache:
+    def __init__(self, memory_budget=BITMAP_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self._bitmaps = OrderedDict()  # лемма -> битовая карта
+        self._size = 0
+        self._lock = threading.Lock()
+
+    # load(lemma) — отсортированные номера документов леммы
+    def get(self, lemma, load):
+        with self._lock:
+            bitmap = self._bitmaps.get(lemma)
+            if bitmap is not None:
+                self._bitmaps.move_to_end(lemma)
+                return bitmap
+
+        bitmap = Bitmap.from_sorted(load(lemma))
+        size = bitmap.memory_size()
+        if size > self.memory_budget:
+            return bitmap
+
+        with self._lock:
+            if lemma not in self._bitmaps:
+                self._bitmaps[lemma] = bitmap
+                self._size += size
+
+                while self._size > self.memory_budget:
+                    _, evicted = self._bitmaps.popitem(last=False)
+                    self._size -= evicted.memory_size()
+
+        return bitmap
+
+    # Объём памяти, занятый картами (байт)
+    def size(self):
+        return self._size
+
+
+# Инвертированный индекс поверх бинарного файла: списки документов
+# читаются из mmap только для лемм, которые встретились в запросе
+class BinaryIndex:
+    positions = None
+    doc_urls = {}
+
+    def __init__(self, path=INDEX_BIN_FILE, postings_format=POSTINGS_FORMAT):
+        self.reader = IndexReader(path)
+        self.doc_count = self.reader.doc_count
+        self.doc_ids = self.reader.doc_ids()
+        self.postings_format = postings_format
+        self.bitmaps = BitmapCache() if postings_format == "bitmap" else None
+
+    def postings(self, lemma):
+        if self.bitmaps is not None:
+            return self.bitmaps.get(lemma, self.reader.doc_postings)
+        return self.reader.doc_postings(lemma)
+
+    def doc_id(self, number):
+        return self.doc_ids[number]
+
+    def all_docs(self):
+        return range(self.doc_count)
+
+    def terms(self):
+        return self.reader.terms()
+
+    def refresh(self):
+        return self
+
+
+# Булев поиск по сегментам инкрементального индекса (segments.py);
+# удалённые документы не входят ни в списки лемм, ни в дополнение для NOT
+class SegmentIndex:
+    doc_urls = {}
+
+    def __init__(self, segments, postings_format=POSTINGS_FORMAT):
+        self.segments = segments
+        self.postings_format = postings_format
+        self.doc_count = segments.doc_count
+        self.positions = segments.positions
+
+        # Снимок сегментов не меняется, поэтому карты можно хранить до его замены
+        self.bitmaps = BitmapCache() if postings_format == "bitmap" else None
+
+    def postings(self, lemma):
+        if self.bitmaps is not None:
+            return self.bitmaps.get(lemma, self.segments.doc_postings)
+        return self.segments.doc_postings(lemma)
+
+    def doc_id(self, number):
+        return self.segments.doc_id(number)
+
+    def all_docs(self):
+        return self.segments.live_docs()
+
+    def terms(self):
+        return self.segments.terms()
+
+    # Новый снимок, если сегменты обновились
+    def refresh(self):
+        segments = self.segments.refresh()
+        if segments is self.segments:
+            return self
+
+        index = SegmentIndex(segments, self.postings_format)
+        index.doc_urls = load_doc_urls() if os.path.exists(INDEX_DOCS_FILE) else {}
+        return index
+
+
+# Поколение индексов на диске, из которых читает load_index: меняется при пересборке
+# любого из них или обновлении сегментов
+def index_generation():
+    return tuple(file_version(path) for path in (manifest_path(), INDEX_FILE, INDEX_BIN_FILE, POSITIONS_FILE))
+
+
 # Загрузка индекса из файла
-def load_index():
-    index = defaultdict(set)
-    with open(INDEX_FILE, "r", encoding="utf-8") as f:
-        for line in f:
-            parts = line.strip().split()
-            lemma = parts[0]
-            docs = parts[1:]
-            index[lemma] = set(docs)
+def load_index(postings_format=POSTINGS_FORMAT):
+    doc_urls = load_doc_urls() if os.path.exists(INDEX_DOCS_FILE) else {}
+
+    # Сегменты инкрементального индекса, если они обновлялись после полной сборки
+    if segments_are_current((INDEX_FILE, INDEX_BIN_FILE)):
+        index = SegmentIndex(SegmentedIndex(), postings_format)
+
+    # Бинарный индекс (его строит tfidf.py) открывается без разбора текста,
+    # если он не старше текстового
+    elif os.path.exists(INDEX_BIN_FILE) and (
+            not os.path.exists(INDEX_FILE)
+            or os.path.getmtime(INDEX_BIN_FILE) >= os.path.getmtime(INDEX_FILE)):
+        index = BinaryIndex(INDEX_BIN_FILE, postings_format)
+    else:
+        postings = defaultdict(set)
+        with open(INDEX_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.strip().split()
+                lemma = parts[0]
+                docs = parts[1:]
+                postings[lemma] = set(docs)
+
+        # Документы без лемм тоже входят в коллекцию (важно для NOT)
+        index = InvertedIndex(postings, doc_urls.keys(), postings_format)
+
+    if index.positions is None and os.path.exists(POSITIONS_FILE):
+        index.positions = PositionalIndexReader(POSITIONS_FILE)
+
+    index.doc_urls = doc_urls
+
     return index
 
 
-# Булев поиск
-def boolean_search(query, index, all_docs, token_to_lemma):
+# Разбор булева запроса
 
-    query = query.lower()
-    tokens = re.findall(r"\w+|\(|\)", query)
-    expression = []
+class QueryError(ValueError):
+    pass
 
-    for token in tokens:
 
-        if token == "and":
-            expression.append("&")
+class QuerySyntaxError(QueryError):
+    pass
 
-        elif token == "or":
-            expression.append("|")
 
-        elif token == "not":
-            expression.append("all_docs -")
+# Лексемы запроса: фразы в кавычках, NEAR/k, слова и скобки;
+# операторы AND/OR/NOT/NEAR без учёта регистра
+def tokenize_query(query):
+    return re.findall(r'"[^"]*"|"|near/\d+|\w+|\(|\)', query.lower())
 
-        elif token in ("(", ")"):
-            expression.append(token)
 
-        else:
-            lemma = token_to_lemma.get(token)
+def is_near(token):
+    return token is not None and token.startswith("near/")
+
+
+class QueryParser:
+    """
+    Рекурсивный спуск, приоритет операторов: NEAR/k > NOT > AND > OR.
+    Слова подряд без оператора соединяются через AND.
+    Результат — дерево запроса из кортежей:
+        ("term", лемма), ("not", узел), ("and", [узлы]), ("or", [узлы]),
+        ("phrase", [(смещение, лемма), ...]), ("near", k, лемма, лемма)
+    """
 
-            if lemma:
-                docs = index.get(lemma, set())
+    def __init__(self, tokens, to_lemma):
+        self.tokens = tokens
+        self.position = 0
+        self.to_lemma = to_lemma
+        self.depth = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    # Вход в скобки или NOT; выход — self.depth -= 1
+    def enter(self):
+        self.depth += 1
+        if self.depth > MAX_QUERY_DEPTH:
+            raise QuerySyntaxError(f"слишком глубокая вложенность скобок и NOT (больше {MAX_QUERY_DEPTH})")
+
+    def parse(self):
+        if not self.tokens:
+            raise QuerySyntaxError("пустой запрос")
+
+        node = self.parse_or()
+
+        if self.peek() is not None:
+            raise QuerySyntaxError(f"неожиданное '{self.peek()}'")
+        return node
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.peek() == "or":
+            self.take()
+            children.append(self.parse_and())
+        return self.combine("or", children)
+
+    def parse_and(self):
+        children = [self.parse_not()]
+        while self.peek() not in (None, "or", ")"):
+            if self.peek() == "and":
+                self.take()
+            children.append(self.parse_not())
+        return self.combine("and", children)
+
+    def parse_not(self):
+        if self.peek() == "not":
+            self.take()
+            self.enter()
+            node = self.parse_not()
+            self.depth -= 1
+            return "not", node
+        return self.parse_near()
+
+    # a NEAR/k b: слова a и b стоят не дальше k позиций друг от друга
+    def parse_near(self):
+        node = self.parse_primary()
+
+        if not is_near(self.peek()):
+            return node
+
+        distance = int(self.take()[len("near/"):])
+        right = self.parse_primary()
+
+        if node[0] != "term" or right[0] != "term":
+            raise QuerySyntaxError("NEAR связывает только отдельные слова")
+        if is_near(self.peek()):
+            raise QuerySyntaxError("NEAR связывает только два слова")
+
+        return "near", distance, node[1], right[1]
+
+    def parse_primary(self):
+        token = self.take()
+
+        if token is None:
+            raise QuerySyntaxError("запрос обрывается после оператора")
+
+        if token == "(":
+            self.enter()
+            node = self.parse_or()
+            if self.take() != ")":
+                raise QuerySyntaxError("не хватает ')'")
+            self.depth -= 1
+            return node
+
+        if token in (")", "and", "or") or is_near(token):
+            raise QuerySyntaxError(f"неожиданное '{token}'")
+
+        if token == '"':
+            raise QuerySyntaxError("не закрыта кавычка")
+
+        if token.startswith('"'):
+            return self.parse_phrase(token[1:-1])
+
+        return "term", self.to_lemma(token)
+
+    # Фраза разбивается на слова так же, как текст страниц; смещения слов
+    # учитывают отброшенные стоп-слова
+    def parse_phrase(self, text):
+        words = tokenize_with_positions(text)
+
+        if not words:
+            raise QuerySyntaxError("во фразе нет слов для поиска")
+        if len(words) == 1:
+            return "term", self.to_lemma(words[0][1])
+
+        first = words[0][0]
+        return "phrase", [(position - first, self.to_lemma(word)) for position, word in words]
+
+    # Вложенные AND/OR одного вида сливаются в один узел
+    @staticmethod
+    def combine(operator, children):
+        if len(children) == 1:
+            return children[0]
+
+        flat = []
+        for child in children:
+            if child[0] == operator:
+                flat.extend(child[1])
             else:
-                docs = set()
+                flat.append(child)
+        return operator, flat
+
+
+# Операции над списками документов: отсортированными списками номеров
+# или битовыми картами (тогда операция выполняется над контейнерами карты)
+
+def as_bitmap(docs):
+    if isinstance(docs, Bitmap):
+        return docs
+    if isinstance(docs, range):
+        return Bitmap.from_range(len(docs))
+    return Bitmap.from_sorted(docs)
+
+
+# Пересечение; если один список много короче, ищем его элементы двоичным поиском
+def intersect(a, b):
+    if isinstance(a, Bitmap) or isinstance(b, Bitmap):
+        return as_bitmap(a) & as_bitmap(b)
+
+    if len(a) > len(b):
+        a, b = b, a
+
+    result = []
+
+    if len(a) * 8 < len(b):
+        low = 0
+        for doc in a:
+            low = bisect_left(b, doc, low)
+            if low == len(b):
+                break
+            if b[low] == doc:
+                result.append(doc)
+        return result
+
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if a[i] == b[j]:
+            result.append(a[i])
+            i += 1
+            j += 1
+        elif a[i] < b[j]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+# Объединение нескольких списков слиянием
+def union(lists):
+    lists = [docs for docs in lists if docs]
+    if any(isinstance(docs, Bitmap) for docs in lists):
+        return Bitmap.union_all(as_bitmap(docs) for docs in lists)
+
+    if len(lists) == 1:
+        return list(lists[0])
+
+    result = []
+    for doc in heapq.merge(*lists):
+        if not result or result[-1] != doc:
+            result.append(doc)
+    return result
+
+
+# Разность a - b (AND NOT): документы из a, которых нет в b
+def difference(a, b):
+    if isinstance(a, Bitmap) or isinstance(b, Bitmap):
+        return as_bitmap(a) - as_bitmap(b)
 
-            expression.append(f"set({list(docs)})")
+    if not b:
+        return list(a)
 
-    final_expression = " ".join(expression)
+    result = []
 
-    try:
-        result = eval(final_expression)
-    except Exception as e:
-        print(f"Ошибка в запросе: {e}")
-        return set()
+    if len(a) * 8 < len(b):
+        low = 0
+        for doc in a:
+            low = bisect_left(b, doc, low)
+            if low == len(b) or b[low] != doc:
+                result.append(doc)
+        return result
 
+    j = 0
+    for doc in a:
+        while j < len(b) and b[j] < doc:
+            j += 1
+        if j == len(b) or b[j] != doc:
+            result.append(doc)
     return result
 
 
+# Проверка позиций
+
+POSITIONAL = ("phrase", "near")
+
+
+def positional_lemmas(node):
+    if node[0] == "phrase":
+        return [lemma for _, lemma in node[1]]
+    return [node[2], node[3]]
+
+
+# Есть ли в документе все слова фразы подряд (с учётом смещений)
+def match_phrase(offsets, positions):
+    rest = [(offset, set(docs)) for offset, docs in zip(offsets[1:], positions[1:])]
+    return any(all(start + offset in docs for offset, docs in rest)
+               for start in positions[0])
+
+
+# Есть ли пара позиций a и b на расстоянии не больше distance
+def match_near(distance, a, b):
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if abs(a[i] - b[j]) <= distance:
+            return True
+        if a[i] < b[j]:
+            i += 1
+        else:
+            j += 1
+    return False
+
+
+# Отбор кандидатов (номеров документов, уже прошедших пересечение списков)
+# по позициям слов; позиции читаются только для этих документов
+def match_positions(node, candidates, index):
+    if index.positions is None:
+        raise QueryError(f"фразы и NEAR недоступны: нет позиционного индекса {POSITIONS_FILE}")
+
+    reader = index.positions
+    numbers = {}
+
+    for doc in candidates:
+        number = reader.doc_number(index.doc_id(doc))
+        if number is not None:
+            numbers[number] = doc
+
+    lemmas = positional_lemmas(node)
+    lemma_positions = []
+
+    for lemma in lemmas:
+        positions = reader.positions(lemma, numbers.keys())
+        numbers = {number: numbers[number] for number in positions}
+        lemma_positions.append(positions)
+
+    matched = set()
+
+    for number, doc in numbers.items():
+        positions = [by_doc[number] for by_doc in lemma_positions]
+
+        if node[0] == "phrase":
+            found = match_phrase([offset for offset, _ in node[1]], positions)
+        else:
+            found = match_near(node[1], positions[0], positions[1])
+
+        if found:
+            matched.add(doc)
+
+    return [doc for doc in candidates if doc in matched]
+
+
+# Документы, где есть все слова фразы или NEAR (без проверки позиций)
+def positional_candidates(node, index):
+    return evaluate(("and", [("term", lemma) for lemma in positional_lemmas(node)]), index)
+
+
+# Вычисление дерева запроса по спискам документов индекса
+def evaluate(node, index):
+    operator = node[0]
+
+    if operator == "term":
+        return index.postings(node[1]) if node[1] else []
+
+    if operator == "or":
+        return union([evaluate(child, index) for child in node[1]])
+
+    if operator == "not":
+        # Полное дополнение нужно, только если NOT не стоит внутри AND
+        return difference(index.all_docs(), evaluate(node[1], index))
+
+    if operator in POSITIONAL:
+        return match_positions(node, positional_candidates(node, index), index)
+
+    # AND: сначала пересекаем списки от коротких к длинным,
+    # затем вычитаем отрицания (AND NOT) из уже малого результата;
+    # позиции фраз и NEAR проверяются последними — только у оставшихся документов
+    positives = [child for child in node[1] if child[0] != "not"]
+    negatives = [child[1] for child in node[1] if child[0] == "not"]
+    positional = [child for child in positives if child[0] in POSITIONAL]
+
+    if not positives:
+        return evaluate(("not", ("or", negatives)), index)
+
+    lists = sorted((positional_candidates(child, index) if child[0] in POSITIONAL
+                    else evaluate(child, index) for child in positives), key=len)
+    result = lists[0]
+
+    for docs in lists[1:]:
+        if not result:
+            return []
+        result = intersect(result, docs)
+
+    for child in negatives:
+        if not result:
+            return []
+        result = difference(result, evaluate(child, index))
+
+    for child in positional:
+        if not result:
+            return []
+        result = match_positions(child, result, index)
+
+    return result
+
+
+# Булев поиск: doc_id найденных документов в порядке индекса.
+# Слова запроса приводятся к леммам общим анализатором запросов (query_analyzer.py).
+# Ошибка в запросе — QueryError: вызывающий отличает её от пустой выдачи
+def boolean_search(query, index, analyzer=None):
+    analyzer = analyzer or get_query_analyzer()
+
+    tree = QueryParser(tokenize_query(query), analyzer.lemma).parse()
+    return [index.doc_id(doc) for doc in evaluate(tree, index)]
 
 
 def main():
@@ -151,16 +651,22 @@ def main():
     index = build_inverted_index()
     save_index(index)
 
-    token_to_lemma = load_token_to_lemma()
+    # Позиционный индекс для фраз и NEAR
+    build_positional_index()
+
+    # Словарь токен -> лемма для разбора запросов
+    save_lexicon(build_lexicon(PAGE_TERMS_DIR))
+
+    # Сегменты инкрементального индекса (если есть) пересоздаются по новому индексу
+    reset_segments()
 
     print("[+] Индекс построен и сохранён")
 
     # Загружаем индекс и URL
     index = load_index()
-    doc_urls = load_doc_urls()
-    all_docs = set(doc_urls.keys())
 
-    print("\nВведите запрос с операторами AND, OR, NOT. Для выхода введите 'exit'.")
+    print("\nВведите запрос с операторами AND, OR, NOT, NEAR/k и фразами в кавычках. "
+          "Для выхода введите 'exit'.")
 
     while True:
         query = input("\nЗапрос: ")
@@ -168,13 +674,20 @@ def main():
         if query.lower() == "exit":
             break
 
-        result = boolean_search(query, index, all_docs, token_to_lemma)
+        # Сегменты могли обновиться — берём свежий снимок
+        index = index.refresh()
+
+        try:
+            result = boolean_search(query, index)
+        except QueryError as e:
+            print(f"Ошибка в запросе: {e}")
+            continue
 
         print("\nНайденные ссылки:")
 
         if result:
-            for doc_id in sorted(result):
-                print(doc_urls.get(doc_id, "URL не найден"))
+            for doc_id in result:
+                print(index.doc_urls.get(doc_id, "URL не найден"))
         else:
             print("Ничего не найдено")
 
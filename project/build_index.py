@@ -0,0 +1,265 @@
+import argparse
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+import boolean_search
+import metrics
+import positional_index
+import text_processing
+import tfidf
+from external_build import MEMORY_BUDGET, RunWriter, remove_runs, write_indexes_from_runs
+from index_format import INDEX_BIN_FILE, doc_sort_key, write_index
+from lemmatizer import get_lemmatizer
+from query_analyzer import add_page_lemmas, save_lexicon
+from segments import reset_segments
+
+# Сборка всех индексов за один проход по документам.
+#
+# Каждая страница читается и разбирается один раз (text_processing.analyze_document),
+# а из результата сразу накапливаются инвертированный индекс, словарь токен -> лемма,
+# DF терминов и лемм и позиции. Файлы page_terms тоже пишутся, чтобы отдельные
+# скрипты заданий 2–4 продолжали работать, но друг друга они больше не перечитывают.
+
+WORKERS = text_processing.WORKERS  # Процессы для разбора документов
+CHUNK_SIZE = text_processing.CHUNK_SIZE
+PROGRESS_EVERY = 100  # Как часто печатать прогресс (документов)
+
+# Этапы сборки для итогового отчёта
+BUILD_STAGES = {
+    "analyze": "разбор документов",
+    "merge": "слияние прогонов",
+    "inverted": "инвертированный индекс",
+    "positions": "позиционный индекс",
+    "tfidf": "TF-IDF",
+    "binary": "бинарный индекс",
+    "archives": "архивы",
+    "segments": "сегменты",
+}
+
+
+# Задача для пула процессов: разбор страницы и запись её файлов в page_terms
+def analyze_task(args):
+    doc_id, file_path = args
+    terms, timings = text_processing.analyze_document(doc_id, file_path)
+
+    started = time.perf_counter()
+    text_processing.write_document_files(doc_id, terms)
+    timings["write"] = time.perf_counter() - started
+
+    return terms, timings, get_lemmatizer().take_new_entries()
+
+
+# Список страниц для сборки в порядке doc_id; файлы удалённых краулером
+# документов убираются из page_terms. Очередь изменений забирается до сборки:
+# изменения, пришедшие во время неё, останутся в очереди до следующего запуска
+def collect_tasks():
+    changes = text_processing.claim_changed_docs() or {}
+
+    for doc_id, kind in changes.items():
+        if kind == "deleted":
+            text_processing.remove_document(doc_id)
+
+    doc_ids = sorted(
+        (filename[:-len(".txt")] for filename in os.listdir(text_processing.PAGES_DIR)
+         if filename.endswith(".txt")),
+        key=doc_sort_key,
+    )
+
+    # Лишние файлы page_terms (документов, которых больше нет) не должны попасть
+    # в отдельные скрипты заданий 3–4
+    known = set(doc_ids)
+    for filename in os.listdir(text_processing.OUTPUT_DIR):
+        doc_id = filename.split("_")[0]
+        if doc_id not in known:
+            text_processing.remove_document(doc_id)
+
+    return [(doc_id, os.path.join(text_processing.PAGES_DIR, f"{doc_id}.txt")) for doc_id in doc_ids]
+
+
+def print_build_report(stage_times, elapsed):
+    print(f"\nСборка индексов: {elapsed:.2f} с")
+    for stage, name in BUILD_STAGES.items():
+        if stage in stage_times:
+            print(f"  {name:<24} {stage_times[stage]:8.2f} с")
+
+
+# Файлы TF-IDF документов по сохранённым page_terms: по одному документу за раз
+def write_tfidf_from_page_terms(doc_ids, term_idf, lemma_idf):
+    for doc_id in doc_ids:
+        term_counts, length = tfidf.load_page_tf(doc_id)
+        lemma_counts = tfidf.count_lemmas(tfidf.load_page_lemmas(doc_id), term_counts)
+        tfidf.write_doc_tfidf(doc_id, term_counts, lemma_counts, length, term_idf, lemma_idf)
+
+
+def build(workers=WORKERS, chunksize=CHUNK_SIZE, external=False, memory_budget=MEMORY_BUDGET):
+    """
+    external=True — сборка во внешней памяти (external_build.py): леммы документов
+    сбрасываются на диск отсортированными прогонами по memory_budget байт
+    и сливаются в итоговые индексы. В памяти остаются только таблица документов
+    и словари (DF терминов, токен -> лемма), а не векторы всех документов.
+    """
+    os.makedirs(text_processing.OUTPUT_DIR, exist_ok=True)
+    tfidf.create_output_dirs()
+
+    build_started = time.perf_counter()
+    stage_times = {}
+
+    # 1. Разбор документов: единственный проход по страницам
+    started = time.perf_counter()
+    tasks = collect_tasks()
+    workers = max(1, min(workers, len(tasks)))
+
+    lexicon = {}
+    term_df = defaultdict(int)
+    doc_lengths = []
+
+    runs = RunWriter(memory_budget=memory_budget) if external else None
+    inverted_index = defaultdict(set)
+    doc_positions = []
+    doc_counts = {}
+    lemma_df = defaultdict(int)
+
+    analyze_totals = defaultdict(float)
+    tokens_count = 0
+
+    lemmatizer = get_lemmatizer()
+
+    # Пул закрывается и при ошибке в одном из документов
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    with executor or nullcontext():
+        if executor is not None:
+            results = executor.map(analyze_task, tasks, chunksize=chunksize)
+        else:
+            results = map(analyze_task, tasks)
+
+        for done, ((doc_id, _), (terms, timings, lemma_entries)) in enumerate(zip(tasks, results), 1):
+            for stage, value in timings.items():
+                analyze_totals[stage] += value
+                metrics.observe("document_stage_seconds", value, stage=stage)
+            metrics.inc("documents_processed_total")
+            tokens_count += terms["length"]
+            lemmatizer.merge(lemma_entries)
+
+            term_counts = terms["token_counts"]
+
+            add_page_lemmas(lexicon, terms["lemmas"])
+
+            for term in term_counts:
+                term_df[term] += 1
+
+            doc_lengths.append(terms["length"])
+
+            if runs is not None:
+                runs.add_document(done - 1, terms["positions"])
+            else:
+                lemma_counts = tfidf.count_lemmas(terms["lemmas"], term_counts)
+
+                for lemma in lemma_counts:
+                    inverted_index[lemma].add(doc_id)
+                    lemma_df[lemma] += 1
+
+                doc_counts[doc_id] = (term_counts, lemma_counts, terms["length"])
+                doc_positions.append((doc_id, terms["positions"]))
+
+            if done % PROGRESS_EVERY == 0 or done == len(tasks):
+                print(f"[+] Обработано документов: {done}/{len(tasks)}")
+
+    lemmatizer.save_cache()
+    stage_times["analyze"] = time.perf_counter() - started
+
+    text_processing.print_timing_report(analyze_totals, len(tasks), tokens_count, workers,
+                                        stage_times["analyze"])
+
+    doc_ids = [doc_id for doc_id, _ in tasks]
+    term_idf = tfidf.compute_idf(term_df, len(doc_ids))
+
+    if runs is not None:
+        # 2. Слияние прогонов сразу в inverted_index.txt, positions.bin и index.bin
+        started = time.perf_counter()
+        run_paths = runs.close()
+        print(f"[+] Отсортированных прогонов на диске: {len(run_paths)}")
+
+        lemma_idf = write_indexes_from_runs(run_paths, doc_ids, doc_lengths, tfidf.load_doc_urls())
+        remove_runs()
+        save_lexicon(lexicon)
+        stage_times["merge"] = time.perf_counter() - started
+        print(f"[+] Индексы собраны слиянием прогонов: {boolean_search.INDEX_FILE}, "
+              f"{positional_index.POSITIONS_FILE}, {INDEX_BIN_FILE} ({len(lemma_idf)} лемм)")
+
+        # 3. TF-IDF документов: частоты перечитываются из page_terms по одному документу
+        started = time.perf_counter()
+        write_tfidf_from_page_terms(doc_ids, term_idf, lemma_idf)
+        stage_times["tfidf"] = time.perf_counter() - started
+        print(f"[+] TF-IDF сохранён в папке: {tfidf.OUTPUT_DIR}")
+    else:
+        # 2. Инвертированный индекс и словарь токен -> лемма для разбора запросов
+        started = time.perf_counter()
+        boolean_search.save_index(inverted_index)
+        save_lexicon(lexicon)
+        stage_times["inverted"] = time.perf_counter() - started
+        print(f"[+] Инвертированный индекс сохранён: {boolean_search.INDEX_FILE} ({len(inverted_index)} лемм)")
+
+        # 3. Позиционный индекс
+        started = time.perf_counter()
+        positional_index.write_document_positions(positional_index.POSITIONS_FILE, doc_positions)
+        stage_times["positions"] = time.perf_counter() - started
+        print(f"[+] Позиционный индекс сохранён: {positional_index.POSITIONS_FILE}")
+
+        # 4. IDF и TF-IDF документов
+        started = time.perf_counter()
+        lemma_idf = tfidf.compute_idf(lemma_df, len(doc_ids))
+
+        lemma_vectors = {}
+
+        for doc_id, (term_counts, lemma_counts, length) in doc_counts.items():
+            lemma_vectors[doc_id] = tfidf.write_doc_tfidf(doc_id, term_counts, lemma_counts, length,
+                                                          term_idf, lemma_idf)
+        stage_times["tfidf"] = time.perf_counter() - started
+        print(f"[+] TF-IDF сохранён в папке: {tfidf.OUTPUT_DIR}")
+
+        # 5. Бинарный индекс для векторного и булева поиска
+        started = time.perf_counter()
+        write_index(INDEX_BIN_FILE, lemma_vectors, lemma_idf, tfidf.load_doc_urls(),
+                    dict(zip(doc_ids, doc_lengths)))
+        stage_times["binary"] = time.perf_counter() - started
+        print(f"[+] Бинарный индекс сохранён: {INDEX_BIN_FILE}")
+
+    started = time.perf_counter()
+    tfidf.create_archive(tfidf.TERMS_DIR, tfidf.ARCHIVE_TERMS_FILE)
+    tfidf.create_archive(tfidf.LEMMAS_DIR, tfidf.ARCHIVE_LEMMAS_FILE)
+    stage_times["archives"] = time.perf_counter() - started
+
+    # Забранные изменения краулера учтены полной сборкой
+    text_processing.finish_changed_docs()
+
+    # Сегменты инкрементального индекса (если есть) пересоздаются по новой сборке
+    started = time.perf_counter()
+    reset_segments()
+    stage_times["segments"] = time.perf_counter() - started
+
+    for stage, value in stage_times.items():
+        metrics.observe("build_stage_seconds", value, stage=stage)
+
+    print_build_report(stage_times, time.perf_counter() - build_started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка всех индексов за один проход")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--external", action="store_true",
+                        help="сборка во внешней памяти: отсортированные прогоны на диске")
+    parser.add_argument("--memory-budget", type=int, default=MEMORY_BUDGET // (1024 * 1024),
+                        help="размер буфера прогона в МБ (для --external)")
+    args = parser.parse_args()
+
+    build(args.workers, args.chunksize, args.external, args.memory_budget * 1024 * 1024)
+    metrics.write_summary("build_index", {"workers": args.workers, "external": args.external})
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,17 @@
 import os
+import json
+import codecs
+import hashlib
+import threading
 import requests
-from bs4 import BeautifulSoup
-from langdetect import detect
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from langdetect import detect, DetectorFactory
+from langdetect.detector_factory import init_factory
+from parsing import make_soup
+import metrics
 import time
 import zipfile
 
@@ -9,10 +19,19 @@ import zipfile
 
 URLS_FILE = "../urls.txt"  # Файл со списком URL для скачивания
 OUTPUT_DIR = "../pages"  # Папка для сохранения скачанных страниц
+TEXT_DIR = "../pages_text"  # Папка для извлечённого текста страниц
 INDEX_FILE = "../index.txt"  # Файл для записи соответствия номера файла и URL
+CRAWL_STATE_FILE = "../crawl_state.json"  # Состояние обхода между запусками
+CHANGED_DOCS_FILE = "../changed_docs.txt"  # Новые/изменённые/удалённые doc_id для text_processing
+STATE_SAVE_EVERY = 20  # Как часто сохранять состояние (в обработанных URL)
 MIN_PAGES = 100  # Минимальное количество страниц для скачивания
-TIMEOUT = 60  # Таймаут запроса в секундах
-DELAY = 1  # Задержка между запросами (сек)
+TIMEOUT = 60  # Таймаут чтения из сокета в секундах
+CONNECT_TIMEOUT = 10  # Таймаут установки соединения в секундах
+FETCH_DEADLINE = 120  # Общее время на скачивание одной страницы (сек)
+MAX_PAGE_SIZE = 5 * 1024 * 1024  # Максимальный размер страницы (байт)
+CHUNK_SIZE = 64 * 1024  # Размер блока при потоковом чтении (байт)
+DELAY = 1  # Минимальный интервал между запросами к одному хосту (сек)
+CONCURRENCY = 8  # Количество одновременных загрузок
 ARCHIVE_FILE = "../pages.zip"  # Имя архива для сохраненных страниц
 
 # User-Agent нужен, чтобы сервер не блокировал запросы
@@ -22,6 +41,14 @@ HEADERS = {
                   "Chrome/120.0.0.0 Safari/537.36"
 }
 
+# langdetect по умолчанию недетерминирован — фиксируем seed,
+# чтобы повторный запуск давал тот же язык и те же номера документов
+DetectorFactory.seed = 0
+
+# Профили языков загружаются лениво и без блокировки — при параллельной
+# загрузке страниц потоки ломают друг другу инициализацию, поэтому грузим сразу
+init_factory()
+
 
 # Проверка, что ответ сервера — HTML
 def is_html(response):
@@ -29,10 +56,8 @@ def is_html(response):
     return "text/html" in content_type
 
 
-# Определение языка страницы
-def get_page_language(html):
-    soup = BeautifulSoup(html, "html.parser")
-    text = soup.get_text()
+# Определение языка по тексту страницы
+def get_page_language(text):
     if len(text.strip()) < 200:
         return None
     try:
@@ -41,10 +66,8 @@ def get_page_language(html):
         return None
 
 
-# Очистка HTML: удаление JS, CSS и изображений
-def remove_js_css_images(html_content):
-    soup = BeautifulSoup(html_content, "html.parser")
-
+# Очистка HTML: удаление JS, CSS и изображений (дерево меняется на месте)
+def remove_js_css_images(soup):
     # Удаляем теги <script>
     for script in soup.find_all("script"):
         script.decompose()
@@ -57,7 +80,15 @@ def remove_js_css_images(html_content):
     for img in soup.find_all("img"):
         img.decompose()
 
-    return str(soup)
+
+# Разбор страницы за один проход: очищенный HTML, видимый текст и язык
+def parse_page(html_content):
+    soup = make_soup(html_content)
+    remove_js_css_images(soup)
+
+    text = soup.get_text(separator=" ")
+
+    return str(soup), text, get_page_language(text)
 
 
 # Создание архива ZIP с выкаченными страницами
@@ -69,72 +100,397 @@ def create_archive(directory, archive_name):
     print(f"[+] Archive created: {archive_name}")
 
 
-def main():
-    # Создаём папку для страниц, если её нет
-    if not os.path.exists(OUTPUT_DIR):
-        os.makedirs(OUTPUT_DIR)
+# Ограничение частоты запросов отдельно для каждого хоста
+class HostRateLimiter:
+    def __init__(self, delay):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.next_time = {}  # хост -> время, раньше которого нельзя отправлять запрос
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+
+        # Резервируем ближайший свободный слот для хоста
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_time.get(host, now))
+            self.next_time[host] = slot + self.delay
+
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# Сессия с пулом соединений (keep-alive) на все потоки
+def create_session(concurrency):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(HEADERS)
+    return session
+
+
+# Загрузка состояния обхода (URL -> doc_id, ETag, Last-Modified, хеш, статус)
+def load_crawl_state(path):
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    return {
+        "next_doc_id": 1,
+        "base_language": None,
+        "run": 0,  # номер текущего прохода
+        "run_complete": True,  # False — предыдущий проход прервался, его надо продолжить
+        "pages": {},
+    }
+
+
+# Атомарное сохранение: сначала во временный файл, затем замена
+def save_crawl_state(state, path):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+# index.txt пересобирается из состояния: номера документов не меняются между запусками
+def write_index_file(state, path):
+    docs = [
+        (page["doc_id"], url)
+        for url, page in state["pages"].items()
+        if page.get("status") == "ok"
+    ]
+
+    with open(path, "w", encoding="utf-8") as f:
+        for doc_id, url in sorted(docs):
+            f.write(f"{doc_id} {url}\n")
+
+
+# Добавление изменённых документов в очередь для text_processing
+def save_changed_docs(changes, path):
+    """
+    Формат файла: <doc_id> <updated|deleted>.
+    Файл накапливает изменения между запусками краулера
+    и очищается, когда text_processing их обработает.
+    """
+    merged = {}
+
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2:
+                    merged[parts[0]] = parts[1]
+
+    merged.update(changes)
+
+    # Файл заменяется атомарно: обработчики забирают очередь переименованием
+    # (text_processing.claim_changed_docs) и не должны застать её недописанной
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for doc_id in sorted(merged, key=int):
+            f.write(f"{doc_id} {merged[doc_id]}\n")
+    os.replace(tmp_path, path)
+
+
+# Потоковое чтение тела ответа с ограничением размера и общего времени
+def read_page_body(response, started):
+    """
+    Тело читается блоками и декодируется по мере получения,
+    поэтому в памяти не бывает больше одной копии страницы.
+    Возвращает (текст, sha256 текста, ошибка).
+    """
+    content_length = response.headers.get("Content-Length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_PAGE_SIZE:
+        return None, None, f"Page too large ({content_length} bytes)"
+
+    decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+    digest = hashlib.sha256()
+    parts = []
+    size = 0
+
+    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+        size += len(chunk)
+        if size > MAX_PAGE_SIZE:
+            return None, None, f"Page too large (> {MAX_PAGE_SIZE} bytes)"
+
+        if time.monotonic() - started > FETCH_DEADLINE:
+            return None, None, f"Download took longer than {FETCH_DEADLINE} s"
+
+        part = decoder.decode(chunk)
+        digest.update(part.encode("utf-8"))
+        parts.append(part)
+
+    part = decoder.decode(b"", final=True)
+    digest.update(part.encode("utf-8"))
+    parts.append(part)
+
+    return "".join(parts), digest.hexdigest(), None
+
+
+# Загрузка и обработка одной страницы (выполняется в потоке пула)
+def fetch_page(session, limiter, url, previous=None):
+    """
+    previous — запись о странице из прошлого обхода.
+    По ней отправляется условный запрос (If-None-Match / If-Modified-Since),
+    а неизменившаяся страница не разбирается повторно.
+    """
+    result = {
+        "url": url, "error": None, "status_code": None, "unchanged": False,
+        "etag": None, "last_modified": None, "hash": None,
+        "language": None, "html": None, "text": None,
+    }
+    previous = previous or {}
+
+    headers = {}
+    if previous.get("etag"):
+        headers["If-None-Match"] = previous["etag"]
+    if previous.get("last_modified"):
+        headers["If-Modified-Since"] = previous["last_modified"]
 
-    # Читаем список URL из файла
-    with open(URLS_FILE, "r", encoding="utf-8") as f:
-        urls = [line.strip() for line in f if line.strip()]
+    try:
+        limiter.wait(url)
+        started = time.monotonic()
+
+        # stream=True: сначала получаем только заголовки, тело читаем отдельно
+        with session.get(url, headers=headers, timeout=(CONNECT_TIMEOUT, TIMEOUT),
+                         stream=True) as response:
+            result["status_code"] = response.status_code
+
+            if response.status_code == 304:
+                result["unchanged"] = True
+                return result
+
+            if response.status_code != 200:
+                result["error"] = f"Status code {response.status_code} for {url}"
+                return result
+
+            result["etag"] = response.headers.get("ETag")
+            result["last_modified"] = response.headers.get("Last-Modified")
+
+            # Не HTML — закрываем соединение, не скачивая тело
+            if not is_html(response):
+                result["error"] = f"Not HTML page for {url}"
+                return result
+
+            html_content, result["hash"], error = read_page_body(response, started)
+
+        metrics.observe("crawl_stage_seconds", time.monotonic() - started, stage="fetch")
+
+        if error is not None:
+            result["error"] = f"{error} for {url}"
+            return result
+
+        # Содержимое не изменилось — разбирать страницу не нужно
+        if result["hash"] == previous.get("hash"):
+            result["unchanged"] = True
+            return result
+
+        # Страница разбирается один раз: очистка, текст и язык из одного дерева
+        with metrics.timer("crawl_stage_seconds", stage="parse"):
+            result["html"], result["text"], result["language"] = parse_page(html_content)
+
+    except Exception as e:
+        result["error"] = f"Error with {url}: {e}"
+
+    return result
+
+
+def crawl(urls, output_dir=OUTPUT_DIR, index_path=INDEX_FILE, text_dir=TEXT_DIR,
+          state_path=CRAWL_STATE_FILE, changes_path=CHANGED_DOCS_FILE,
+          min_pages=MIN_PAGES, concurrency=CONCURRENCY, delay=DELAY):
+    """
+    Скачивает страницы параллельно, но обрабатывает результаты
+    строго в порядке urls, поэтому номера документов в index.txt
+    не зависят от того, какой ответ пришёл первым.
+
+    Состояние обхода хранится в state_path: известные страницы
+    перепроверяются условными запросами, новые скачиваются, пока
+    не набрано min_pages документов. Прерванный проход при повторном
+    запуске продолжается с места остановки.
+    Возвращает количество документов в коллекции.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(text_dir, exist_ok=True)
+
+    state = load_crawl_state(state_path)
+    pages = state["pages"]
+
+    # Новый проход начинаем, только если предыдущий был завершён
+    if state["run_complete"]:
+        state["run"] += 1
+        state["run_complete"] = False
+    run = state["run"]
 
-    saved_count = 0
-    base_language = None # Язык первой страницы, чтобы все страницы были одного языка
+    saved_count = sum(1 for page in pages.values() if page.get("status") == "ok")
+    changes = {}  # doc_id -> updated | deleted
+    processed = 0
 
-    # Открываем index.txt для записи соответствия файла и URL
-    with open(INDEX_FILE, "w", encoding="utf-8") as index_file:
-        for url in urls:
-            if saved_count >= MIN_PAGES:
-                break
+    def save_progress():
+        save_crawl_state(state, state_path)
+        write_index_file(state, index_path)
+        save_changed_docs(changes, changes_path)
 
-            try:
-                response = requests.get(url, headers=HEADERS, timeout=TIMEOUT)
-                if response.status_code != 200:
-                    print(f"[!] Status code {response.status_code} for {url}")
+    def is_known(url):
+        return pages.get(url, {}).get("status") == "ok"
+
+    session = create_session(concurrency)
+    limiter = HostRateLimiter(delay)
+
+    # Окно задач: загружаем вперёд не больше 2 * concurrency страниц
+    url_iter = iter(urls)
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+        def submit_next():
+            for url in url_iter:
+                # Уже проверена в этом (прерванном) проходе
+                if pages.get(url, {}).get("run") == run:
                     continue
 
-                if not is_html(response):
-                    print(f"[!] Not HTML page for {url}")
+                # Новые страницы нужны, только пока не набрано min_pages
+                if not is_known(url) and saved_count >= min_pages:
                     continue
 
-                html_content = response.text
-                page_language = get_page_language(html_content)
+                # Валидаторы удалённой страницы не годятся: её нужно скачать заново
+                previous = pages.get(url, {})
+                if previous.get("status") not in ("ok", "skipped"):
+                    previous = {}
+
+                pending.append(executor.submit(fetch_page, session, limiter, url, dict(previous)))
+                return
+
+        for _ in range(concurrency * 2):
+            submit_next()
+
+        while pending:
+            result = pending.popleft().result()
+            submit_next()
+
+            url = result["url"]
+            page = pages.setdefault(url, {"doc_id": None, "status": None})
+            known = page["status"] == "ok"
+            doc_id = page["doc_id"]
+
+            processed += 1
+            if processed % STATE_SAVE_EVERY == 0:
+                save_progress()
+
+            if result["unchanged"]:
+                metrics.inc("crawl_pages_total", outcome="unchanged")
+                page["run"] = run
+                if result["etag"] or result["last_modified"]:
+                    page["etag"] = result["etag"]
+                    page["last_modified"] = result["last_modified"]
+                if known:
+                    print(f"[=] Not modified {doc_id}: {url}")
+                continue
 
-                if page_language is None:
-                    print(f"[!] Page language not found for {url}")
-                    continue
+            if result["error"] is not None:
+                print(f"[!] {result['error']}")
+                gone = known and result["status_code"] in (404, 410)
+                metrics.inc("crawl_pages_total", outcome="deleted" if gone else "error")
+
+                # Страница удалена с сайта — убираем её из коллекции
+                if gone:
+                    page["status"] = "gone"
+                    page["run"] = run
+                    changes[str(doc_id)] = "deleted"
+                    saved_count -= 1
+                    for directory in (output_dir, text_dir):
+                        file_path = os.path.join(directory, f"{doc_id}.txt")
+                        if os.path.exists(file_path):
+                            os.remove(file_path)
+                elif not known and result["status_code"] is not None:
+                    page["status"] = "skipped"
+                    page["run"] = run
+                continue
 
-                if base_language is None:
-                    base_language = page_language # Запоминаем язык первой страницы
+            page["run"] = run
 
-                if page_language != base_language:
-                    print(f"[!] Page language mismatch for {url}")
+            page_language = result["language"]
+
+            if page_language is None:
+                print(f"[!] Page language not found for {url}")
+                metrics.inc("crawl_pages_total", outcome="skipped")
+                if not known:
+                    page["status"] = "skipped"
+                continue
+
+            if state["base_language"] is None:
+                state["base_language"] = page_language  # Запоминаем язык первой страницы
+
+            if page_language != state["base_language"]:
+                print(f"[!] Page language mismatch for {url}")
+                metrics.inc("crawl_pages_total", outcome="skipped")
+                if not known:
+                    page["status"] = "skipped"
+                continue
+
+            if not known:
+                # Лишняя страница, скачанная заранее, пока набирался min_pages
+                if saved_count >= min_pages:
+                    metrics.inc("crawl_pages_total", outcome="extra")
+                    del pages[url]
                     continue
 
-                clean_html = remove_js_css_images(html_content)
+                # Новая страница получает следующий свободный номер
+                if doc_id is None:
+                    doc_id = state["next_doc_id"]
+                    state["next_doc_id"] += 1
+                    page["doc_id"] = doc_id
 
-                # Увеличиваем счётчик сохранённых страниц
+                page["status"] = "ok"
                 saved_count += 1
-                file_path = os.path.join(OUTPUT_DIR, f"{saved_count}.txt")
 
-                # Сохраняем очищенную страницу
-                with open(file_path, "w", encoding="utf-8") as page_file:
-                    page_file.write(clean_html)
+            # Страница принята: запоминаем валидаторы для следующих условных запросов.
+            # У отклонённой страницы они остаются прежними, иначе следующий запрос
+            # получил бы 304 и её новое содержимое больше не проверялось бы
+            page["etag"] = result["etag"]
+            page["last_modified"] = result["last_modified"]
+            page["hash"] = result["hash"]
 
-                # Записываем в index.txt номер файла и URL
-                index_file.write(f"{saved_count} {url}\n")
-                time.sleep(DELAY) # Пауза между запросами, чтобы сервер не блокировал
+            file_path = os.path.join(output_dir, f"{doc_id}.txt")
 
-                print(f"[+] Saved {saved_count}: {url}")
+            # Сохраняем очищенную страницу
+            with open(file_path, "w", encoding="utf-8") as page_file:
+                page_file.write(result["html"])
 
-            except Exception as e:
-                print(f"[!] Error with {url}: {e}")
-                continue
+            # Рядом сохраняем извлечённый текст, чтобы text_processing не разбирал HTML повторно
+            with open(os.path.join(text_dir, f"{doc_id}.txt"), "w", encoding="utf-8") as text_file:
+                text_file.write(result["text"])
+
+            changes[str(doc_id)] = "updated"
+            metrics.inc("crawl_pages_total", outcome="updated" if known else "saved")
+
+            print(f"[+] {'Updated' if known else 'Saved'} {doc_id}: {url}")
+
+    session.close()
+
+    state["run_complete"] = True
+    save_progress()
+
+    print(f"[+] Новых или изменённых документов: "
+          f"{sum(1 for kind in changes.values() if kind == 'updated')}, "
+          f"удалённых: {sum(1 for kind in changes.values() if kind == 'deleted')}")
+
+    return saved_count
+
+
+def main():
+    # Читаем список URL из файла
+    with open(URLS_FILE, "r", encoding="utf-8") as f:
+        urls = [line.strip() for line in f if line.strip()]
+
+    saved_count = crawl(urls)
 
     print(f"Сохранено страниц: {saved_count}")
 
     create_archive(OUTPUT_DIR, ARCHIVE_FILE)
 
+    metrics.write_summary("crawler", {"saved_pages": saved_count})
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,192 @@
+import heapq
+import math
+import os
+import shutil
+from array import array
+from itertools import groupby
+
+import boolean_search
+from index_format import INDEX_BIN_FILE, IndexWriter
+from positional_index import POSITIONS_FILE, PositionalIndexWriter
+
+# Сборка индекса во внешней памяти.
+#
+# Вместо словарей на всю коллекцию записи (лемма, номер документа, позиции)
+# копятся в буфере; когда его размер достигает memory_budget, буфер сортируется
+# и сбрасывается на диск отдельным отсортированным прогоном. В конце прогоны
+# сливаются k-путевым слиянием (heapq.merge): если их больше MERGE_FAN_IN, сначала
+# по MERGE_FAN_IN за раз в промежуточные прогоны, чтобы число открытых файлов
+# не росло с размером коллекции. Затем документы каждой леммы по одному
+# уходят в потоковые писатели index.bin, positions.bin и inverted_index.txt.
+# В памяти остаются таблицы документов и словарь, а для текущей леммы — только
+# номера документов и веса в компактных массивах (позиции сразу пишутся на диск),
+# поэтому размер коллекции ограничен диском, а не RAM.
+
+RUNS_DIR = "../build_runs"  # Временная папка для отсортированных прогонов
+MEMORY_BUDGET = 256 * 1024 * 1024  # Сколько байт может занимать буфер прогона
+MERGE_FAN_IN = 64  # Сколько прогонов сливается за раз (столько файлов открыто одновременно)
+
+
+# Примерный объём записи в памяти Python (байт): кортеж, список и числа позиций
+def record_size(positions):
+    return 160 + 36 * len(positions)
+
+
+class RunWriter:
+    """
+    Накопление записей (лемма, номер документа, позиции) со сбросом
+    отсортированных прогонов на диск. Строка прогона:
+        <лемма> <номер документа> <позиция1> <позиция2> ...
+    """
+
+    def __init__(self, runs_dir=RUNS_DIR, memory_budget=MEMORY_BUDGET, fan_in=MERGE_FAN_IN):
+        self.runs_dir = runs_dir
+        self.memory_budget = memory_budget
+        self.fan_in = fan_in
+        self.buffer = []
+        self.buffer_size = 0
+        self.paths = []
+
+        shutil.rmtree(runs_dir, ignore_errors=True)
+        os.makedirs(runs_dir)
+
+    # lemma_positions — лемма -> позиции леммы в документе doc
+    def add_document(self, doc, lemma_positions):
+        for lemma, positions in lemma_positions.items():
+            self.buffer.append((lemma, doc, positions))
+            self.buffer_size += record_size(positions)
+
+        if self.buffer_size >= self.memory_budget:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+
+        self.buffer.sort(key=lambda record: (record[0], record[1]))
+
+        path = os.path.join(self.runs_dir, f"run_{len(self.paths):05d}.txt")
+        write_run(path, self.buffer)
+
+        self.paths.append(path)
+        self.buffer = []
+        self.buffer_size = 0
+
+    # Прогоны для итогового слияния: не больше fan_in
+    def close(self):
+        self.flush()
+        return reduce_runs(self.paths, self.runs_dir, self.fan_in)
+
+
+def write_run(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for lemma, doc, positions in records:
+            f.write(f"{lemma} {doc} " + " ".join(map(str, positions)) + "\n")
+
+
+def read_run(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            yield parts[0], int(parts[1]), [int(position) for position in parts[2:]]
+
+
+# k-путевое слияние прогонов: записи по возрастанию (лемма, номер документа)
+def merge_records(paths):
+    return heapq.merge(*(read_run(path) for path in paths),
+                       key=lambda record: (record[0], record[1]))
+
+
+# Слияние прогонов проходами по fan_in в промежуточные прогоны, пока их больше fan_in.
+# Возвращает оставшиеся прогоны; слитые удаляются
+def reduce_runs(paths, runs_dir, fan_in=MERGE_FAN_IN):
+    level = 0
+
+    while len(paths) > fan_in:
+        level += 1
+        merged = []
+
+        for start in range(0, len(paths), fan_in):
+            group = paths[start:start + fan_in]
+            if len(group) == 1:
+                merged.append(group[0])
+                continue
+
+            path = os.path.join(runs_dir, f"merge_{level:02d}_{len(merged):05d}.txt")
+            write_run(path, merge_records(group))
+            for source in group:
+                os.remove(source)
+            merged.append(path)
+
+        paths = merged
+
+    return paths
+
+
+# Итоговое слияние прогонов: (лемма, итератор пар (номер документа, позиции))
+# по возрастанию лемм. Пары читаются из прогонов по мере обхода итератора, поэтому
+# его нужно пройти до перехода к следующей лемме
+def merge_runs(paths):
+    for lemma, group in groupby(merge_records(paths), key=lambda record: record[0]):
+        yield lemma, ((doc, positions) for _, doc, positions in group)
+
+
+def remove_runs(runs_dir=RUNS_DIR):
+    shutil.rmtree(runs_dir, ignore_errors=True)
+
+
+# Запись индексов из прогонов.
+# doc_ids и doc_lengths — списки по номерам документов, doc_urls — doc_id -> URL.
+# Возвращает idf лемм (нужен для файлов TF-IDF документов)
+def write_indexes_from_runs(paths, doc_ids, doc_lengths, doc_urls):
+    total_docs = len(doc_ids)
+
+    # Слияние 1: idf лемм и нормы векторов документов
+    lemma_idf = {}
+    norms = [0.0] * total_docs
+
+    for lemma, postings in merge_runs(paths):
+        # idf известен только после всех документов леммы: до него копятся номера и tf
+        docs = array("I")
+        tfs = array("d")
+        for doc, positions in postings:
+            length = doc_lengths[doc]
+            docs.append(doc)
+            tfs.append(len(positions) / length if length > 0 else 0.0)
+
+        idf = math.log(total_docs / len(docs))
+        lemma_idf[lemma] = idf
+
+        for doc, tf in zip(docs, tfs):
+            weight = tf * idf
+            norms[doc] += weight * weight
+
+    # Слияние 2: потоковая запись списков документов
+    index_writer = IndexWriter(INDEX_BIN_FILE)
+    positions_writer = PositionalIndexWriter(POSITIONS_FILE)
+
+    for doc, doc_id in enumerate(doc_ids):
+        index_writer.add_document(doc_id, doc_urls.get(doc_id, ""), doc_lengths[doc], norms[doc] ** 0.5)
+        positions_writer.add_document(doc_id)
+
+    with open(boolean_search.INDEX_FILE, "w", encoding="utf-8") as inverted:
+        for lemma, postings in merge_runs(paths):
+            idf = lemma_idf[lemma]
+            docs = array("I")
+            weights = array("d")
+
+            positions_writer.start_term(lemma)
+            for doc, positions in postings:
+                length = doc_lengths[doc]
+                docs.append(doc)
+                weights.append(len(positions) / length * idf if length > 0 else 0.0)
+                positions_writer.add_posting(doc, positions)
+            positions_writer.finish_term()
+
+            index_writer.add_term(lemma, idf, docs, weights)
+            inverted.write(lemma + " " + " ".join(sorted(doc_ids[doc] for doc in docs)) + "\n")
+
+    index_writer.close()
+    positions_writer.close()
+
+    return lemma_idf
@@ -0,0 +1,51 @@
+import os
+import shutil
+import time
+
+# Настройки gunicorn для поисковой системы: gunicorn -c gunicorn.conf.py app:app
+#
+# Индексы загружаются один раз в главном процессе (preload_app + when_ready), рабочие
+# процессы получают их после fork копированием при записи, а index.bin и сегменты
+# читаются через mmap и лежат в общем кеше страниц ОС. Каждый рабочий процесс
+# обслуживает запросы несколькими потоками.
+#
+# Метрики рабочих процессов складываются через общую папку METRICS_MULTIPROC_DIR
+# (см. metrics.py): она очищается при запуске, а после завершения рабочего процесса
+# его файл остаётся в сумме под другим именем (счётчики не уменьшаются).
+
+os.environ.setdefault("METRICS_MULTIPROC_DIR", os.path.abspath("../metrics/gunicorn"))
+
+bind = os.environ.get("BIND", "127.0.0.1:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1))
+worker_class = "gthread"
+threads = int(os.environ.get("THREADS", 4))
+preload_app = True
+timeout = 30
+keepalive = 5
+accesslog = os.environ.get("ACCESS_LOG")  # "-" — в stdout, по умолчанию выключен
+
+
+def on_starting(server):
+    multiproc_dir = os.environ["METRICS_MULTIPROC_DIR"]
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir, exist_ok=True)
+
+
+def when_ready(server):
+    import app
+
+    started = time.perf_counter()
+    app.preload_indexes()
+    server.log.info("Индексы загружены за %.2f с", time.perf_counter() - started)
+
+
+def worker_exit(server, worker):
+    import metrics
+
+    metrics.REGISTRY.flush()
+
+
+def child_exit(server, worker):
+    import metrics
+
+    metrics.mark_process_dead(worker.pid, os.environ["METRICS_MULTIPROC_DIR"])
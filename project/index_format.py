@@ -0,0 +1,416 @@
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from array import array
+
+INDEX_BIN_FILE = "../index.bin"  # Бинарный индекс: словарь терминов, списки документов, нормы
+
+# Формат файла (все числа little-endian):
+#
+#     заголовок     HEADER
+#     документы     DOC_ENTRY * doc_count, по порядковому номеру документа
+#     термины       TERM_ENTRY * term_count, отсортированы по термину
+#     строки        doc_id, URL и термины в UTF-8
+#     списки        для каждого термина: номера документов разностями в varint,
+#                   затем веса TF-IDF (float32) в том же порядке
+#
+# Таблицы документов и терминов имеют записи фиксированной длины,
+# поэтому файл можно открыть через mmap и читать только нужные записи.
+
+MAGIC = b"OIPX"
+VERSION = 1
+
+# magic, версия, документов, терминов, смещения: документы, термины, строки, списки
+HEADER = struct.Struct("<4sIII4Q")
+
+# смещение doc_id, длина doc_id, смещение URL, длина URL, длина документа, норма вектора
+DOC_ENTRY = struct.Struct("<IIIIId")
+
+# смещение термина, длина термина, df, смещение списка, длина блока номеров, idf,
+# максимальный вклад термина в косинусное сходство (max w / ||d||)
+TERM_ENTRY = struct.Struct("<IIIQIdd")
+
+
+# Порядок документов: числовые doc_id по возрастанию, затем остальные
+def doc_sort_key(doc_id):
+    if doc_id.isdigit():
+        return 0, int(doc_id), ""
+    return 1, 0, doc_id
+
+
+# Версия файла на диске: меняется при замене файла (os.replace создаёт новый файл,
+# поэтому меняется хотя бы одно из полей); None, если файла нет
+def file_version(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+# Запись числа в формате varint (по 7 бит в байте)
+def encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+# Чтение count номеров документов, записанных разностями в varint
+def decode_doc_gaps(data, count):
+    docs = [0] * count
+    doc = 0
+    value = 0
+    shift = 0
+    i = 0
+
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+
+        doc += value
+        docs[i] = doc
+        i += 1
+        value = 0
+        shift = 0
+
+    return docs
+
+
+class IndexWriter:
+    """
+    Потоковая запись индекса.
+    Сначала добавляются все документы (add_document) по порядку номеров,
+    затем термины (add_term) в порядке возрастания. Списки документов
+    пишутся во временный файл, поэтому в памяти держится только словарь.
+    """
+
+    def __init__(self, path=INDEX_BIN_FILE):
+        self.path = path
+        self.docs = []
+        self.terms = []
+        self.strings = bytearray()
+        self.postings_path = path + ".postings.tmp"
+        self.postings = open(self.postings_path, "wb")
+        self.postings_size = 0
+        self.last_term = None
+
+    def _add_string(self, value):
+        data = value.encode("utf-8")
+        offset = len(self.strings)
+        self.strings += data
+        return offset, len(data)
+
+    # Возвращает порядковый номер документа в индексе
+    def add_document(self, doc_id, url="", length=0, norm=0.0):
+        id_off, id_len = self._add_string(doc_id)
+        url_off, url_len = self._add_string(url or "")
+        self.docs.append([id_off, id_len, url_off, url_len, length, norm])
+        return len(self.docs) - 1
+
+    def set_norm(self, doc, norm):
+        self.docs[doc][5] = norm
+
+    # docs — возрастающие порядковые номера документов, weights — их веса TF-IDF
+    def add_term(self, term, idf, docs, weights):
+        if self.last_term is not None and term <= self.last_term:
+            raise ValueError(f"Термины должны добавляться по возрастанию: {term!r}")
+        self.last_term = term
+
+        # Граница MaxScore считается по тем же float32, что попадут в файл:
+        # по весам float64 она может оказаться чуть ниже реального вклада
+        stored_weights = array("f", weights)
+        block = bytearray()
+        previous = 0
+        max_score = 0.0
+
+        for doc, weight in zip(docs, stored_weights):
+            encode_varint(doc - previous, block)
+            previous = doc
+
+            norm = self.docs[doc][5]
+            if norm > 0:
+                max_score = max(max_score, weight / norm)
+
+        offset = self.postings_size
+        docs_len = len(block)
+        block += stored_weights.tobytes()
+
+        self.postings.write(block)
+        self.postings_size += len(block)
+
+        term_off, term_len = self._add_string(term)
+        self.terms.append((term_off, term_len, len(docs), offset, docs_len, idf, max_score))
+
+    # Сборка итогового файла; старый индекс заменяется атомарно
+    def close(self):
+        self.postings.close()
+
+        doc_table_off = HEADER.size
+        term_table_off = doc_table_off + DOC_ENTRY.size * len(self.docs)
+        strings_off = term_table_off + TERM_ENTRY.size * len(self.terms)
+        postings_off = strings_off + len(self.strings)
+
+        tmp_path = self.path + ".tmp"
+
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(self.docs), len(self.terms),
+                                doc_table_off, term_table_off, strings_off, postings_off))
+
+            for entry in self.docs:
+                f.write(DOC_ENTRY.pack(*entry))
+
+            for entry in self.terms:
+                f.write(TERM_ENTRY.pack(*entry))
+
+            f.write(self.strings)
+
+            with open(self.postings_path, "rb") as postings:
+                while True:
+                    chunk = postings.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+
+        os.remove(self.postings_path)
+        os.replace(tmp_path, self.path)
+
+
+# Словарь лемма -> idf поверх индекса (читается по запросу, без загрузки в память).
+# reader — любой объект с методом idf(term), возвращающим None для неизвестного термина
+class IdfValues:
+    def __init__(self, reader):
+        self.reader = reader
+
+    def __contains__(self, term):
+        return self.reader.idf(term) is not None
+
+    def __getitem__(self, term):
+        idf = self.reader.idf(term)
+        if idf is None:
+            raise KeyError(term)
+        return idf
+
+    def get(self, term, default=None):
+        idf = self.reader.idf(term)
+        return default if idf is None else idf
+
+
+# Примерный объём памяти под раскодированный список из df документов (байт)
+def postings_memory_size(df):
+    return 64 + 40 * df
+
+
+class IndexReader:
+    """
+    Чтение индекса через mmap: при открытии читается только заголовок,
+    записи документов и терминов разбираются по мере обращения к ним.
+    memory_budget — сколько байт можно занять раскодированными списками
+    документов (LRU-кеш); 0 — не кешировать, всё читается из mmap.
+    """
+
+    def __init__(self, path=INDEX_BIN_FILE, memory_budget=0):
+        self.path = path
+        self.file = open(path, "rb")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # Обращения к индексу случайные: упреждающее чтение только раздувает память
+        if hasattr(self.mm, "madvise") and hasattr(mmap, "MADV_RANDOM"):
+            self.mm.madvise(mmap.MADV_RANDOM)
+
+        self.memory_budget = memory_budget
+        self._cache = OrderedDict()  # термин -> (номера документов, веса)
+        self._cache_size = 0
+        self._lock = threading.Lock()
+
+        (magic, version, self.doc_count, self.term_count, self.doc_table_off,
+         self.term_table_off, self.strings_off, self.postings_off) = HEADER.unpack_from(self.mm, 0)
+
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path}: неизвестный формат индекса")
+
+        # Кеш поиска терминов: термин -> номер. Хранятся только найденные термины,
+        # поэтому кеш не больше словаря индекса, сколько бы разных слов ни искали
+        self._term_ids = {}
+        self.idf_values = IdfValues(self)
+
+    def close(self):
+        if getattr(self, "mm", None) is not None:
+            self.mm.close()
+            self.mm = None
+        self.file.close()
+
+    def _string(self, offset, length):
+        start = self.strings_off + offset
+        return self.mm[start:start + length].decode("utf-8")
+
+    # Документы
+
+    def _doc_entry(self, doc):
+        return DOC_ENTRY.unpack_from(self.mm, self.doc_table_off + DOC_ENTRY.size * doc)
+
+    def doc_id(self, doc):
+        id_off, id_len, _, _, _, _ = self._doc_entry(doc)
+        return self._string(id_off, id_len)
+
+    def doc_url(self, doc):
+        _, _, url_off, url_len, _, _ = self._doc_entry(doc)
+        return self._string(url_off, url_len)
+
+    def doc_length(self, doc):
+        return self._doc_entry(doc)[4]
+
+    def norm(self, doc):
+        return self._doc_entry(doc)[5]
+
+    def doc_ids(self):
+        return [self.doc_id(doc) for doc in range(self.doc_count)]
+
+    # Термины
+
+    def _term_entry(self, term_id):
+        return TERM_ENTRY.unpack_from(self.mm, self.term_table_off + TERM_ENTRY.size * term_id)
+
+    def term(self, term_id):
+        term_off, term_len = self._term_entry(term_id)[:2]
+        return self._string(term_off, term_len)
+
+    def terms(self):
+        for term_id in range(self.term_count):
+            yield self.term(term_id)
+
+    # (термин, df) всех терминов по порядку, без чтения списков
+    def term_dfs(self):
+        for term_id in range(self.term_count):
+            term_off, term_len, df = self._term_entry(term_id)[:3]
+            yield self._string(term_off, term_len), df
+
+    # Номер термина двоичным поиском по отсортированной таблице; -1, если термина нет
+    def find_term(self, term):
+        term_id = self._term_ids.get(term)
+        if term_id is not None:
+            return term_id
+
+        key = term.encode("utf-8")
+        low, high = 0, self.term_count - 1
+        term_id = -1
+
+        while low <= high:
+            middle = (low + high) // 2
+            term_off, term_len = self._term_entry(middle)[:2]
+            start = self.strings_off + term_off
+            current = self.mm[start:start + term_len]
+
+            if current < key:
+                low = middle + 1
+            elif current > key:
+                high = middle - 1
+            else:
+                term_id = middle
+                break
+
+        if term_id >= 0:
+            self._term_ids[term] = term_id
+        return term_id
+
+    # (df, idf, максимальный вклад) термина или None
+    def term_info(self, term):
+        term_id = self.find_term(term)
+        if term_id < 0:
+            return None
+        _, _, df, _, _, idf, max_score = self._term_entry(term_id)
+        return df, idf, max_score
+
+    def idf(self, term):
+        info = self.term_info(term)
+        return info[1] if info else None
+
+    def max_score(self, term):
+        info = self.term_info(term)
+        return info[2] if info else 0.0
+
+    # Только номера документов (для булева поиска веса не нужны)
+    def doc_postings(self, term):
+        term_id = self.find_term(term)
+        if term_id < 0:
+            return []
+
+        _, _, df, offset, docs_len, _, _ = self._term_entry(term_id)
+        start = self.postings_off + offset
+        return decode_doc_gaps(self.mm[start:start + docs_len], df)
+
+    # Номера документов и веса TF-IDF термина
+    def postings(self, term):
+        with self._lock:
+            cached = self._cache.get(term)
+            if cached is not None:
+                self._cache.move_to_end(term)
+                return cached
+
+        term_id = self.find_term(term)
+        if term_id < 0:
+            return [], array("f")
+
+        docs, weights = self.read_postings(term_id)
+        self._remember(term, (docs, weights), postings_memory_size(len(docs)))
+        return docs, weights
+
+    # Номера документов и веса термина по его номеру, мимо кеша (для обхода всего индекса)
+    def read_postings(self, term_id):
+        _, _, df, offset, docs_len, _, _ = self._term_entry(term_id)
+        start = self.postings_off + offset
+        docs = decode_doc_gaps(self.mm[start:start + docs_len], df)
+
+        weights = array("f")
+        weights.frombytes(self.mm[start + docs_len:start + docs_len + 4 * df])
+        return docs, weights
+
+    # Кеширование раскодированного списка в пределах memory_budget
+    def _remember(self, term, postings, size):
+        if size > self.memory_budget:
+            return
+
+        with self._lock:
+            if term in self._cache:
+                return
+
+            self._cache[term] = postings
+            self._cache_size += size
+
+            while self._cache_size > self.memory_budget:
+                _, (docs, _) = self._cache.popitem(last=False)
+                self._cache_size -= postings_memory_size(len(docs))
+
+    # Объём памяти, занятый кешем списков (байт)
+    def cache_size(self):
+        return self._cache_size
+
+
+# Запись индекса из векторов документов: doc_vectors[doc_id] = {термин: tfidf}
+def write_index(path, doc_vectors, idf_values, doc_urls=None, doc_lengths=None):
+    doc_urls = doc_urls or {}
+    doc_lengths = doc_lengths or {}
+
+    writer = IndexWriter(path)
+    postings = {}
+
+    for doc_id in sorted(doc_vectors, key=doc_sort_key):
+        vector = doc_vectors[doc_id]
+        norm = sum(weight * weight for weight in vector.values()) ** 0.5
+        doc = writer.add_document(doc_id, doc_urls.get(doc_id, ""), doc_lengths.get(doc_id, 0), norm)
+
+        for term, weight in vector.items():
+            postings.setdefault(term, ([], []))
+            postings[term][0].append(doc)
+            postings[term][1].append(weight)
+
+    for term in sorted(postings):
+        docs, weights = postings[term]
+        writer.add_term(term, idf_values.get(term, 0.0), docs, weights)
+
+    writer.close()
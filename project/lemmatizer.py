@@ -0,0 +1,204 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+LEMMA_CACHE_FILE = "../lemma_cache.txt"  # Общий кеш токен -> лемма для всех этапов
+LEMMA_CACHE_SIZE = None  # Максимальный размер кеша в памяти (None — без ограничения)
+
+# Неправильные формы
+IRREGULAR_FORMS = {
+    "went": "go",
+    "gone": "go",
+    "did": "do",
+    "done": "do",
+    "was": "be",
+    "were": "be",
+    "been": "be",
+    "has": "have",
+    "had": "have",
+    "having": "have",
+    "made": "make",
+    "took": "take",
+    "taken": "take",
+    "saw": "see",
+    "seen": "see",
+    "ran": "run",
+    "bought": "buy",
+    "brought": "bring",
+    "thought": "think",
+    "better": "good",
+    "best": "good",
+    "worse": "bad",
+    "worst": "bad"
+}
+
+# Правила отбрасывания окончаний, проверяются строго по порядку:
+# (окончание, слово длиннее чем, замена, дополнительная обработка основы)
+SUFFIX_RULES = (
+    ("ies", 4, "y", None),  # Множественное число (companies → company)
+    ("es", 4, "", None),  # Множественное число (boxes → box)
+    ("s", 3, "", None),  # Обычное множественное число (cats → cat)
+    ("ing", 5, "", "undouble"),  # Continuous (running → run)
+    ("ed", 4, "", "i_to_y"),  # Прошедшее время (played → play, studied → study)
+    ("er", 4, "", "undouble"),  # Сравнительная степень (bigger → big)
+    ("est", 5, "", "undouble"),  # Превосходная степень (biggest → big)
+)
+
+
+# Удвоенная согласная в конце основы (runn → run)
+def _undouble(base):
+    if len(base) > 2 and base[-1] == base[-2]:
+        return base[:-1]
+    return base
+
+
+# studi → study
+def _i_to_y(base):
+    if base.endswith("i"):
+        return base[:-1] + "y"
+    return base
+
+
+STEM_FIXES = {None: None, "undouble": _undouble, "i_to_y": _i_to_y}
+
+
+# Таблица правил компилируется один раз: правила группируются по последней
+# букве окончания, и для слова проверяются только подходящие ему
+def compile_rules(rules):
+    by_last_char = {}
+
+    for suffix, min_length, replacement, fix in rules:
+        by_last_char.setdefault(suffix[-1], []).append(
+            (suffix, len(suffix), min_length, replacement, STEM_FIXES[fix])
+        )
+
+    return by_last_char
+
+
+COMPILED_RULES = compile_rules(SUFFIX_RULES)
+
+# Версия правил: кеш, построенный другими правилами, не используется
+RULES_VERSION = hashlib.sha1(
+    repr((SUFFIX_RULES, sorted(IRREGULAR_FORMS.items()))).encode("utf-8")
+).hexdigest()[:12]
+
+
+# Лемматизация по таблице правил (без кеша)
+def lemmatize_word(word):
+
+    # Неправильные формы
+    if word in IRREGULAR_FORMS:
+        return IRREGULAR_FORMS[word]
+
+    if not word:
+        return word
+
+    for suffix, suffix_length, min_length, replacement, fix in COMPILED_RULES.get(word[-1], ()):
+        if len(word) > min_length and word.endswith(suffix):
+            base = word[:-suffix_length] + replacement
+            return fix(base) if fix else base
+
+    return word
+
+
+class Lemmatizer:
+    """
+    Лемматизатор с кешем токен -> лемма.
+    Словарь коллекции сильно повторяется, поэтому правила
+    применяются к каждому токену только один раз.
+    cache_size=None — кеш без ограничения, иначе LRU указанного размера.
+    """
+
+    def __init__(self, cache_size=LEMMA_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.cache = OrderedDict() if cache_size else {}
+        self.new_entries = {}  # Леммы, вычисленные после загрузки кеша
+        self.hits = 0
+        self.misses = 0
+
+    def lemmatize(self, word):
+        lemma = self.cache.get(word)
+
+        if lemma is not None:
+            self.hits += 1
+            if self.cache_size:
+                self.cache.move_to_end(word)
+            return lemma
+
+        self.misses += 1
+        lemma = lemmatize_word(word)
+        self.add(word, lemma)
+        self.new_entries[word] = lemma
+        return lemma
+
+    # Лемматизация списка токенов за один вызов
+    def lemmatize_batch(self, tokens):
+        cache = self.cache
+        if self.cache_size:
+            return [self.lemmatize(token) for token in tokens]
+
+        lemmas = []
+        for token in tokens:
+            lemma = cache.get(token)
+            if lemma is None:
+                lemma = self.lemmatize(token)
+            else:
+                self.hits += 1
+            lemmas.append(lemma)
+        return lemmas
+
+    def add(self, word, lemma):
+        self.cache[word] = lemma
+        if self.cache_size and len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    # Забрать новые записи (например, чтобы передать их из процесса-воркера)
+    def take_new_entries(self):
+        entries = self.new_entries
+        self.new_entries = {}
+        return entries
+
+    def merge(self, entries):
+        for word, lemma in entries.items():
+            self.add(word, lemma)
+            self.new_entries[word] = lemma
+
+    # Загрузка кеша из файла: первая строка — версия правил, далее <токен> <лемма>
+    def load_cache(self, path=LEMMA_CACHE_FILE):
+        if not os.path.exists(path):
+            return
+
+        with open(path, "r", encoding="utf-8") as f:
+            if f.readline().strip() != f"#version {RULES_VERSION}":
+                return
+
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2:
+                    self.add(parts[0], parts[1])
+
+    # Сохранение кеша (атомарно, через временный файл)
+    def save_cache(self, path=LEMMA_CACHE_FILE):
+        tmp_path = path + ".tmp"
+
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(f"#version {RULES_VERSION}\n")
+            for word in sorted(self.cache):
+                f.write(f"{word} {self.cache[word]}\n")
+
+        os.replace(tmp_path, path)
+        self.new_entries = {}
+
+
+_lemmatizer = None
+
+
+# Общий лемматизатор процесса, при первом обращении загружает кеш с диска
+def get_lemmatizer():
+    global _lemmatizer
+
+    if _lemmatizer is None:
+        _lemmatizer = Lemmatizer()
+        _lemmatizer.load_cache()
+
+    return _lemmatizer
@@ -0,0 +1,152 @@
+import argparse
+import http.client
+import json
+import threading
+import time
+from itertools import cycle
+from urllib.parse import urlencode, urlsplit
+
+from batch_search import load_queries, percentile
+
+# Нагрузочное тестирование поисковой системы через JSON API (/api/search).
+# Несколько потоков по кругу отправляют запросы из файла, каждый по своему
+# keep-alive соединению; в конце печатается пропускная способность и задержки.
+
+URL = "http://127.0.0.1:8000"  # Адрес сервера (gunicorn -c gunicorn.conf.py app:app)
+CONCURRENCY = 8  # Одновременных клиентов
+DURATION = 30.0  # Длительность теста, сек
+WARMUP = 3.0  # Сколько секунд в начале не учитывать (прогрев кешей)
+
+
+class Client:
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.connection = None
+
+    # Запрос к /api/search: (HTTP-статус, число результатов)
+    def search(self, query, mode, k):
+        path = "/api/search?" + urlencode({"query": query, "mode": mode, "k": k})
+
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            try:
+                self.connection.request("GET", path)
+                response = self.connection.getresponse()
+                body = response.read()
+                break
+            except (OSError, http.client.HTTPException):
+                # Сервер мог закрыть простаивающее соединение — переподключаемся один раз
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+
+        if response.status != 200:
+            return response.status, 0
+        return response.status, len(json.loads(body)["results"])
+
+
+def run_load_test(url, queries, mode="vector", k=10, concurrency=CONCURRENCY,
+                  duration=DURATION, warmup=WARMUP):
+    started = time.perf_counter()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(offset):
+        client = Client(url)
+        own_latencies = []
+        own_errors = []
+
+        for query in cycle(queries[offset:] + queries[:offset]):
+            now = time.perf_counter()
+            if now >= stop_at:
+                break
+
+            try:
+                status, _ = client.search(query, mode, k)
+                error = None if status == 200 else f"HTTP {status}"
+            except (OSError, http.client.HTTPException) as e:
+                error = repr(e)
+
+            finished = time.perf_counter()
+            if now >= measure_from:
+                if error:
+                    own_errors.append(error)
+                else:
+                    own_latencies.append((finished - now) * 1000)
+
+        with lock:
+            latencies.extend(own_latencies)
+            errors.extend(own_errors)
+
+    threads = [threading.Thread(target=worker, args=(i * len(queries) // concurrency,))
+               for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - measure_from
+
+    return {
+        "url": url,
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "error_examples": sorted(set(errors))[:5],
+        "elapsed_s": round(elapsed, 3),
+        "qps": round(len(latencies) / elapsed, 1) if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "max": round(max(latencies, default=0.0), 3),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочное тестирование /api/search")
+    parser.add_argument("queries", help="файл с запросами, по одному в строке")
+    parser.add_argument("--url", default=URL)
+    parser.add_argument("--mode", choices=("vector", "boolean"), default="vector")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--duration", type=float, default=DURATION, help="сек")
+    parser.add_argument("--warmup", type=float, default=WARMUP, help="сек, не учитываются")
+    parser.add_argument("--output", help="файл для сводки (JSON)")
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries)
+    if not queries:
+        print("[!] Файл запросов пуст")
+        return
+
+    print(f"[+] {args.concurrency} клиентов, {args.duration:.0f} с (+{args.warmup:.0f} с прогрева): {args.url}")
+    summary = run_load_test(args.url, queries, args.mode, args.k, args.concurrency,
+                            args.duration, args.warmup)
+
+    latency = summary["latency_ms"]
+    print(f"[+] Запросов: {summary['requests']}, ошибок: {summary['errors']}, "
+          f"{summary['qps']} запросов/с")
+    print(f"[+] Задержка, мс: p50={latency['p50']} p95={latency['p95']} "
+          f"p99={latency['p99']} max={latency['max']}")
+    for error in summary["error_examples"]:
+        print(f"[!] {error}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"[+] Сводка сохранена: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Метрики процесса: счётчики, текущие значения и гистограммы длительностей с метками.
+# Поисковая система отдаёт их в текстовом формате Prometheus (/metrics в app.py),
+# скрипты сборки в конце сохраняют сводку в JSON (write_summary).
+#
+# Метрики хранятся в памяти своего процесса; скрипты учитывают время процессов-воркеров,
+# которое те возвращают вместе с результатом. Под gunicorn рабочих процессов несколько,
+# и запрос к /metrics попадает в любой из них, поэтому там включается общий режим
+# (enable_multiprocess): каждый процесс раз в FLUSH_INTERVAL сохраняет свои метрики
+# в файл <pid>.json общей папки, а /metrics складывает файлы всех процессов.
+# Счётчики и гистограммы суммируются (файлы завершившихся процессов остаются под
+# другим именем, чтобы сумма не уменьшалась), текущие значения выдаются по процессам
+# с меткой pid.
+
+METRICS_DIR = "../metrics"  # Папка для JSON-сводок скриптов
+MULTIPROC_DIR_ENV = "METRICS_MULTIPROC_DIR"  # Переменная окружения: общая папка метрик процессов
+FLUSH_INTERVAL = 1.0  # Как часто (сек) процесс сохраняет метрики в общую папку
+
+# Верхние границы корзин гистограмм (сек): от долей миллисекунды (запросы)
+# до минут (этапы сборки)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# Описания метрик для /metrics
+DESCRIPTIONS = {
+    "crawl_pages_total": "Страницы обхода по результату",
+    "crawl_stage_seconds": "Этапы загрузки страницы: fetch, parse",
+    "documents_processed_total": "Обработанные документы",
+    "document_stage_seconds": "Этапы разбора документа: read, tokenize, lemmatize, write",
+    "build_stage_seconds": "Этапы сборки индексов",
+    "search_queries_total": "Выполненные поисковые запросы",
+    "search_latency_seconds": "Время ответа на поисковый запрос",
+    "search_stage_seconds": "Этапы векторного поиска: analyze, score, sort",
+    "index_reloads_total": "Перечитывания индекса после пересборки",
+    "index_documents": "Документов в загруженном индексе",
+    "query_cache_entries": "Запросов в кеше результатов",
+    "query_cache_memory_bytes": "Память под кеш результатов",
+    "query_cache_evictions_total": "Вытеснено из кеша результатов",
+}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+# Текстовый формат Prometheus
+def _render_prometheus(counters, gauges, histograms):
+    lines = []
+
+    groups = (("counter", counters), ("gauge", gauges), ("histogram", histograms))
+
+    for kind, values in groups:
+        for name in sorted({name for name, _ in values}):
+            if name in DESCRIPTIONS:
+                lines.append(f"# HELP {name} {DESCRIPTIONS[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+            for (metric, key), value in sorted(values.items()):
+                if metric != name:
+                    continue
+
+                if kind != "histogram":
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+                    continue
+
+                cumulative = 0
+                for bound, count in zip(BUCKETS, value.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {value.count}")
+                lines.append(f"{name}_sum{_format_labels(key)} {value.sum}")
+                lines.append(f"{name}_count{_format_labels(key)} {value.count}")
+
+    return "\n".join(lines) + "\n"
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # последняя корзина — больше всех границ
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Оценка перцентиля по корзинам: верхняя граница корзины, где он находится
+    # (None — больше последней границы)
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+
+        rank = p / 100 * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+
+class Registry:
+    def __init__(self):
+        self._counters = {}  # (имя, метки) -> значение
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+        self._collectors = []  # Функции, обновляющие метрики перед выдачей
+        self.multiproc_dir = None
+        self._flusher = None
+
+        # Рабочий процесс после fork начинает свои метрики с нуля:
+        # метрики главного процесса остаются в его файле
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._flusher = None
+
+    # collect() вызывается перед выдачей и сохранением метрик: в нём процесс
+    # записывает текущие значения (размер кеша и т. п.)
+    def add_collector(self, collect):
+        self._collectors.append(collect)
+
+    def _collect(self):
+        for collect in self._collectors:
+            collect()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._ensure_flusher()
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+        self._ensure_flusher()
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+        self._ensure_flusher()
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    # Общий режим для нескольких процессов (см. начало модуля)
+    def enable_multiprocess(self, multiproc_dir):
+        os.makedirs(multiproc_dir, exist_ok=True)
+        self.multiproc_dir = multiproc_dir
+        atexit.register(self.flush)
+
+    # Поток сохранения метрик; в общем режиме запускается при первой записи в процессе
+    def _ensure_flusher(self):
+        if self.multiproc_dir is None or self._flusher is not None:
+            return
+
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as error:
+                print(f"[!] Не удалось сохранить метрики: {error!r}")
+
+    # Метрики процесса в виде, пригодном для JSON
+    def _state(self):
+        with self._lock:
+            return {
+                "counters": [[name, key, value] for (name, key), value in self._counters.items()],
+                "gauges": [[name, key, value] for (name, key), value in self._gauges.items()],
+                "histograms": [[name, key, histogram.counts, histogram.sum, histogram.count]
+                               for (name, key), histogram in self._histograms.items()],
+            }
+
+    # Сохранение метрик процесса в общую папку
+    def flush(self):
+        if self.multiproc_dir is None:
+            return
+
+        self._collect()
+        state = self._state()
+        if any(state.values()):
+            _write_state(os.path.join(self.multiproc_dir, f"{os.getpid()}.json"), state)
+
+    # Сумма метрик всех процессов из общей папки
+    def _merged(self):
+        counters = {}
+        gauges = {}
+        histograms = {}
+
+        for filename in sorted(os.listdir(self.multiproc_dir)):
+            if not filename.endswith(".json"):
+                continue
+
+            state = _read_state(os.path.join(self.multiproc_dir, filename))
+            if state is None:
+                continue  # Файл перенесли между чтением папки и открытием
+
+            _add_state(counters, histograms, state)
+            if filename.startswith("dead-"):
+                continue  # Текущие значения завершившегося процесса не выдаются
+
+            pid = filename[:-len(".json")]
+            for name, key, value in state["gauges"]:
+                key = tuple(sorted(list(map(tuple, key)) + [("pid", pid)]))
+                gauges[(name, key)] = value
+
+        return counters, gauges, histograms
+
+    # Текстовый формат Prometheus; в общем режиме — по всем процессам
+    def render_prometheus(self):
+        if self.multiproc_dir is not None:
+            self.flush()
+            return _render_prometheus(*self._merged())
+
+        self._collect()
+        with self._lock:
+            return _render_prometheus(self._counters, self._gauges, self._histograms)
+
+    # Сводка для JSON: имя -> {"метка=значение,...": значение или статистика гистограммы}
+    def summary(self):
+        result = {"counters": {}, "gauges": {}, "histograms": {}}
+
+        def label_text(key):
+            return ",".join(f"{name}={value}" for name, value in key) or "all"
+
+        with self._lock:
+            for (name, key), value in sorted(self._counters.items()):
+                result["counters"].setdefault(name, {})[label_text(key)] = value
+            for (name, key), value in sorted(self._gauges.items()):
+                result["gauges"].setdefault(name, {})[label_text(key)] = value
+            for (name, key), histogram in sorted(self._histograms.items()):
+                stats = {
+                    "count": histogram.count,
+                    "sum_s": round(histogram.sum, 6),
+                    "avg_ms": round(histogram.sum / histogram.count * 1000, 3) if histogram.count else 0.0,
+                }
+                for p in (50, 95, 99):
+                    bound = histogram.percentile(p)
+                    stats[f"p{p}_ms_le"] = None if bound is None else round(bound * 1000, 3)
+                result["histograms"].setdefault(name, {})[label_text(key)] = stats
+
+        return result
+
+
+# Общий реестр процесса
+REGISTRY = Registry()
+inc = REGISTRY.inc
+set_value = REGISTRY.set
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+
+
+def _read_state(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Запись атомарной заменой файла: читатель видит либо старое, либо новое содержимое
+def _write_state(path, state):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+# Прибавление счётчиков и гистограмм сохранённого состояния процесса
+def _add_state(counters, histograms, state):
+    for name, key, value in state["counters"]:
+        key = (name, tuple(map(tuple, key)))
+        counters[key] = counters.get(key, 0) + value
+
+    for name, key, counts, total, count in state["histograms"]:
+        key = (name, tuple(map(tuple, key)))
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram()
+        histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+        histogram.sum += total
+        histogram.count += count
+
+
+# Процесс завершился (вызывается главным процессом gunicorn после его завершения):
+# файл переименовывается в dead-<pid>-<время>.json — его счётчики и гистограммы остаются
+# в сумме, текущие значения больше не выдаются, а новый процесс с тем же номером
+# не затрёт накопленное. Переименование атомарно, поэтому сумма не скачет
+def mark_process_dead(pid, multiproc_dir):
+    path = os.path.join(multiproc_dir, f"{pid}.json")
+    if os.path.exists(path):
+        os.replace(path, os.path.join(multiproc_dir, f"dead-{pid}-{time.time_ns()}.json"))
+
+
+# Сохранение сводки метрик скрипта в METRICS_DIR/<script>.json
+def write_summary(script, extra=None, metrics_dir=METRICS_DIR):
+    os.makedirs(metrics_dir, exist_ok=True)
+    path = os.path.join(metrics_dir, f"{script}.json")
+
+    data = {"script": script, "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    data.update(extra or {})
+    data.update(REGISTRY.summary())
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+    print(f"[+] Метрики сохранены: {path}")
+    return path
@@ -0,0 +1,14 @@
+from bs4 import BeautifulSoup
+
+# Парсер HTML: lxml заметно быстрее встроенного html.parser,
+# поэтому используем его, если он установлен
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+
+# Построение дерева документа выбранным парсером
+def make_soup(html):
+    return BeautifulSoup(html, HTML_PARSER)
@@ -0,0 +1,331 @@
+import mmap
+import os
+import struct
+
+from index_format import HEADER, doc_sort_key, encode_varint
+
+PAGE_TERMS_DIR = "../page_terms"  # Файлы <doc_id>_positions.txt из text_processing
+POSITIONS_FILE = "../positions.bin"  # Позиционный индекс для фразового поиска и NEAR
+
+# Формат файла (как у index.bin, все числа little-endian):
+#
+#     заголовок     HEADER с MAGIC = b"OIPP"
+#     документы     DOC_ENTRY * doc_count, по порядку doc_id
+#     термины       TERM_ENTRY * term_count, отсортированы по термину
+#     строки        doc_id и термины в UTF-8
+#     списки        для каждого документа термина: разность номера документа,
+#                   число позиций, длина блока позиций в байтах, затем позиции
+#                   разностями — всё в varint
+#
+# Длина блока позиций позволяет перешагнуть документ, не раскодируя его позиции:
+# позиции читаются только для документов-кандидатов.
+
+MAGIC = b"OIPP"
+VERSION = 1
+
+# смещение doc_id, длина doc_id
+DOC_ENTRY = struct.Struct("<II")
+
+# смещение термина, длина термина, df, смещение списка, длина списка в байтах
+TERM_ENTRY = struct.Struct("<IIIQQ")
+
+
+# Чтение одного varint начиная с position: (значение, следующая позиция)
+def read_varint(data, position):
+    value = 0
+    shift = 0
+
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+
+def decode_positions(data, position, count):
+    positions = [0] * count
+    current = 0
+
+    for i in range(count):
+        gap, position = read_varint(data, position)
+        current += gap
+        positions[i] = current
+
+    return positions
+
+
+# Загрузка позиций лемм страницы: лемма -> возрастающие позиции
+def load_page_positions(file_path):
+    lemma_positions = {}
+
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) > 1:
+                lemma_positions[parts[0]] = [int(position) for position in parts[1:]]
+
+    return lemma_positions
+
+
+class PositionalIndexWriter:
+    """
+    Потоковая запись позиционного индекса (как IndexWriter в index_format):
+    сначала все документы (add_document) по порядку номеров, затем термины
+    (add_term) по возрастанию. Позиции каждого документа сразу пишутся во временный
+    файл, поэтому термин можно добавлять по частям: start_term, add_posting
+    для каждого документа, finish_term — без списка документов термина в памяти.
+    """
+
+    def __init__(self, path=POSITIONS_FILE):
+        self.path = path
+        self.docs = []
+        self.terms = []
+        self.strings = bytearray()
+        self.postings_path = path + ".postings.tmp"
+        self.postings = open(self.postings_path, "wb")
+        self.postings_size = 0
+        self.last_term = None
+
+        self.term = None  # Термин, который сейчас добавляется, и его df и начало списка
+        self.term_df = 0
+        self.term_offset = 0
+        self.previous_doc = 0
+
+    def _add_string(self, value):
+        data = value.encode("utf-8")
+        offset = len(self.strings)
+        self.strings += data
+        return offset, len(data)
+
+    def add_document(self, doc_id):
+        self.docs.append(self._add_string(doc_id))
+        return len(self.docs) - 1
+
+    # postings — пары (номер документа, возрастающие позиции) по возрастанию номеров
+    def add_term(self, term, postings):
+        self.start_term(term)
+        for doc, positions in postings:
+            self.add_posting(doc, positions)
+        self.finish_term()
+
+    def start_term(self, term):
+        if self.last_term is not None and term <= self.last_term:
+            raise ValueError(f"Термины должны добавляться по возрастанию: {term!r}")
+        self.last_term = term
+
+        self.term = term
+        self.term_df = 0
+        self.term_offset = self.postings_size
+        self.previous_doc = 0
+
+    # Документы термина — по возрастанию номеров
+    def add_posting(self, doc, positions):
+        encoded = bytearray()
+        previous = 0
+        for position in positions:
+            encode_varint(position - previous, encoded)
+            previous = position
+
+        entry = bytearray()
+        encode_varint(doc - self.previous_doc, entry)
+        encode_varint(len(positions), entry)
+        encode_varint(len(encoded), entry)
+        entry += encoded
+
+        self.postings.write(entry)
+        self.postings_size += len(entry)
+        self.previous_doc = doc
+        self.term_df += 1
+
+    def finish_term(self):
+        term_off, term_len = self._add_string(self.term)
+        self.terms.append((term_off, term_len, self.term_df, self.term_offset,
+                           self.postings_size - self.term_offset))
+        self.term = None
+
+    # Сборка итогового файла; старый индекс заменяется атомарно
+    def close(self):
+        self.postings.close()
+
+        doc_table_off = HEADER.size
+        term_table_off = doc_table_off + DOC_ENTRY.size * len(self.docs)
+        strings_off = term_table_off + TERM_ENTRY.size * len(self.terms)
+        postings_off = strings_off + len(self.strings)
+
+        tmp_path = self.path + ".tmp"
+
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(self.docs), len(self.terms),
+                                doc_table_off, term_table_off, strings_off, postings_off))
+
+            for entry in self.docs:
+                f.write(DOC_ENTRY.pack(*entry))
+
+            for entry in self.terms:
+                f.write(TERM_ENTRY.pack(*entry))
+
+            f.write(self.strings)
+
+            with open(self.postings_path, "rb") as postings:
+                while True:
+                    chunk = postings.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+
+        os.remove(self.postings_path)
+        os.replace(tmp_path, self.path)
+
+
+# Запись позиционного индекса: postings[термин] = [(номер документа, позиции), ...]
+def write_positional_index(path, doc_ids, postings):
+    writer = PositionalIndexWriter(path)
+
+    for doc_id in doc_ids:
+        writer.add_document(doc_id)
+
+    for term in sorted(postings):
+        writer.add_term(term, postings[term])
+
+    writer.close()
+
+
+# Построение позиционного индекса по файлам позиций всех страниц
+def build_positional_index(path=POSITIONS_FILE, page_terms_dir=PAGE_TERMS_DIR):
+    doc_ids = sorted(
+        (filename[:-len("_positions.txt")]
+         for filename in os.listdir(page_terms_dir)
+         if filename.endswith("_positions.txt")),
+        key=doc_sort_key,
+    )
+
+    doc_positions = (
+        (doc_id, load_page_positions(os.path.join(page_terms_dir, f"{doc_id}_positions.txt")))
+        for doc_id in doc_ids
+    )
+    return write_document_positions(path, doc_positions)
+
+
+# Запись позиционного индекса по парам (doc_id, лемма -> позиции) в порядке doc_id
+def write_document_positions(path, doc_positions):
+    doc_ids = []
+    postings = {}
+
+    for doc, (doc_id, lemma_positions) in enumerate(doc_positions):
+        doc_ids.append(doc_id)
+        for lemma, positions in lemma_positions.items():
+            postings.setdefault(lemma, []).append((doc, positions))
+
+    write_positional_index(path, doc_ids, postings)
+    return len(doc_ids), len(postings)
+
+
+class PositionalIndexReader:
+    """
+    Чтение позиционного индекса через mmap. Списки позиций раскодируются
+    только для запрошенных документов, остальные перешагиваются по длине блока.
+    """
+
+    def __init__(self, path=POSITIONS_FILE):
+        self.path = path
+        self.file = open(path, "rb")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, self.doc_count, self.term_count, self.doc_table_off,
+         self.term_table_off, self.strings_off, self.postings_off) = HEADER.unpack_from(self.mm, 0)
+
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path}: неизвестный формат позиционного индекса")
+
+        self._doc_numbers = None
+
+    def close(self):
+        if getattr(self, "mm", None) is not None:
+            self.mm.close()
+            self.mm = None
+        self.file.close()
+
+    def _string(self, offset, length):
+        start = self.strings_off + offset
+        return self.mm[start:start + length].decode("utf-8")
+
+    def doc_id(self, doc):
+        id_off, id_len = DOC_ENTRY.unpack_from(self.mm, self.doc_table_off + DOC_ENTRY.size * doc)
+        return self._string(id_off, id_len)
+
+    # Номер документа по doc_id; None, если позиций документа нет
+    def doc_number(self, doc_id):
+        if self._doc_numbers is None:
+            self._doc_numbers = {self.doc_id(doc): doc for doc in range(self.doc_count)}
+        return self._doc_numbers.get(doc_id)
+
+    def _term_entry(self, term_id):
+        return TERM_ENTRY.unpack_from(self.mm, self.term_table_off + TERM_ENTRY.size * term_id)
+
+    def terms(self):
+        for term_id in range(self.term_count):
+            term_off, term_len = self._term_entry(term_id)[:2]
+            yield self._string(term_off, term_len)
+
+    # Номер термина двоичным поиском; -1, если термина нет
+    def find_term(self, term):
+        key = term.encode("utf-8")
+        low, high = 0, self.term_count - 1
+
+        while low <= high:
+            middle = (low + high) // 2
+            term_off, term_len = self._term_entry(middle)[:2]
+            start = self.strings_off + term_off
+            current = self.mm[start:start + term_len]
+
+            if current < key:
+                low = middle + 1
+            elif current > key:
+                high = middle - 1
+            else:
+                return middle
+
+        return -1
+
+    # Позиции термина в документах docs (множество номеров): номер -> позиции
+    def positions(self, term, docs):
+        term_id = self.find_term(term)
+        if term_id < 0 or not docs:
+            return {}
+
+        _, _, df, offset, length = self._term_entry(term_id)
+        start = self.postings_off + offset
+        data = self.mm[start:start + length]
+        last = max(docs)
+
+        result = {}
+        position = 0
+        doc = 0
+
+        for _ in range(df):
+            gap, position = read_varint(data, position)
+            doc += gap
+            if doc > last:
+                break
+
+            count, position = read_varint(data, position)
+            size, position = read_varint(data, position)
+
+            if doc in docs:
+                result[doc] = decode_positions(data, position, count)
+            position += size
+
+        return result
+
+
+def main():
+    docs_count, terms_count = build_positional_index()
+    print(f"[+] Позиционный индекс сохранён: {POSITIONS_FILE} "
+          f"({docs_count} документов, {terms_count} лемм)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import os
+import threading
+
+from lemmatizer import lemmatize_word
+from text_processing import OUTPUT_DIR, tokenize
+
+# Разбор запросов — общий для векторного и булева поиска.
+#
+# Слова запроса выделяются так же, как слова страниц (text_processing.tokenize: то же
+# регулярное выражение, стоп-слова и минимальная длина), и приводятся к леммам по
+# словарю коллекции token_lemmas.txt одним обращением к словарю. Словарь пишется вместе
+# с индексом (build_index.py, boolean_search.py, segments.py), поэтому при запуске поиска
+# файлы page_terms не читаются. Слова, которых нет в коллекции, лемматизируются теми же
+# правилами, но в кеш лемматизатора не попадают: запросы не должны раздувать его.
+
+LEXICON_FILE = "../token_lemmas.txt"  # Словарь коллекции: <токен> <лемма>
+
+
+def load_lexicon(path=LEXICON_FILE):
+    lexicon = {}
+    if not os.path.exists(path):
+        return lexicon
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 2:
+                lexicon[parts[0]] = parts[1]
+    return lexicon
+
+
+# Сохранение словаря (атомарно, через временный файл)
+def save_lexicon(lexicon, path=LEXICON_FILE):
+    tmp_path = path + ".tmp"
+
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for token in sorted(lexicon):
+            f.write(f"{token} {lexicon[token]}\n")
+
+    os.replace(tmp_path, path)
+
+
+# Добавление слов страницы: lemmas — лемма -> токены этой леммы
+def add_page_lemmas(lexicon, lemmas):
+    for lemma, tokens in lemmas.items():
+        lexicon[lemma] = lemma
+        for token in tokens:
+            lexicon[token] = lemma
+
+
+# Словарь по файлам <doc_id>_lemmas.txt (при сборке отдельными скриптами заданий)
+def build_lexicon(page_terms_dir=OUTPUT_DIR):
+    lexicon = {}
+
+    for filename in os.listdir(page_terms_dir):
+        if filename.endswith("_lemmas.txt"):
+            with open(os.path.join(page_terms_dir, filename), "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.split()
+                    if parts:
+                        add_page_lemmas(lexicon, {parts[0]: parts[1:]})
+
+    return lexicon
+
+
+class QueryAnalyzer:
+    def __init__(self, lexicon=None):
+        self.lexicon = load_lexicon() if lexicon is None else lexicon
+
+    # Лемма одного слова запроса
+    def lemma(self, token):
+        return self.lexicon.get(token) or lemmatize_word(token)
+
+    # Леммы слов текста запроса в порядке следования
+    def terms(self, text):
+        return [self.lemma(token) for token in tokenize(text)]
+
+
+_analyzer = None
+_analyzer_lock = threading.Lock()
+
+
+# Общий анализатор процесса, словарь читается при первом обращении
+def get_query_analyzer():
+    global _analyzer
+
+    if _analyzer is None:
+        with _analyzer_lock:
+            if _analyzer is None:
+                _analyzer = QueryAnalyzer()
+
+    return _analyzer
+
+
+# Перечитать словарь (после пересборки индекса)
+def reload_query_analyzer():
+    global _analyzer
+
+    _analyzer = QueryAnalyzer()
+    return _analyzer
@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import OrderedDict
+import metrics
+
+# Кеш результатов поиска: LRU с ограничением по числу записей, по памяти и по времени жизни.
+# Ключ включает поколение индекса, поэтому результаты старого индекса после его
+# замены не возвращаются, а clear() освобождает их память сразу.
+
+MAX_ENTRIES = 10000  # Сколько разных запросов хранить
+MAX_MEMORY = 32 * 1024 * 1024  # Сколько байт можно занять результатами
+TTL = 300.0  # Сколько секунд результат считается свежим; 0 — без ограничения
+
+
+# Примерный объём результата — списка кортежей (doc_id, URL, score) — в памяти (байт)
+def results_memory_size(results):
+    return 200 + sum(120 + sum(len(value) for value in item if isinstance(value, str))
+                     for item in results)
+
+
+class QueryCache:
+    def __init__(self, max_entries=MAX_ENTRIES, max_memory=MAX_MEMORY, ttl=TTL):
+        self.max_entries = max_entries
+        self.max_memory = max_memory
+        self.ttl = ttl
+
+        self._entries = OrderedDict()  # ключ -> (время записи, результаты, размер)
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Результаты по ключу или None; устаревшая запись удаляется
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and self.ttl and time.monotonic() - entry[0] > self.ttl:
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, results):
+        size = results_memory_size(results)
+        if self.max_entries <= 0 or size > self.max_memory:
+            return
+
+        evicted = 0
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (time.monotonic(), results, size)
+            self._size += size
+
+            while len(self._entries) > self.max_entries or self._size > self.max_memory:
+                self._remove(next(iter(self._entries)))
+                evicted += 1
+            self.evictions += evicted
+
+        if evicted:
+            metrics.inc("query_cache_evictions_total", evicted)
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._size -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "memory": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / requests if requests else 0.0,
+            }
@@ -0,0 +1,773 @@
+import argparse
+import heapq
+import json
+import math
+import os
+import threading
+import time
+from bisect import bisect_right
+from collections import Counter
+
+import metrics
+import text_processing
+from index_format import INDEX_BIN_FILE, IdfValues, IndexReader, IndexWriter, doc_sort_key, file_version
+from lemmatizer import get_lemmatizer
+from positional_index import PositionalIndexReader, PositionalIndexWriter, load_page_positions
+from query_analyzer import add_page_lemmas, load_lexicon, save_lexicon
+from tfidf import load_doc_urls
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Инкрементальный индекс из сегментов.
+#
+# Сегмент — неизменяемая пара файлов: <имя>.bin в формате index.bin, где вместо
+# TF-IDF хранится TF (count / длина документа), и <имя>.pos в формате positions.bin.
+# Новые и изменённые документы записываются новым маленьким сегментом, удаления
+# и старые версии документов помечаются в манифесте (tombstones) без перезаписи
+# файлов. IDF считается при запросе по сумме df сегментов, поэтому добавление
+# документа не требует пересчёта остальных. Фоновое слияние объединяет мелкие
+# сегменты и вычищает удалённые документы.
+#
+# IDF со временем меняется, поэтому нормы векторов документов и границы MaxScore,
+# записанные в сегмент (по IDF на момент записи), при поиске не используются: снимок
+# пересчитывает их по своему IDF при первом обращении, и score остаётся косинусом.
+# df удалённых документов учитывается до слияния.
+
+SEGMENTS_DIR = "../segments"  # Папка с сегментами и манифестом
+MANIFEST_NAME = "segments.json"  # Список сегментов и удалённых документов
+LOCK_NAME = "segments.lock"  # Файл-замок: манифест меняет один процесс за раз
+MAX_SEGMENTS = 8  # Больше сегментов — сливаем соседние
+MERGE_FACTOR = 4  # Сколько соседних сегментов сливается за раз
+MAX_DELETED_RATIO = 0.5  # Сегмент, где удалено больше этой доли, переписывается
+POLL_INTERVAL = 2.0  # Как часто (сек) проверять очередь изменений в режиме --watch
+
+
+def manifest_path(segments_dir=SEGMENTS_DIR):
+    return os.path.join(segments_dir, MANIFEST_NAME)
+
+
+def load_manifest(segments_dir=SEGMENTS_DIR):
+    path = manifest_path(segments_dir)
+    if not os.path.exists(path):
+        return {"generation": 0, "next_segment": 1, "segments": []}
+
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# Манифест заменяется атомарно: читатели видят либо старый, либо новый набор сегментов
+def save_manifest(manifest, segments_dir=SEGMENTS_DIR):
+    manifest["generation"] += 1
+
+    path = manifest_path(segments_dir)
+    tmp_path = path + ".tmp"
+
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+    os.replace(tmp_path, path)
+
+
+# Сегменты новее остальных индексов (paths) — поиск должен читать их
+def segments_are_current(paths=(INDEX_BIN_FILE,), segments_dir=SEGMENTS_DIR):
+    path = manifest_path(segments_dir)
+    if not os.path.exists(path):
+        return False
+
+    mtime = os.path.getmtime(path)
+    return all(not os.path.exists(other) or mtime >= os.path.getmtime(other) for other in paths)
+
+
+class ManifestLock:
+    """
+    Блокировка изменений манифеста между процессами (segments.py --watch и --merge-all,
+    полная сборка) и между потоками одного процесса (фоновое слияние).
+    Между процессами — блокировка файла LOCK_NAME в папке сегментов.
+    """
+
+    def __init__(self, segments_dir=SEGMENTS_DIR):
+        self.path = os.path.join(segments_dir, LOCK_NAME)
+        self._thread_lock = threading.Lock()
+        self._file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            self._file = open(self.path, "a+b")
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            else:
+                # msvcrt.locking не ждёт дольше 10 секунд — ждём сами
+                self._file.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        time.sleep(0.05)
+        except BaseException:
+            if self._file is not None:
+                self._file.close()
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._file.close()
+            self._file = None
+            self._thread_lock.release()
+
+
+def segment_files(segments_dir, name):
+    return os.path.join(segments_dir, name + ".bin"), os.path.join(segments_dir, name + ".pos")
+
+
+def remove_segment_files(segments_dir, name):
+    for path in segment_files(segments_dir, name):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def live_count(entry):
+    return entry["docs"] - len(entry["deleted"])
+
+
+# IDF по df и числу живых документов коллекции
+def idf_value(live, df):
+    return math.log(live / df) if df and live > df else 0.0
+
+
+# Норма вектора документа: веса — TF * IDF
+def doc_norm(length, lemma_positions, idf):
+    if length <= 0:
+        return 0.0
+    return math.sqrt(sum((len(positions) / length * idf(lemma)) ** 2
+                         for lemma, positions in lemma_positions.items()))
+
+
+# Запись сегмента. docs — [(doc_id, URL, длина, лемма -> позиции)],
+# idf(лемма) — IDF коллекции для норм документов
+def write_segment(segments_dir, name, docs, idf):
+    index_path, positions_path = segment_files(segments_dir, name)
+    index_writer = IndexWriter(index_path)
+    positions_writer = PositionalIndexWriter(positions_path)
+
+    lengths = []
+    postings = {}
+
+    for doc_id, url, length, lemma_positions in docs:
+        doc = index_writer.add_document(doc_id, url, length, doc_norm(length, lemma_positions, idf))
+        positions_writer.add_document(doc_id)
+        lengths.append(length)
+
+        for lemma, positions in lemma_positions.items():
+            postings.setdefault(lemma, []).append((doc, positions))
+
+    for lemma in sorted(postings):
+        entries = postings[lemma]
+        doc_numbers = [doc for doc, _ in entries]
+        tfs = [len(positions) / lengths[doc] if lengths[doc] > 0 else 0.0 for doc, positions in entries]
+
+        index_writer.add_term(lemma, idf(lemma), doc_numbers, tfs)
+        positions_writer.add_term(lemma, entries)
+
+    index_writer.close()
+    positions_writer.close()
+
+
+# Неудалённые документы сегмента в виде, пригодном для write_segment
+def read_segment_documents(segments_dir, entry):
+    index_path, positions_path = segment_files(segments_dir, entry["name"])
+    reader = IndexReader(index_path)
+    positions_reader = PositionalIndexReader(positions_path)
+
+    deleted = set(entry["deleted"])
+    live = [doc for doc in range(reader.doc_count) if doc not in deleted]
+    docs = {doc: (reader.doc_id(doc), reader.doc_url(doc), reader.doc_length(doc), {}) for doc in live}
+
+    live_set = set(live)
+    for lemma in positions_reader.terms():
+        for doc, positions in positions_reader.positions(lemma, live_set).items():
+            docs[doc][3][lemma] = positions
+
+    reader.close()
+    positions_reader.close()
+    return [docs[doc] for doc in live]
+
+
+class SegmentedIndex:
+    """
+    Снимок набора сегментов для поиска. Интерфейс совпадает с IndexReader
+    (postings, norm, max_score, idf_values, doc_id, ...), поэтому с ним работают
+    search_index, search_top_k, SparseVectorIndex и булев поиск. Номера документов
+    сквозные: номер в сегменте + число документов в предыдущих сегментах.
+    Снимок не меняется; refresh() возвращает новый, если манифест обновился.
+    Заменённый снимок закрывается, когда по нему закончатся запросы: запрос из
+    другого потока берёт снимок через acquire() и отпускает через release().
+    """
+
+    def __init__(self, segments_dir=SEGMENTS_DIR, memory_budget=0, manifest=None):
+        self.segments_dir = segments_dir
+        self.memory_budget = memory_budget
+
+        self._users = 0  # Сколько запросов сейчас читают снимок
+        self._retired = False  # Снимок заменён новым
+        self._users_lock = threading.Lock()
+
+        # Слияние может удалить файлы между чтением манифеста и открытием сегментов
+        for _ in range(5):
+            self.version = self._manifest_version()
+            self.manifest = manifest or load_manifest(segments_dir)
+            try:
+                self._open()
+                break
+            except FileNotFoundError:
+                self.close()
+                if manifest is not None:
+                    raise
+        else:
+            raise RuntimeError(f"{segments_dir}: не удалось открыть согласованный набор сегментов")
+
+        self.idf_values = IdfValues(self)
+        self.positions = SegmentPositions(self)
+        self._doc_numbers = None
+
+        self._norms = None  # Нормы документов по IDF снимка (считаются при первом запросе)
+        self._norms_lock = threading.Lock()
+        self._max_scores = {}  # термин -> граница вклада по этим нормам
+
+    def _manifest_version(self):
+        return file_version(manifest_path(self.segments_dir))
+
+    def _open(self):
+        self.readers = []
+        self.positions_readers = []
+        self.deleted = []
+        self.bases = []
+        self.doc_count = 0
+
+        segments = self.manifest["segments"]
+        budget = self.memory_budget // max(1, len(segments))
+
+        for entry in segments:
+            index_path, positions_path = segment_files(self.segments_dir, entry["name"])
+            self.readers.append(IndexReader(index_path, memory_budget=budget))
+            self.positions_readers.append(PositionalIndexReader(positions_path))
+            self.deleted.append(set(entry["deleted"]))
+            self.bases.append(self.doc_count)
+            self.doc_count += self.readers[-1].doc_count
+
+        self.live_count = self.doc_count - sum(len(deleted) for deleted in self.deleted)
+
+    def close(self):
+        for reader in getattr(self, "readers", []) + getattr(self, "positions_readers", []):
+            reader.close()
+        self.readers = []
+        self.positions_readers = []
+
+    # Снимок для запроса; False — снимок уже заменён и закрыт, нужно взять новый
+    def acquire(self):
+        with self._users_lock:
+            if self._retired and self._users == 0:
+                return False
+            self._users += 1
+            return True
+
+    def release(self):
+        with self._users_lock:
+            self._users -= 1
+            if not self._retired or self._users:
+                return
+        self.close()
+
+    # Снимок заменён: закрывается сразу или после последнего запроса по нему
+    def retire(self):
+        with self._users_lock:
+            self._retired = True
+            if self._users:
+                return
+        self.close()
+
+    # Новый снимок, если манифест изменился с момента открытия; старый закрывается
+    def refresh(self):
+        if self._manifest_version() == self.version:
+            return self
+
+        snapshot = SegmentedIndex(self.segments_dir, self.memory_budget)
+        self.retire()
+        return snapshot
+
+    # Документы
+
+    def _locate(self, doc):
+        segment = bisect_right(self.bases, doc) - 1
+        return segment, doc - self.bases[segment]
+
+    def is_deleted(self, doc):
+        segment, local = self._locate(doc)
+        return local in self.deleted[segment]
+
+    def live_docs(self):
+        return [doc for doc in range(self.doc_count) if not self.is_deleted(doc)]
+
+    def doc_id(self, doc):
+        segment, local = self._locate(doc)
+        return self.readers[segment].doc_id(local)
+
+    def doc_url(self, doc):
+        segment, local = self._locate(doc)
+        return self.readers[segment].doc_url(local)
+
+    def doc_length(self, doc):
+        segment, local = self._locate(doc)
+        return self.readers[segment].doc_length(local)
+
+    def norm(self, doc):
+        return self._get_norms()[doc]
+
+    def _get_norms(self):
+        if self._norms is None:
+            with self._norms_lock:
+                if self._norms is None:
+                    self._norms = self._compute_norms()
+        return self._norms
+
+    # Нормы по тому же IDF, с которым postings считает веса: один проход по всем
+    # спискам сегментов. Приложение платит за него при прогреве нового снимка
+    def _compute_norms(self):
+        df = Counter()
+        for reader in self.readers:
+            for term, term_df in reader.term_dfs():
+                df[term] += term_df
+
+        squares = [0.0] * self.doc_count
+        for base, reader in zip(self.bases, self.readers):
+            for term_id, term in enumerate(reader.terms()):
+                idf = idf_value(self.live_count, df[term])
+                if idf == 0:
+                    continue
+
+                docs, tfs = reader.read_postings(term_id)
+                for doc, tf in zip(docs, tfs):
+                    weight = tf * idf
+                    squares[base + doc] += weight * weight
+
+        return [math.sqrt(value) for value in squares]
+
+    # Сквозной номер актуальной версии документа; None, если его нет
+    def doc_number(self, doc_id):
+        if self._doc_numbers is None:
+            self._doc_numbers = {self.doc_id(doc): doc for doc in self.live_docs()}
+        return self._doc_numbers.get(doc_id)
+
+    # Термины
+
+    def terms(self):
+        previous = None
+        for term in heapq.merge(*(reader.terms() for reader in self.readers)):
+            if term != previous:
+                yield term
+                previous = term
+
+    def df(self, term):
+        return sum(info[0] for info in (reader.term_info(term) for reader in self.readers) if info)
+
+    def idf(self, term):
+        df = self.df(term)
+        if df == 0:
+            return None
+        return idf_value(self.live_count, df)
+
+    # Граница вклада: max(w / ||d||) по живым документам; запоминается только
+    # для терминов индекса, поэтому не больше словаря
+    def max_score(self, term):
+        max_score = self._max_scores.get(term)
+        if max_score is not None:
+            return max_score
+
+        docs, weights = self.postings(term)
+        if not docs:
+            return 0.0
+
+        norms = self._get_norms()
+        max_score = max((weight / norms[doc] for doc, weight in zip(docs, weights) if norms[doc] > 0),
+                        default=0.0)
+        self._max_scores[term] = max_score
+        return max_score
+
+    # Номера документов и веса TF-IDF (IDF — на момент запроса)
+    def postings(self, term):
+        idf = self.idf(term)
+        if idf is None:
+            return [], []
+
+        docs = []
+        weights = []
+
+        for base, reader, deleted in zip(self.bases, self.readers, self.deleted):
+            segment_docs, tfs = reader.postings(term)
+            for doc, tf in zip(segment_docs, tfs):
+                if doc not in deleted:
+                    docs.append(base + doc)
+                    weights.append(tf * idf)
+
+        return docs, weights
+
+    # Только номера документов (для булева поиска)
+    def doc_postings(self, term):
+        docs = []
+        for base, reader, deleted in zip(self.bases, self.readers, self.deleted):
+            docs.extend(base + doc for doc in reader.doc_postings(term) if doc not in deleted)
+        return docs
+
+
+# После полной пересборки (build_index, tfidf, boolean_search) сегменты, если они
+# используются, пересоздаются из её результатов. Иначе после следующего
+# инкрементального обновления манифест снова окажется новее индексов, и поиск
+# будет читать старые сегменты без изменений, учтённых пересборкой
+def reset_segments(segments_dir=SEGMENTS_DIR):
+    if not os.path.exists(manifest_path(segments_dir)):
+        return
+
+    count = IncrementalIndexer(segments_dir).reset()
+    print(f"[+] Сегменты пересозданы по результатам полной сборки: {count} документов")
+
+
+# Снимок сегментов, на котором построен индекс поиска, или None
+def index_segments(index):
+    if isinstance(index, SegmentedIndex):
+        return index
+    return getattr(index, "segments", None)
+
+
+# Позиции лемм по сегментам (интерфейс PositionalIndexReader для фраз и NEAR)
+class SegmentPositions:
+    def __init__(self, index):
+        self.index = index
+
+    def doc_number(self, doc_id):
+        return self.index.doc_number(doc_id)
+
+    def positions(self, term, docs):
+        result = {}
+        index = self.index
+
+        for segment, (base, reader) in enumerate(zip(index.bases, index.positions_readers)):
+            end = base + index.readers[segment].doc_count
+            local = {doc - base for doc in docs if base <= doc < end}
+            for doc, positions in reader.positions(term, local).items():
+                result[base + doc] = positions
+
+        return result
+
+
+# Выбор сегментов для слияния: номера в манифесте или None
+def select_merge(manifest):
+    segments = manifest["segments"]
+
+    # Сегмент, где удалена большая часть документов, переписывается отдельно
+    for i, entry in enumerate(segments):
+        if entry["docs"] and len(entry["deleted"]) / entry["docs"] > MAX_DELETED_RATIO:
+            return [i]
+
+    if len(segments) <= MAX_SEGMENTS:
+        return None
+
+    # MERGE_FACTOR соседних сегментов с наименьшим числом живых документов
+    sizes = [live_count(entry) for entry in segments]
+    start = min(range(len(segments) - MERGE_FACTOR + 1),
+                key=lambda i: sum(sizes[i:i + MERGE_FACTOR]))
+    return list(range(start, start + MERGE_FACTOR))
+
+
+class IncrementalIndexer:
+    """
+    Запись изменений в сегменты и слияние сегментов. Манифест меняется
+    только под блокировкой (общей для всех процессов); новый сегмент пишется
+    до изменения манифеста, поэтому поиск никогда не видит недописанных файлов.
+    """
+
+    def __init__(self, segments_dir=SEGMENTS_DIR):
+        self.segments_dir = segments_dir
+        os.makedirs(segments_dir, exist_ok=True)
+        self.lock = ManifestLock(segments_dir)
+        self.merge_thread = None
+
+    # Имя нового сегмента (под блокировкой). Имя закрепляется созданием пустого файла
+    # сегмента, а не записью манифеста: новый манифест заставил бы все процессы
+    # приложения перечитать индекс и сбросить кеш результатов. Имя, закреплённое
+    # незавершённым слиянием, ещё не записано в манифест, поэтому занятые имена пропускаются
+    def _reserve_name(self, manifest):
+        while True:
+            name = f"seg_{manifest['next_segment']:06d}"
+            manifest["next_segment"] += 1
+
+            index_path, _ = segment_files(self.segments_dir, name)
+            try:
+                os.close(os.open(index_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            except FileExistsError:
+                continue
+            return name
+
+    # IDF для норм нового сегмента: df документов docs плюс df сегментов readers
+    def _idf_function(self, readers, docs, live):
+        new_df = Counter(lemma for _, _, _, lemma_positions in docs for lemma in lemma_positions)
+
+        def idf(lemma):
+            df = new_df[lemma] + sum(info[0] for info in (reader.term_info(lemma) for reader in readers)
+                                     if info)
+            return idf_value(live, df)
+
+        return idf
+
+    # Документы коллекции из файлов page_terms в виде, пригодном для write_segment
+    def _page_terms_documents(self, page_terms_dir):
+        doc_urls = load_doc_urls()
+        doc_ids = sorted(
+            (filename[:-len("_positions.txt")] for filename in os.listdir(page_terms_dir)
+             if filename.endswith("_positions.txt")),
+            key=doc_sort_key,
+        )
+
+        docs = []
+        for doc_id in doc_ids:
+            with open(os.path.join(page_terms_dir, f"{doc_id}_tf.txt"), "r", encoding="utf-8") as f:
+                length = int(f.readline() or 0)
+            positions = load_page_positions(os.path.join(page_terms_dir, f"{doc_id}_positions.txt"))
+            docs.append((doc_id, doc_urls.get(doc_id, ""), length, positions))
+
+        return docs
+
+    # Первый сегмент из файлов page_terms (после полной обработки text_processing/build_index)
+    def initialize(self, page_terms_dir=text_processing.OUTPUT_DIR):
+        docs = self._page_terms_documents(page_terms_dir)
+        self.update(docs, [])
+        return len(docs)
+
+    # Замена всех сегментов одним, собранным из файлов page_terms
+    def reset(self, page_terms_dir=text_processing.OUTPUT_DIR):
+        # Файлы читаются под блокировкой: обновление, пришедшее во время чтения,
+        # не потеряется при замене сегментов
+        with self.lock:
+            docs = self._page_terms_documents(page_terms_dir)
+            manifest = load_manifest(self.segments_dir)
+            old_names = [entry["name"] for entry in manifest["segments"]]
+
+            name = self._reserve_name(manifest)
+            write_segment(self.segments_dir, name, docs, self._idf_function([], docs, len(docs)))
+            manifest["segments"] = [{"name": name, "docs": len(docs), "deleted": []}]
+            save_manifest(manifest, self.segments_dir)
+
+        for old_name in old_names:
+            remove_segment_files(self.segments_dir, old_name)
+
+        return len(docs)
+
+    # Новые версии документов docs и удаление deleted_ids одной сменой манифеста
+    def update(self, docs, deleted_ids):
+        with self.lock:
+            manifest = load_manifest(self.segments_dir)
+            index = SegmentedIndex(self.segments_dir, manifest=manifest)
+
+            # Старые версии обновлённых и удалённые документы помечаются удалёнными
+            tombstoned = 0
+            for doc_id in [doc[0] for doc in docs] + list(deleted_ids):
+                doc = index.doc_number(doc_id)
+                if doc is not None:
+                    segment, local = index._locate(doc)
+                    manifest["segments"][segment]["deleted"].append(local)
+                    tombstoned += 1
+
+            if docs:
+                name = self._reserve_name(manifest)
+                live = index.live_count - tombstoned + len(docs)
+                write_segment(self.segments_dir, name, docs, self._idf_function(index.readers, docs, live))
+                manifest["segments"].append({"name": name, "docs": len(docs), "deleted": []})
+
+            index.close()
+            save_manifest(manifest, self.segments_dir)
+
+    # Слияние сегментов с номерами positions (по умолчанию — по политике select_merge)
+    def merge(self, positions=None):
+        with self.lock:
+            manifest = load_manifest(self.segments_dir)
+            if positions is None:
+                positions = select_merge(manifest)
+            if not positions:
+                return False
+
+            sources = [dict(manifest["segments"][i], deleted=list(manifest["segments"][i]["deleted"]))
+                       for i in positions]
+            name = self._reserve_name(manifest)
+            next_segment = manifest["next_segment"]
+
+        # Чтение и запись — без блокировки: обновления продолжают приходить
+        started = time.perf_counter()
+        docs = []
+        remap = {}  # (имя сегмента, номер в сегменте) -> номер в новом сегменте
+        for entry in sources:
+            deleted = set(entry["deleted"])
+            live = [doc for doc in range(entry["docs"]) if doc not in deleted]
+            for local, doc in zip(live, read_segment_documents(self.segments_dir, entry)):
+                remap[(entry["name"], local)] = len(docs)
+                docs.append(doc)
+
+        if docs:
+            index = SegmentedIndex(self.segments_dir)
+            source_names = {entry["name"] for entry in sources}
+            readers = [reader for reader, entry in zip(index.readers, index.manifest["segments"])
+                       if entry["name"] not in source_names]
+            write_segment(self.segments_dir, name, docs,
+                          self._idf_function(readers, docs, index.live_count))
+            index.close()
+
+        with self.lock:
+            manifest = load_manifest(self.segments_dir)
+            current = {entry["name"]: entry for entry in manifest["segments"]}
+
+            # Сегменты заменила полная пересборка (reset) — результат слияния не нужен
+            if any(entry["name"] not in current for entry in sources):
+                remove_segment_files(self.segments_dir, name)
+                return False
+
+            # Удаления, пришедшие во время слияния, переносятся на новый сегмент
+            new_deleted = []
+            for entry in sources:
+                for local in set(current[entry["name"]]["deleted"]) - set(entry["deleted"]):
+                    new_deleted.append(remap[(entry["name"], local)])
+
+            source_names = {entry["name"] for entry in sources}
+            first = min(i for i, entry in enumerate(manifest["segments"]) if entry["name"] in source_names)
+            segments = [entry for entry in manifest["segments"] if entry["name"] not in source_names]
+            if docs:
+                segments.insert(first, {"name": name, "docs": len(docs), "deleted": sorted(new_deleted)})
+            else:
+                remove_segment_files(self.segments_dir, name)
+
+            manifest["segments"] = segments
+            # Номер закреплённого имени в манифест ещё не записан — учитываем его сейчас
+            manifest["next_segment"] = max(manifest["next_segment"], next_segment)
+            save_manifest(manifest, self.segments_dir)
+
+        for entry in sources:
+            remove_segment_files(self.segments_dir, entry["name"])
+
+        metrics.observe("build_stage_seconds", time.perf_counter() - started, stage="segment_merge")
+
+        print(f"[+] Слияние сегментов: {', '.join(entry['name'] for entry in sources)} -> "
+              f"{name if docs else 'удалены'} ({len(docs)} документов)")
+        return True
+
+    def merge_all(self):
+        manifest = load_manifest(self.segments_dir)
+        if manifest["segments"]:
+            self.merge(list(range(len(manifest["segments"]))))
+
+    # Слияние в фоне, пока политика находит, что сливать
+    def maybe_merge(self, background=True):
+        if self.merge_thread is not None and self.merge_thread.is_alive():
+            return
+
+        if select_merge(load_manifest(self.segments_dir)) is None:
+            return
+
+        def merge_loop():
+            while self.merge():
+                pass
+
+        if background:
+            self.merge_thread = threading.Thread(target=merge_loop, daemon=True)
+            self.merge_thread.start()
+        else:
+            merge_loop()
+
+    def wait_merges(self):
+        if self.merge_thread is not None:
+            self.merge_thread.join()
+
+    # Обработка очереди изменений краулера: возвращает число изменённых документов
+    def process_queue(self, changes_path=text_processing.CHANGED_DOCS_FILE):
+        changes = text_processing.claim_changed_docs(changes_path)
+        if not changes:
+            text_processing.finish_changed_docs(changes_path)
+            return 0
+
+        doc_urls = load_doc_urls()
+        lexicon = load_lexicon()
+        docs = []
+        deleted_ids = []
+
+        for doc_id, kind in sorted(changes.items(), key=lambda item: doc_sort_key(item[0])):
+            file_path = os.path.join(text_processing.PAGES_DIR, f"{doc_id}.txt")
+
+            if kind == "deleted" or not os.path.isfile(file_path):
+                text_processing.remove_document(doc_id)
+                deleted_ids.append(doc_id)
+                continue
+
+            terms, timings = text_processing.analyze_document(doc_id, file_path)
+            for stage, value in timings.items():
+                metrics.observe("document_stage_seconds", value, stage=stage)
+            metrics.inc("documents_processed_total")
+
+            text_processing.write_document_files(doc_id, terms)
+            add_page_lemmas(lexicon, terms["lemmas"])
+            docs.append((doc_id, doc_urls.get(doc_id, ""), terms["length"], terms["positions"]))
+
+        get_lemmatizer().save_cache()
+        if docs:
+            save_lexicon(lexicon)
+        with metrics.timer("build_stage_seconds", stage="segment_update"):
+            self.update(docs, deleted_ids)
+        text_processing.finish_changed_docs(changes_path)
+
+        print(f"[+] Сегменты обновлены: изменено {len(docs)}, удалено {len(deleted_ids)}")
+        return len(changes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Инкрементальное обновление индекса сегментами")
+    parser.add_argument("--watch", action="store_true",
+                        help="следить за очередью изменений и сливать сегменты в фоне")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL,
+                        help="период проверки очереди, сек")
+    parser.add_argument("--merge-all", action="store_true", help="слить все сегменты в один")
+    args = parser.parse_args()
+
+    indexer = IncrementalIndexer()
+
+    if not os.path.exists(manifest_path()):
+        count = indexer.initialize()
+        print(f"[+] Создан первый сегмент: {count} документов")
+
+    if args.merge_all:
+        indexer.merge_all()
+        return
+
+    while True:
+        if indexer.process_queue():
+            metrics.write_summary("segments")
+        indexer.maybe_merge(background=args.watch)
+
+        if not args.watch:
+            break
+        time.sleep(args.interval)
+
+    indexer.wait_merges()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import hashlib
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import crawler
+
+PAGE_COUNT = 6
+
+TEXT = ("Поисковая система скачивает страницы, извлекает из них текст, приводит слова "
+        "к начальной форме и строит обратный индекс, по которому затем ищет документы. ")
+
+
+def page_html(number, version=1):
+    return (f"<html><body><h1>Страница {number}</h1>"
+            f"<p>Версия {version}. {TEXT * 3}</p></body></html>")
+
+
+# Локальный сайт: отдаёт ETag и отвечает 304 на If-None-Match с тем же ETag.
+# Первые страницы отвечают медленнее, поэтому ответы приходят не по порядку URL
+class Site:
+    def __init__(self):
+        self.pages = {f"/page{number}": page_html(number) for number in range(PAGE_COUNT)}
+        self.requests = []  # (путь, If-None-Match, код ответа)
+        self.lock = threading.Lock()
+
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                site.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, number):
+        return f"http://127.0.0.1:{self.server.server_port}/page{number}"
+
+    def etag(self, path):
+        return '"' + hashlib.sha256(self.pages[path].encode("utf-8")).hexdigest()[:16] + '"'
+
+    def handle(self, handler):
+        path = handler.path
+        if_none_match = handler.headers.get("If-None-Match")
+
+        if path not in self.pages:
+            status = 404
+        elif if_none_match == self.etag(path):
+            status = 304
+        else:
+            status = 200
+
+        with self.lock:
+            self.requests.append((path, if_none_match, status))
+
+        if status == 200:
+            time.sleep(0.05 * (PAGE_COUNT - int(path[len("/page"):])))
+
+        handler.send_response(status)
+        if status != 200:
+            handler.send_header("Content-Length", "0")
+            handler.end_headers()
+            return
+
+        body = self.pages[path].encode("utf-8")
+        handler.send_header("Content-Type", "text/html; charset=utf-8")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.send_header("ETag", self.etag(path))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def site():
+    site = Site()
+    yield site
+    site.close()
+
+
+def run_crawl(site, work_dir):
+    urls = [site.url(number) for number in range(PAGE_COUNT)]
+    return crawler.crawl(
+        urls,
+        output_dir=os.path.join(work_dir, "pages"),
+        index_path=os.path.join(work_dir, "index.txt"),
+        text_dir=os.path.join(work_dir, "pages_text"),
+        state_path=os.path.join(work_dir, "crawl_state.json"),
+        changes_path=os.path.join(work_dir, "changed_docs.txt"),
+        min_pages=PAGE_COUNT,
+        concurrency=4,
+        delay=0,
+    )
+
+
+def read_lines(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().splitlines()
+
+
+def test_doc_ids_follow_url_order(site, tmp_path):
+    first = tmp_path / "first"
+    second = tmp_path / "second"
+
+    assert run_crawl(site, str(first)) == PAGE_COUNT
+    assert run_crawl(site, str(second)) == PAGE_COUNT
+
+    expected = [f"{number + 1} {site.url(number)}" for number in range(PAGE_COUNT)]
+    assert read_lines(first / "index.txt") == expected
+    assert read_lines(second / "index.txt") == expected
+
+
+def test_second_run_uses_conditional_requests(site, tmp_path):
+    run_crawl(site, str(tmp_path))
+    index_before = read_lines(tmp_path / "index.txt")
+    os.remove(tmp_path / "changed_docs.txt")
+
+    site.requests.clear()
+    site.pages["/page2"] = page_html(2, version=2)
+    run_crawl(site, str(tmp_path))
+
+    # Каждая известная страница перепроверяется с ETag прошлого ответа
+    assert len(site.requests) == PAGE_COUNT
+    assert all(if_none_match for _, if_none_match, _ in site.requests)
+
+    statuses = {path: status for path, _, status in site.requests}
+    assert statuses.pop("/page2") == 200
+    assert set(statuses.values()) == {304}
+
+    # Номера не меняются, в очередь попадает только изменившаяся страница
+    assert read_lines(tmp_path / "index.txt") == index_before
+    assert read_lines(tmp_path / "changed_docs.txt") == ["3 updated"]
+    with open(tmp_path / "pages_text" / "3.txt", "r", encoding="utf-8") as f:
+        assert "Версия 2" in f.read()
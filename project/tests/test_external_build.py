@@ -0,0 +1,48 @@
+import os
+import random
+
+import external_build
+from external_build import RunWriter, merge_runs
+
+
+def test_runs_are_merged_in_passes(tmp_path, monkeypatch):
+    rng = random.Random(3)
+    documents = {
+        doc: {f"lemma{rng.randrange(30):02d}": sorted(rng.sample(range(50), rng.randint(1, 4)))
+              for _ in range(rng.randint(1, 8))}
+        for doc in range(1, 61)
+    }
+
+    # Сколько прогонов открыто одновременно при слиянии
+    open_runs = {"current": 0, "max": 0}
+    read_run = external_build.read_run
+
+    def counting_read_run(path):
+        open_runs["current"] += 1
+        open_runs["max"] = max(open_runs["max"], open_runs["current"])
+        try:
+            yield from read_run(path)
+        finally:
+            open_runs["current"] -= 1
+
+    monkeypatch.setattr(external_build, "read_run", counting_read_run)
+
+    # Нулевой бюджет: каждый документ сбрасывается отдельным прогоном
+    runs_dir = str(tmp_path / "runs")
+    writer = RunWriter(runs_dir=runs_dir, memory_budget=0, fan_in=4)
+    for doc, lemma_positions in documents.items():
+        writer.add_document(doc, lemma_positions)
+    paths = writer.close()
+
+    assert len(paths) <= 4
+    assert sorted(os.listdir(runs_dir)) == sorted(os.path.basename(path) for path in paths)
+
+    merged = {lemma: list(postings) for lemma, postings in merge_runs(paths)}
+    expected = {}
+    for doc, lemma_positions in documents.items():
+        for lemma, positions in lemma_positions.items():
+            expected.setdefault(lemma, []).append((doc, positions))
+
+    assert merged == {lemma: expected[lemma] for lemma in sorted(expected)}
+    assert list(merged) == sorted(expected)
+    assert open_runs["max"] <= 4
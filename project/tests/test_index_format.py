@@ -0,0 +1,22 @@
+import random
+
+from index_format import IndexReader, write_index
+
+
+# Граница MaxScore равна наибольшему вкладу термина по весам, записанным в файл
+def test_max_score_matches_stored_weights(tmp_path):
+    rng = random.Random(11)
+    terms = [f"term{number}" for number in range(20)]
+    doc_vectors = {
+        str(doc_id): {term: rng.uniform(0.001, 3.0) / 7 for term in rng.sample(terms, rng.randint(1, 8))}
+        for doc_id in range(1, 201)
+    }
+    path = str(tmp_path / "index.bin")
+    write_index(path, doc_vectors, {term: 1.0 for term in terms})
+
+    reader = IndexReader(path)
+    for term in reader.terms():
+        docs, weights = reader.postings(term)
+        assert reader.max_score(term) == max(weight / reader.norm(doc)
+                                             for doc, weight in zip(docs, weights))
+    reader.close()
@@ -0,0 +1,97 @@
+import math
+import random
+
+import pytest
+
+import vector_search
+from segments import IncrementalIndexer, SegmentedIndex
+from vector_search import VectorIndex, search_index
+
+LEMMAS = [f"lemma{number}" for number in range(12)]
+
+
+# Документ для write_segment: (doc_id, URL, длина, лемма -> позиции)
+def make_document(rng, doc_id):
+    words = [rng.choice(LEMMAS[:rng.randint(3, len(LEMMAS))]) for _ in range(rng.randint(5, 30))]
+    lemma_positions = {}
+    for position, lemma in enumerate(words):
+        lemma_positions.setdefault(lemma, []).append(position)
+    return doc_id, f"http://example.com/{doc_id}", len(words), lemma_positions
+
+
+# Полная пересборка по живым документам: TF-IDF с IDF = log(N / df), как в tfidf.py
+def rebuild(documents):
+    df = {}
+    for _, _, _, lemma_positions in documents.values():
+        for lemma in lemma_positions:
+            df[lemma] = df.get(lemma, 0) + 1
+
+    idf_values = {lemma: math.log(len(documents) / count) for lemma, count in df.items()}
+    doc_vectors = {
+        doc_id: {lemma: len(positions) / length * idf_values[lemma]
+                 for lemma, positions in lemma_positions.items()}
+        for doc_id, (_, _, length, lemma_positions) in documents.items()
+    }
+    return VectorIndex(doc_vectors, idf_values)
+
+
+def scores_by_doc_id(index, query, k=None):
+    return {index.doc_id(doc): score for doc, score in search_index(query, index, k)}
+
+
+@pytest.fixture
+def plain_queries(monkeypatch):
+    # Запросы — сразу леммы через пробел, без морфологического анализа
+    monkeypatch.setattr(vector_search, "query_terms", lambda query: query.split())
+
+
+def test_scores_are_cosines_after_updates_and_merge(tmp_path, plain_queries):
+    rng = random.Random(7)
+    indexer = IncrementalIndexer(str(tmp_path / "segments"))
+
+    documents = {str(number): make_document(rng, str(number)) for number in range(1, 11)}
+    indexer.update(list(documents.values()), [])
+
+    # Обновления и новые документы меняют df и размер коллекции после записи сегментов,
+    # а слияния по политике переписывают часть сегментов
+    for round_number in range(12):
+        changed = [make_document(rng, doc_id) for doc_id in rng.sample(sorted(documents), 3)]
+        changed += [make_document(rng, str(100 + round_number * 10 + number))
+                    for number in range(rng.randint(0, 6))]
+        for document in changed:
+            documents[document[0]] = document
+        indexer.update(changed, [])
+        indexer.maybe_merge(background=False)
+
+    deleted = rng.sample(sorted(documents), 3)
+    for doc_id in deleted:
+        del documents[doc_id]
+    indexer.update([], deleted)
+
+    queries = [" ".join(rng.sample(LEMMAS, rng.randint(1, 4))) for _ in range(40)]
+
+    index = SegmentedIndex(str(tmp_path / "segments"))
+    for query in queries:
+        scores = scores_by_doc_id(index, query)
+        assert all(score <= 1 + 1e-9 for score in scores.values())
+        assert set(scores) <= set(documents)
+
+        # Top-k с отсечением MaxScore совпадает с полным обходом
+        top = scores_by_doc_id(index, query, k=5)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:5]
+        assert sorted(top.values(), reverse=True) == pytest.approx([score for _, score in best])
+    index.close()
+
+    # После слияния удалённые документы вычищены, и выдача совпадает с полной пересборкой
+    indexer.merge_all()
+    index = SegmentedIndex(str(tmp_path / "segments"))
+    reference = rebuild(documents)
+
+    for query in queries:
+        scores = scores_by_doc_id(index, query)
+        expected = scores_by_doc_id(reference, query)
+        assert scores.keys() == expected.keys()
+        for doc_id, score in expected.items():
+            assert scores[doc_id] == pytest.approx(score, rel=1e-5)
+            assert scores[doc_id] <= 1 + 1e-9
+    index.close()
@@ -0,0 +1,76 @@
+import os
+import random
+import shutil
+
+import text_processing
+
+# Слова с формами одной леммы и стоп-словами: токенизатор оставляет только латиницу
+WORDS = ("the cats cat running runs search searched searching engines engine index indexes "
+         "documents document queries query studies study and of to with for better good "
+         "ranking ranked users user pages page").split()
+
+# Документ с известным разбором
+KNOWN_PAGE = ("<html><body><p>The cats and the cat were running.</p>"
+              "<p>Cats run to the search engines for queries.</p></body></html>")
+
+
+def make_pages(pages_dir, count=12):
+    rng = random.Random(5)
+    os.makedirs(pages_dir)
+
+    with open(os.path.join(pages_dir, "1.txt"), "w", encoding="utf-8") as f:
+        f.write(KNOWN_PAGE)
+
+    for doc_id in range(2, count + 1):
+        paragraphs = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 60)))
+                      for _ in range(3)]
+        html = ("<html><head><script>var x = 1;</script></head><body>"
+                + "".join(f"<p>{paragraph}</p>" for paragraph in paragraphs)
+                + "</body></html>")
+        with open(os.path.join(pages_dir, f"{doc_id}.txt"), "w", encoding="utf-8") as f:
+            f.write(html)
+
+
+def read_outputs(output_dir):
+    outputs = {}
+    for filename in sorted(os.listdir(output_dir)):
+        with open(os.path.join(output_dir, filename), "rb") as f:
+            outputs[filename] = f.read()
+    return outputs
+
+
+def lines(outputs, filename):
+    return outputs[filename].decode("utf-8").splitlines()
+
+
+# Файлы документов не зависят от числа процессов: пути скриптов ("../pages" и т. д.)
+# отсчитываются от рабочей папки, поэтому тест работает во временной папке
+def test_workers_produce_identical_files(tmp_path, monkeypatch):
+    make_pages(str(tmp_path / "pages"))
+    (tmp_path / "run").mkdir()
+    monkeypatch.chdir(tmp_path / "run")
+
+    output_dir = tmp_path / "page_terms"
+
+    text_processing.main(workers=1)
+    sequential = read_outputs(str(output_dir))
+
+    shutil.rmtree(output_dir)
+    os.remove(tmp_path / "lemma_cache.txt")
+
+    text_processing.main(workers=3, chunksize=2)
+    parallel = read_outputs(str(output_dir))
+
+    assert len(sequential) == 12 * 4
+    assert all(content.strip() for content in sequential.values())
+    assert all(int(lines(sequential, f"{doc_id}_tf.txt")[0]) > 0 for doc_id in range(1, 13))
+
+    # Стоп-слова и короткие слова отброшены, формы собраны в леммы, повторы посчитаны
+    assert lines(sequential, "1_tokens.txt") == [
+        "cat", "cats", "engines", "queries", "run", "running", "search", "were"]
+    assert "cat cat cats" in lines(sequential, "1_lemmas.txt")
+    assert "run run running" in lines(sequential, "1_lemmas.txt")
+    assert lines(sequential, "1_tf.txt")[:3] == ["9", "cat 1", "cats 2"]
+    assert "cat 1 4 7" in lines(sequential, "1_positions.txt")
+
+    assert parallel == sequential
@@ -1,14 +1,33 @@
 import os
 import re
-from bs4 import BeautifulSoup
-from collections import defaultdict
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from parsing import make_soup
+from index_format import doc_sort_key
+from lemmatizer import get_lemmatizer
+import metrics
+from collections import defaultdict, Counter
 
 
 # Настройки
 
 PAGES_DIR = "../pages"  # Папка, в которой лежат сохранённые HTML-документы
+TEXT_DIR = "../pages_text"  # Текст страниц, извлечённый краулером при скачивании
 TOKENS_FILE = "../tokens.txt"  # Файл для сохранения списка токенов
 LEMMAS_FILE = "../lemmas.txt"  # Файл для сохранения сгруппированных лемм
+OUTPUT_DIR = "../page_terms"  # Папка для файлов токенов и лемм каждой страницы
+CHANGED_DOCS_FILE = "../changed_docs.txt"  # Изменённые документы после инкрементального обхода
+WORKERS = os.cpu_count() or 1  # Количество процессов для обработки документов
+CHUNK_SIZE = 16  # Сколько документов отдавать процессу за раз
+
+# Этапы обработки документа для отчёта о производительности
+STAGE_NAMES = {
+    "read": "чтение",
+    "tokenize": "токенизация",
+    "lemmatize": "лемматизация",
+    "write": "запись",
+}
 
 # Стоп-слова
 STOP_WORDS = {
@@ -22,44 +41,29 @@ STOP_WORDS = {
     "so", "than", "too", "very", "can", "will", "just"
 }
 
-# Неправильные формы
-IRREGULAR_FORMS = {
-    "went": "go",
-    "gone": "go",
-    "did": "do",
-    "done": "do",
-    "was": "be",
-    "were": "be",
-    "been": "be",
-    "has": "have",
-    "had": "have",
-    "having": "have",
-    "made": "make",
-    "took": "take",
-    "taken": "take",
-    "saw": "see",
-    "seen": "see",
-    "ran": "run",
-    "bought": "buy",
-    "brought": "bring",
-    "thought": "think",
-    "better": "good",
-    "best": "good",
-    "worse": "bad",
-    "worst": "bad"
-}
-
 # Функция извлечения текста из HTML
 def extract_text_from_html(file_path):
     with open(file_path, "r", encoding="utf-8") as f:
         html = f.read()
 
-    soup = BeautifulSoup(html, "html.parser")
+    soup = make_soup(html)
     return soup.get_text(separator=" ")
 
 
-# Токенизация
-def tokenize(text):
+# Текст страницы: берём готовый от краулера, HTML разбираем только если его нет
+def load_page_text(doc_id, file_path):
+    text_path = os.path.join(TEXT_DIR, f"{doc_id}.txt")
+
+    if os.path.exists(text_path):
+        with open(text_path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    return extract_text_from_html(file_path)
+
+
+# Токенизация с позициями: позиция — номер слова в тексте с учётом
+# отброшенных стоп-слов, чтобы фразовый поиск видел пропуски между словами
+def tokenize_with_positions(text):
     # Приводим текст к нижнему регистру
     text = text.lower()
 
@@ -67,121 +71,286 @@ def tokenize(text):
     tokens = re.findall(r"\b[a-z]+\b", text)
 
     # Удаляем стоп-слова и слишком короткие слова
-    clean_tokens = [
-        token for token in tokens
+    return [
+        (position, token) for position, token in enumerate(tokens)
         if token not in STOP_WORDS and len(token) > 2
     ]
 
-    return clean_tokens
+
+# Токенизация
+def tokenize(text):
+    return [token for _, token in tokenize_with_positions(text)]
 
 
-# Лемматизация
+# Лемматизация (правила и кеш — в модуле lemmatizer)
 def smart_lemmatize(word):
+    return get_lemmatizer().lemmatize(word)
+
+
+# Разбор одного документа: частоты токенов, леммы и позиции лемм
+def analyze_document(doc_id, file_path):
+    """
+    Возвращает словарь с результатами разбора и время каждого этапа (сек):
+        token_counts — Counter токенов, length — длина документа в токенах,
+        lemmas — лемма -> токены, positions — лемма -> позиции в тексте
+    """
+    timings = {}
+    started = time.perf_counter()
+
+    # Извлекаем текст
+    text = load_page_text(doc_id, file_path)
+    timings["read"] = time.perf_counter() - started
+
+    # Токенизация
+    started = time.perf_counter()
+    positioned_tokens = tokenize_with_positions(text)
+    tokens = [token for _, token in positioned_tokens]
+
+    # Частоты токенов; ключи — уникальные токены в отсортированном виде
+    token_counts = Counter(tokens)
+    unique_tokens = sorted(token_counts)
+    timings["tokenize"] = time.perf_counter() - started
+
+    # Лемматизация страницы
+    started = time.perf_counter()
+    lemma_dict = defaultdict(list)
+    lemmas = get_lemmatizer().lemmatize_batch(unique_tokens)
+
+    for token, lemma in zip(unique_tokens, lemmas):
+        lemma_dict[lemma].append(token)
+
+    # Позиции лемм в тексте (для фразового поиска и NEAR)
+    token_lemmas = dict(zip(unique_tokens, lemmas))
+    lemma_positions = defaultdict(list)
+
+    for position, token in positioned_tokens:
+        lemma_positions[token_lemmas[token]].append(position)
+    timings["lemmatize"] = time.perf_counter() - started
+
+    terms = {
+        "token_counts": token_counts,
+        "length": len(tokens),
+        "lemmas": dict(lemma_dict),
+        "positions": dict(lemma_positions),
+    }
+    return terms, timings
+
+
+# Запись файлов токенов, лемм, частот и позиций страницы
+def write_document_files(doc_id, terms, output_dir=OUTPUT_DIR):
+    token_counts = terms["token_counts"]
+    unique_tokens = sorted(token_counts)
+    lemma_dict = terms["lemmas"]
+    lemma_positions = terms["positions"]
+
+    # Сохраняем токены страницы
+    tokens_file_path = os.path.join(
+        output_dir, f"{doc_id}_tokens.txt"
+    )
+
+    with open(tokens_file_path, "w", encoding="utf-8") as f:
+        for token in unique_tokens:
+            f.write(token + "\n")
+
+    # Сохраняем леммы страницы
+    lemmas_file_path = os.path.join(
+        output_dir, f"{doc_id}_lemmas.txt"
+    )
+
+    with open(lemmas_file_path, "w", encoding="utf-8") as f:
+        for lemma in sorted(lemma_dict.keys()):
+            tokens_line = " ".join(sorted(lemma_dict[lemma]))
+            f.write(f"{lemma} {tokens_line}\n")
+
+    # Сохраняем частоты токенов: первая строка — длина документа в токенах,
+    # далее <токен> <количество>. По ним tfidf.py считает TF без чтения страниц
+    tf_file_path = os.path.join(
+        output_dir, f"{doc_id}_tf.txt"
+    )
+
+    with open(tf_file_path, "w", encoding="utf-8") as f:
+        f.write(f"{terms['length']}\n")
+        for token in unique_tokens:
+            f.write(f"{token} {token_counts[token]}\n")
+
+    # Сохраняем позиции лемм: <лемма> <позиция1> <позиция2> ...
+    positions_file_path = os.path.join(
+        output_dir, f"{doc_id}_positions.txt"
+    )
+
+    with open(positions_file_path, "w", encoding="utf-8") as f:
+        for lemma in sorted(lemma_positions):
+            f.write(lemma + " " + " ".join(map(str, lemma_positions[lemma])) + "\n")
+
+
+# Обработка одного документа: токены и леммы страницы
+def process_document(doc_id, file_path, output_dir=OUTPUT_DIR):
+    """
+    Возвращает время каждого этапа (сек) и количество токенов —
+    из них main() собирает отчёт о производительности.
+    """
+    terms, timings = analyze_document(doc_id, file_path)
+
+    started = time.perf_counter()
+    write_document_files(doc_id, terms, output_dir)
+    timings["write"] = time.perf_counter() - started
+
+    return timings, terms["length"]
+
+
+# Обёртка для пула процессов: map передаёт один аргумент.
+# Вместе с результатом возвращаются новые записи кеша лемм процесса
+def process_document_task(args):
+    doc_id, file_path = args
+    timings, tokens_count = process_document(doc_id, file_path)
+    return timings, tokens_count, get_lemmatizer().take_new_entries()
+
+
+# Отчёт о скорости работы по этапам
+def print_timing_report(stage_totals, docs_count, tokens_count, workers, elapsed):
+    print(f"\nДокументов: {docs_count}, токенов: {tokens_count}, "
+          f"процессов: {workers}, время: {elapsed:.2f} с "
+          f"({docs_count / elapsed if elapsed > 0 else 0:.1f} док/с)")
+
+    # Время этапов суммируется по всем процессам
+    for stage, name in STAGE_NAMES.items():
+        total = stage_totals.get(stage, 0.0)
+        rate = docs_count / total if total > 0 else 0
+        print(f"  {name:<14} {total:8.2f} с  {rate:10.1f} док/с на процесс")
+
+
+# Изменения, накопленные краулером: doc_id -> updated | deleted
+def load_changed_docs(path=CHANGED_DOCS_FILE):
+    if not os.path.exists(path):
+        return None
+
+    changes = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 2:
+                changes[parts[0]] = parts[1]
+
+    return changes
 
-    # Неправильные формы
-    if word in IRREGULAR_FORMS:
-        return IRREGULAR_FORMS[word]
-
-    # Множественное число (companies → company)
-    if word.endswith("ies") and len(word) > 4:
-        return word[:-3] + "y"
 
-    # Множественное число (boxes → box)
-    if word.endswith("es") and len(word) > 4:
-        return word[:-2]
+# Очередь изменений (<doc_id> <updated|deleted>) записывается атомарно
+def save_changed_docs(changes, path):
+    tmp_path = path + ".tmp"
+
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for doc_id, kind in sorted(changes.items(), key=lambda item: doc_sort_key(item[0])):
+            f.write(f"{doc_id} {kind}\n")
 
-    # Обычное множественное число (cats → cat)
-    if word.endswith("s") and len(word) > 3:
-        return word[:-1]
+    os.replace(tmp_path, path)
 
-    # Continuous (running → run)
-    if word.endswith("ing") and len(word) > 5:
-        base = word[:-3]
 
-        # Обработка удвоенной согласной (running → run)
-        if len(base) > 2 and base[-1] == base[-2]:
-            base = base[:-1]
-        return base
+# Забор очереди изменений для обработки (text_processing, build_index, segments.py).
+# Очередь сначала забирается переименованием и только потом читается: всё, что
+# краулер запишет после этого, попадёт в новый файл очереди и не потеряется.
+# Забранная очередь добавляется к незавершённой прошлой обработке (.processing),
+# которая выполняется повторно; .claimed остаётся от прерванного слияния очередей.
+# Возвращает изменения или None, если очереди нет; после обработки нужно вызвать
+# finish_changed_docs
+def claim_changed_docs(path=CHANGED_DOCS_FILE):
+    processing_path = path + ".processing"
+    claimed_path = path + ".claimed"
 
-    # Прошедшее время (played → play)
-    if word.endswith("ed") and len(word) > 4:
-        base = word[:-2]
+    if not os.path.exists(claimed_path) and os.path.exists(path):
+        os.replace(path, claimed_path)
 
-        # studied → study
-        if base.endswith("i"):
-            return base[:-1] + "y"
-        return base
+    changes = load_changed_docs(processing_path)
+    claimed = load_changed_docs(claimed_path)
+    if claimed is not None:
+        changes = changes or {}
+        changes.update(claimed)
+        save_changed_docs(changes, processing_path)
+        os.remove(claimed_path)
 
-    # Сравнительная степень (bigger → big)
-    if word.endswith("er") and len(word) > 4:
-        base = word[:-2]
+    return changes
 
-        # bigger → big
-        if base[-1] == base[-2]:
-            base = base[:-1]
-        return base
 
-    # Превосходная степень (biggest → big)
-    if word.endswith("est") and len(word) > 5:
-        base = word[:-3]
+# Забранные изменения обработаны
+def finish_changed_docs(path=CHANGED_DOCS_FILE):
+    processing_path = path + ".processing"
+    if os.path.exists(processing_path):
+        os.remove(processing_path)
 
-        if base[-1] == base[-2]:
-            base = base[:-1]
-        return base
 
-    return word
+# Удаление файлов документа, которого больше нет в коллекции
+def remove_document(doc_id, output_dir=OUTPUT_DIR):
+    for suffix in ("_tokens.txt", "_lemmas.txt", "_tf.txt", "_positions.txt"):
+        file_path = os.path.join(output_dir, f"{doc_id}{suffix}")
+        if os.path.exists(file_path):
+            os.remove(file_path)
 
-def main():
 
-    OUTPUT_DIR = "../page_terms"
+def main(workers=WORKERS, chunksize=CHUNK_SIZE):
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    # Проходим по всем файлам в папке pages
-    for filename in os.listdir(PAGES_DIR):
-
-        file_path = os.path.join(PAGES_DIR, filename)
-
-        if os.path.isfile(file_path) and filename.endswith(".txt"):
-
-            # doc_id = имя файла без расширения
-            doc_id = filename.replace(".txt", "")
-
-            # Извлекаем текст
-            text = extract_text_from_html(file_path)
-
-            # Токенизация
-            tokens = tokenize(text)
-
-            # Убираем дубликаты и сортируем
-            unique_tokens = sorted(set(tokens))
-
-            # Сохраняем токены страницы
-            tokens_file_path = os.path.join(
-                OUTPUT_DIR, f"{doc_id}_tokens.txt"
-            )
-
-            with open(tokens_file_path, "w", encoding="utf-8") as f:
-                for token in unique_tokens:
-                    f.write(token + "\n")
-
-            # Лемматизация страницы
-            lemma_dict = defaultdict(list)
-
-            for token in unique_tokens:
-                lemma = smart_lemmatize(token)
-                lemma_dict[lemma].append(token)
+    # Если краулер оставил список изменений — обрабатываем только его,
+    # иначе проходим по всем файлам в папке pages
+    changes = claim_changed_docs()
+
+    if changes is None:
+        doc_ids = [
+            filename.replace(".txt", "")
+            for filename in os.listdir(PAGES_DIR)
+            if filename.endswith(".txt")
+        ]
+    else:
+        doc_ids = [doc_id for doc_id, kind in changes.items() if kind == "updated"]
+
+        for doc_id, kind in changes.items():
+            if kind == "deleted":
+                remove_document(doc_id)
+                print(f"[-] Удалён документ {doc_id}")
+
+    tasks = []
+    for doc_id in doc_ids:
+        file_path = os.path.join(PAGES_DIR, f"{doc_id}.txt")
+        if os.path.isfile(file_path):
+            tasks.append((doc_id, file_path))
+
+    workers = max(1, min(workers, len(tasks)))
+    stage_totals = defaultdict(float)
+    tokens_count = 0
+    started = time.perf_counter()
+
+    # Документы независимы, поэтому их можно обрабатывать в нескольких процессах;
+    # каждый процесс пишет файлы своих документов, результат совпадает с последовательным
+    # Кеш лемм загружается до запуска процессов и переходит в них при fork
+    lemmatizer = get_lemmatizer()
+
+    # Пул закрывается и при ошибке в одном из документов
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    with executor or nullcontext():
+        if executor is not None:
+            results = executor.map(process_document_task, tasks, chunksize=chunksize)
+        else:
+            results = map(process_document_task, tasks)
+
+        for (doc_id, _), (timings, doc_tokens, lemma_entries) in zip(tasks, results):
+            for stage, value in timings.items():
+                stage_totals[stage] += value
+                metrics.observe("document_stage_seconds", value, stage=stage)
+            metrics.inc("documents_processed_total")
+            tokens_count += doc_tokens
+            lemmatizer.merge(lemma_entries)
+            print(f"[+] Обработан документ {doc_id}")
 
-            # Сохраняем леммы страницы
-            lemmas_file_path = os.path.join(
-                OUTPUT_DIR, f"{doc_id}_lemmas.txt"
-            )
+    # Сохраняем общий кеш лемм для следующих запусков и поисковых модулей
+    lemmatizer.save_cache()
 
-            with open(lemmas_file_path, "w", encoding="utf-8") as f:
-                for lemma in sorted(lemma_dict.keys()):
-                    tokens_line = " ".join(sorted(lemma_dict[lemma]))
-                    f.write(f"{lemma} {tokens_line}\n")
+    elapsed = time.perf_counter() - started
+    print_timing_report(stage_totals, len(tasks), tokens_count, workers, elapsed)
+    metrics.write_summary("text_processing", {"workers": workers, "tokens": tokens_count,
+                                              "elapsed_s": round(elapsed, 3)})
 
-            print(f"[+] Обработан документ {doc_id}")
+    # Изменения обработаны — очищаем забранную очередь
+    if changes is not None:
+        finish_changed_docs()
 
     print("\nГотово. Для каждой страницы созданы отдельные файлы.")
 
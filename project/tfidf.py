@@ -1,12 +1,13 @@
 import os
 import math
+import time
 from collections import defaultdict, Counter
 import zipfile
-
-# Папка с исходными HTML-документами
-PAGES_DIR = "../pages"
+from index_format import INDEX_BIN_FILE, write_index
+import metrics
 
 PAGE_TERMS_DIR = "../page_terms"
+INDEX_DOCS_FILE = "../index.txt"  # Соответствие doc_id -> URL
 
 # Папка для результатов
 OUTPUT_DIR = "../tfidf_results"
@@ -30,16 +31,34 @@ def create_archive(directory, archive_name):
     print(f"[+] Archive created: {archive_name}")
 
 
-# Загрузка токенов страницы
-def load_page_tokens(doc_id):
-    file_path = os.path.join(PAGE_TERMS_DIR, f"{doc_id}_tokens.txt")
+# Загрузка doc_id -> URL (если краулер ещё не запускался, URL пустые)
+def load_doc_urls():
+    doc_urls = {}
+    if os.path.exists(INDEX_DOCS_FILE):
+        with open(INDEX_DOCS_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2:
+                    doc_urls[parts[0]] = parts[1]
+    return doc_urls
+
+
+# Загрузка частот токенов страницы (файл <doc_id>_tf.txt из text_processing)
+def load_page_tf(doc_id):
+    file_path = os.path.join(PAGE_TERMS_DIR, f"{doc_id}_tf.txt")
+
+    term_counts = Counter()
+    total_terms = 0
 
-    tokens = []
     if os.path.exists(file_path):
         with open(file_path, "r", encoding="utf-8") as f:
-            tokens = [line.strip() for line in f]
+            total_terms = int(f.readline() or 0)
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2:
+                    term_counts[parts[0]] = int(parts[1])
 
-    return tokens
+    return term_counts, total_terms
 
 
 # Загрузка лемм страницы
@@ -62,6 +81,51 @@ def load_page_lemmas(doc_id):
     return lemma_to_tokens
 
 
+# TF лемм: сумма частот токенов, которые приводятся к лемме
+def count_lemmas(lemma_to_tokens, term_counts):
+    lemma_counts = defaultdict(int)
+
+    for lemma, lemma_tokens in lemma_to_tokens.items():
+        for token in lemma_tokens:
+            lemma_counts[lemma] += term_counts.get(token, 0)
+
+    return lemma_counts
+
+
+# Подсчёт IDF по документной частоте
+def compute_idf(df_values, total_docs):
+    return {term: math.log(total_docs / df) for term, df in df_values.items()}
+
+
+# Запись TF-IDF файлов документа; возвращает вектор TF-IDF лемм
+def write_doc_tfidf(doc_id, term_counts, lemma_counts, total_terms, term_idf, lemma_idf):
+
+    # Термины
+    term_file_path = os.path.join(TERMS_DIR, f"tfidf_terms_{doc_id}.txt")
+
+    with open(term_file_path, "w", encoding="utf-8") as f:
+        for term, count in sorted(term_counts.items()):
+            tf = count / total_terms if total_terms > 0 else 0
+            idf = term_idf.get(term, 0)
+            tfidf = tf * idf
+            f.write(f"{term} {idf:.6f} {tfidf:.6f}\n")
+
+    # Леммы
+    lemma_file_path = os.path.join(LEMMAS_DIR, f"tfidf_lemmas_{doc_id}.txt")
+
+    vector = {}
+
+    with open(lemma_file_path, "w", encoding="utf-8") as f:
+        for lemma, count in sorted(lemma_counts.items()):
+            tf = count / total_terms if total_terms > 0 else 0
+            idf = lemma_idf.get(lemma, 0)
+            tfidf = tf * idf
+            f.write(f"{lemma} {idf:.6f} {tfidf:.6f}\n")
+            vector[lemma] = tfidf
+
+    return vector
+
+
 def main():
     create_output_dirs()
 
@@ -72,39 +136,21 @@ def main():
     lemma_df = defaultdict(int)
 
     total_docs = 0
+    started = time.perf_counter()
 
-    # Обработка каждой страницы
-    for filename in os.listdir(PAGES_DIR):
+    # Обработка каждой страницы по частотам, сохранённым text_processing
+    for filename in os.listdir(PAGE_TERMS_DIR):
 
-        if filename.endswith(".txt"):
+        if filename.endswith("_tf.txt"):
 
             total_docs += 1
-            doc_id = filename.replace(".txt", "")
-
-            # Загружаем токены страницы
-            tokens = load_page_tokens(doc_id)
-
-            # Загружаем леммы страницы
-            lemma_to_tokens = load_page_lemmas(doc_id)
-
-            # Читаем оригинальный текст страницы
-            with open(os.path.join(PAGES_DIR, filename), "r", encoding="utf-8") as f:
-                words = f.read().lower().split()
-
-            # Оставляем только токены этой страницы
-            words = [w for w in words if w in tokens]
-
-            total_terms_in_doc = len(words)
+            doc_id = filename.replace("_tf.txt", "")
 
             # TF терминов
-            term_counts = Counter(words)
-
-            # TF лемм
-            lemma_counts = defaultdict(int)
+            term_counts, total_terms_in_doc = load_page_tf(doc_id)
 
-            for lemma, lemma_tokens in lemma_to_tokens.items():
-                for token in lemma_tokens:
-                    lemma_counts[lemma] += term_counts.get(token, 0)
+            # Загружаем леммы страницы и считаем TF лемм
+            lemma_counts = count_lemmas(load_page_lemmas(doc_id), term_counts)
 
             doc_term_counts[doc_id] = (term_counts, total_terms_in_doc)
             doc_lemma_counts[doc_id] = (lemma_counts, total_terms_in_doc)
@@ -117,15 +163,16 @@ def main():
             for lemma in lemma_counts:
                 lemma_df[lemma] += 1
 
-    # Подсчёт IDF
-    term_idf = {}
-    lemma_idf = {}
+    metrics.observe("build_stage_seconds", time.perf_counter() - started, stage="read")
 
-    for term, df in term_df.items():
-        term_idf[term] = math.log(total_docs / df)
+    # Подсчёт IDF
+    started = time.perf_counter()
+    term_idf = compute_idf(term_df, total_docs)
+    lemma_idf = compute_idf(lemma_df, total_docs)
 
-    for lemma, df in lemma_df.items():
-        lemma_idf[lemma] = math.log(total_docs / df)
+    # Векторы лемм документов для бинарного индекса
+    lemma_vectors = {}
+    doc_lengths = {}
 
     # Запись TF-IDF файлов
     for doc_id in doc_term_counts:
@@ -133,31 +180,31 @@ def main():
         term_counts, total_terms = doc_term_counts[doc_id]
         lemma_counts, _ = doc_lemma_counts[doc_id]
 
-        # Термины
-        term_file_path = os.path.join(TERMS_DIR, f"tfidf_terms_{doc_id}.txt")
+        lemma_vectors[doc_id] = write_doc_tfidf(doc_id, term_counts, lemma_counts, total_terms,
+                                                term_idf, lemma_idf)
+        doc_lengths[doc_id] = total_terms
 
-        with open(term_file_path, "w", encoding="utf-8") as f:
-            for term, count in term_counts.items():
-                tf = count / total_terms if total_terms > 0 else 0
-                idf = term_idf.get(term, 0)
-                tfidf = tf * idf
-                f.write(f"{term} {idf:.6f} {tfidf:.6f}\n")
+    metrics.observe("build_stage_seconds", time.perf_counter() - started, stage="tfidf")
 
-        # Леммы
-        lemma_file_path = os.path.join(LEMMAS_DIR, f"tfidf_lemmas_{doc_id}.txt")
+    # Бинарный индекс по леммам для поисковых модулей
+    with metrics.timer("build_stage_seconds", stage="binary"):
+        write_index(INDEX_BIN_FILE, lemma_vectors, lemma_idf, load_doc_urls(), doc_lengths)
 
-        with open(lemma_file_path, "w", encoding="utf-8") as f:
-            for lemma, count in lemma_counts.items():
-                tf = count / total_terms if total_terms > 0 else 0
-                idf = lemma_idf.get(lemma, 0)
-                tfidf = tf * idf
-                f.write(f"{lemma} {idf:.6f} {tfidf:.6f}\n")
+    # Сегменты инкрементального индекса (если есть) пересоздаются по новому индексу.
+    # Импорт здесь: segments сам импортирует tfidf
+    from segments import reset_segments
+    with metrics.timer("build_stage_seconds", stage="segments"):
+        reset_segments()
 
     print("TF-IDF успешно рассчитан.")
     print(f"Результаты сохранены в папке: {OUTPUT_DIR}")
+    print(f"[+] Бинарный индекс сохранён: {INDEX_BIN_FILE}")
+
+    with metrics.timer("build_stage_seconds", stage="archives"):
+        create_archive(TERMS_DIR, ARCHIVE_TERMS_FILE)
+        create_archive(LEMMAS_DIR, ARCHIVE_LEMMAS_FILE)
 
-    create_archive(TERMS_DIR, ARCHIVE_TERMS_FILE)
-    create_archive(LEMMAS_DIR, ARCHIVE_LEMMAS_FILE)
+    metrics.write_summary("tfidf", {"documents": total_docs})
 
 
 if __name__ == "__main__":
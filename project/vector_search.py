@@ -1,10 +1,28 @@
 import os
 import math
+import heapq
+import time
+from bisect import bisect_left
 from collections import Counter
+import metrics
+from index_format import INDEX_BIN_FILE, IndexReader, doc_sort_key, file_version
+from query_analyzer import get_query_analyzer
+from segments import SegmentedIndex, index_segments, manifest_path, segments_are_current
+
+# Векторизованный поиск (SparseVectorIndex) — только если установлены numpy и scipy
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = None
+    sparse = None
 
 TFIDF_DIR = "../tfidf_results/lemmas"
 INDEX_DOCS_FILE = "../index.txt"
 
+# Запас на ошибки округления при сравнении границ score с порогом
+SCORE_EPSILON = 1e-9
+
 
 # Загрузка doc_id -> URL
 def load_doc_urls():
@@ -24,6 +42,10 @@ def load_document_vectors():
         doc_vectors[doc_id] = {lemma: tfidf}
         idf_values[lemma] = idf
     """
+    # Если построен бинарный индекс, читаем его вместо разбора текстовых файлов
+    if os.path.exists(INDEX_BIN_FILE):
+        return load_document_vectors_binary(INDEX_BIN_FILE)
+
     doc_vectors = {}
     idf_values = {}
 
@@ -44,6 +66,25 @@ def load_document_vectors():
     return doc_vectors, idf_values
 
 
+# Загрузка TF-IDF векторов из бинарного индекса
+def load_document_vectors_binary(path):
+    reader = IndexReader(path)
+
+    doc_ids = reader.doc_ids()
+    doc_vectors = {doc_id: {} for doc_id in doc_ids}
+    idf_values = {}
+
+    for lemma in reader.terms():
+        idf_values[lemma] = reader.idf(lemma)
+        docs, weights = reader.postings(lemma)
+
+        for doc, weight in zip(docs, weights):
+            doc_vectors[doc_ids[doc]][lemma] = weight
+
+    reader.close()
+    return doc_vectors, idf_values
+
+
 # Косинусное сходство
 def cosine_similarity(vec1, vec2):
 
@@ -63,10 +104,23 @@ def cosine_similarity(vec1, vec2):
     return dot_product / (norm1 * norm2)
 
 
+# Термины запроса в том виде, в котором они ищутся в индексе: леммы слов,
+# выделенных так же, как слова страниц (query_analyzer.py)
+def query_terms(query):
+    return get_query_analyzer().terms(query)
+
+
+# Нормализованный запрос: запросы с одинаковым ключом дают одинаковую выдачу
+# (порядок и повторы лемм учитываются только через число вхождений,
+# поэтому «cats» и «cat» дают один ключ)
+def query_key(query):
+    return tuple(sorted(Counter(query_terms(query)).items()))
+
+
 # Построение вектора запроса
 def build_query_vector(query, idf_values):
 
-    words = query.lower().split()
+    words = query_terms(query)
     term_counts = Counter(words)
 
     total_terms = len(words)
@@ -81,8 +135,346 @@ def build_query_vector(query, idf_values):
     return query_vector
 
 
-# Поиск
-def search(query, doc_vectors, idf_values):
+# Векторы документов в виде инвертированного индекса в памяти.
+# Интерфейс совпадает с IndexReader, поэтому поиск работает с обоими
+class VectorIndex:
+    def __init__(self, doc_vectors, idf_values, doc_urls=None):
+        doc_urls = doc_urls or {}
+
+        self.idf_values = idf_values
+        self.doc_ids = sorted(doc_vectors, key=doc_sort_key)
+        self.doc_count = len(self.doc_ids)
+        self.urls = [doc_urls.get(doc_id, "") for doc_id in self.doc_ids]
+
+        # Нормы векторов считаются один раз при загрузке, а не при каждом запросе
+        self.norms = []
+        self._postings = {}
+
+        for doc, doc_id in enumerate(self.doc_ids):
+            vector = doc_vectors[doc_id]
+            self.norms.append(math.sqrt(sum(v ** 2 for v in vector.values())))
+
+            for lemma, weight in vector.items():
+                docs, weights = self._postings.setdefault(lemma, ([], []))
+                docs.append(doc)
+                weights.append(weight)
+
+        # Максимальный вклад каждой леммы в косинусное сходство (для отсечения в top-k)
+        self._max_scores = {}
+        for lemma, (docs, weights) in self._postings.items():
+            self._max_scores[lemma] = max(
+                (weight / self.norms[doc] for doc, weight in zip(docs, weights) if self.norms[doc] > 0),
+                default=0.0,
+            )
+
+    def postings(self, term):
+        return self._postings.get(term, ([], []))
+
+    def terms(self):
+        return iter(self._postings)
+
+    def max_score(self, term):
+        return self._max_scores.get(term, 0.0)
+
+    def norm(self, doc):
+        return self.norms[doc]
+
+    def doc_id(self, doc):
+        return self.doc_ids[doc]
+
+    def doc_url(self, doc):
+        return self.urls[doc]
+
+
+# Векторизованный индекс: разреженная матрица документ × лемма (CSR)
+# со строками, нормированными по L2. Score запроса — произведение матрицы
+# на вектор запроса, для пачки запросов — на матрицу запросов
+class SparseVectorIndex:
+    def __init__(self, index):
+        """
+        Строится из VectorIndex или IndexReader.
+        Ранжирование совпадает с search_index по исходному индексу.
+        """
+        if sparse is None:
+            raise ImportError("Для SparseVectorIndex нужны numpy и scipy")
+
+        self.idf_values = index.idf_values
+        # IDF читается из исходного индекса при каждом запросе: его сегменты должны
+        # оставаться открытыми, пока работает этот индекс
+        self.segments = index_segments(index)
+        self.doc_count = index.doc_count
+        self.doc_ids = [index.doc_id(doc) for doc in range(self.doc_count)]
+        self.urls = [index.doc_url(doc) for doc in range(self.doc_count)]
+        norms = np.array([index.norm(doc) for doc in range(self.doc_count)], dtype=np.float64)
+
+        self.columns = {}  # лемма -> номер столбца
+        rows, cols, data = [], [], []
+
+        for term in index.terms():
+            docs, weights = index.postings(term)
+            column = len(self.columns)
+            self.columns[term] = column
+            rows.append(np.asarray(docs, dtype=np.int64))
+            cols.append(np.full(len(docs), column, dtype=np.int64))
+            data.append(np.asarray(weights, dtype=np.float64))
+
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+        data = np.concatenate(data) if data else np.zeros(0, dtype=np.float64)
+
+        # Нормировка строк: w / ||d||, документы с нулевой нормой не находятся
+        safe_norms = np.where(norms > 0, norms, 1.0)
+        data = np.where(norms[rows] > 0, data / safe_norms[rows], 0.0)
+
+        self.matrix = sparse.csr_matrix(
+            (data, (rows, cols)), shape=(self.doc_count, len(self.columns))
+        )
+
+    def doc_id(self, doc):
+        return self.doc_ids[doc]
+
+    def doc_url(self, doc):
+        return self.urls[doc]
+
+    # Матрица запросов (лемма × запрос) с нормированными векторами запросов
+    def query_matrix(self, queries):
+        rows, cols, data = [], [], []
+
+        for column, query in enumerate(queries):
+            query_vector = build_query_vector(query, self.idf_values)
+            query_norm = math.sqrt(sum(v ** 2 for v in query_vector.values()))
+            if query_norm == 0:
+                continue
+
+            for term, weight in query_vector.items():
+                rows.append(self.columns[term])
+                cols.append(column)
+                data.append(weight / query_norm)
+
+        return sparse.csc_matrix(
+            (data, (rows, cols)), shape=(len(self.columns), len(queries))
+        )
+
+    # Score всех документов для пачки запросов: плотная матрица документ × запрос
+    def score_queries(self, queries):
+        return (self.matrix @ self.query_matrix(queries)).toarray()
+
+    # Пачка запросов: для каждого [(номер документа, score)] по убыванию score
+    def search_many(self, queries, k=None):
+        if not queries:
+            return []
+
+        # Как и search_top_k: k <= 0 — пустая выдача
+        if k is not None and k <= 0:
+            return [[] for _ in queries]
+
+        all_scores = self.score_queries(queries)
+        results = []
+
+        for column in range(len(queries)):
+            scores = all_scores[:, column]
+            docs = np.flatnonzero(scores > 0)
+
+            # Для top-k сначала argpartition, полная сортировка только k кандидатов
+            if k is not None and len(docs) > k:
+                kth = np.partition(scores[docs], len(docs) - k)[len(docs) - k]
+                docs = docs[scores[docs] >= kth]
+
+            # По убыванию score, при равенстве — по возрастанию номера документа
+            order = np.lexsort((docs, -scores[docs]))
+            docs = docs[order][:k]
+            results.append([(int(doc), float(scores[doc])) for doc in docs])
+
+        return results
+
+    def search(self, query, k=None):
+        return self.search_many([query], k)[0]
+
+
+# Загрузка индекса для поиска: сегменты инкрементального индекса (если они новее
+# index.bin), бинарный через mmap, векторы в памяти
+# или (backend="sparse") разреженная матрица numpy/scipy
+def load_vector_index(lazy=True, memory_budget=0, backend="python"):
+    if segments_are_current():
+        index = SegmentedIndex(memory_budget=memory_budget)
+    elif lazy and os.path.exists(INDEX_BIN_FILE):
+        index = IndexReader(INDEX_BIN_FILE, memory_budget=memory_budget)
+    else:
+        doc_vectors, idf_values = load_document_vectors()
+        index = VectorIndex(doc_vectors, idf_values, load_doc_urls())
+
+    if backend == "sparse":
+        return SparseVectorIndex(index)
+
+    return index
+
+
+# Поколение индекса на диске — то, что прочитает load_vector_index. Меняется при
+# пересборке index.bin, обновлении сегментов или файлов TF-IDF
+def index_generation():
+    if segments_are_current():
+        return "segments", file_version(manifest_path())
+    if os.path.exists(INDEX_BIN_FILE):
+        return "binary", file_version(INDEX_BIN_FILE)
+    return "tfidf", file_version(TFIDF_DIR)
+
+
+# Поиск по инвертированному индексу (VectorIndex или IndexReader)
+def search_index(query, index, k=None):
+    """
+    Возвращает [(номер документа, score)] по убыванию score.
+    Без k обходятся все списки документов лемм запроса (term-at-a-time);
+    с k работает top-k поиск с отсечением MaxScore.
+    """
+    if isinstance(index, SparseVectorIndex):
+        return index.search(query, k)
+
+    if k is not None:
+        return search_top_k(query, index, k)
+
+    started = time.perf_counter()
+    query_vector = build_query_vector(query, index.idf_values)
+    query_norm = math.sqrt(sum(v ** 2 for v in query_vector.values()))
+    analyzed = time.perf_counter()
+    metrics.observe("search_stage_seconds", analyzed - started, stage="analyze")
+
+    if query_norm == 0:
+        return []
+
+    dot_products = {}
+
+    for term, query_weight in query_vector.items():
+        docs, weights = index.postings(term)
+        for doc, weight in zip(docs, weights):
+            dot_products[doc] = dot_products.get(doc, 0.0) + query_weight * weight
+
+    scores = []
+    for doc, dot_product in dot_products.items():
+        norm = index.norm(doc)
+        if norm > 0 and dot_product > 0:
+            scores.append((doc, dot_product / (query_norm * norm)))
+    scored = time.perf_counter()
+
+    # При равных score выше документ с меньшим номером
+    scores.sort(key=lambda x: (x[1], -x[0]), reverse=True)
+
+    metrics.observe("search_stage_seconds", scored - analyzed, stage="score")
+    metrics.observe("search_stage_seconds", time.perf_counter() - scored, stage="sort")
+    return scores
+
+
+# Top-k поиск с динамическим отсечением (MaxScore)
+def search_top_k(query, index, k=10):
+    """
+    Для каждой леммы известна верхняя граница её вклада в score:
+    вес в запросе * max(w / ||d||) по её документам. Леммы упорядочены
+    по границе; те, чья суммарная граница не превышает score k-го
+    лучшего документа, «необязательные»: документ, встречающийся только
+    в них, в top-k попасть не может. Кандидаты берутся только из
+    обязательных списков, необязательные проверяются двоичным поиском
+    и лишь пока документ ещё может обогнать порог.
+    Результат совпадает с search_index без k, обрезанным до k.
+    """
+    started = time.perf_counter()
+    query_vector = build_query_vector(query, index.idf_values)
+    query_norm = math.sqrt(sum(v ** 2 for v in query_vector.values()))
+    analyzed = time.perf_counter()
+    metrics.observe("search_stage_seconds", analyzed - started, stage="analyze")
+
+    if query_norm == 0 or k <= 0:
+        return []
+
+    # (граница вклада, вес леммы в запросе / ||q||, документы, веса)
+    terms = []
+    for term, query_weight in query_vector.items():
+        docs, weights = index.postings(term)
+        if docs:
+            query_weight /= query_norm
+            terms.append((query_weight * index.max_score(term), query_weight, docs, weights))
+
+    terms.sort(key=lambda t: t[0])
+
+    # bound_sums[i] — сумма границ лемм 0..i
+    bound_sums = []
+    total = 0.0
+    for bound, _, _, _ in terms:
+        total += bound
+        bound_sums.append(total)
+
+    positions = [0] * len(terms)
+    heap = []  # (score, -doc): в вершине худший из k лучших
+    threshold = 0.0
+    first_essential = 0  # леммы terms[first_essential:] обязательные
+
+    while True:
+        # Следующий кандидат — наименьший текущий документ обязательных списков
+        candidate = None
+        for i in range(first_essential, len(terms)):
+            docs = terms[i][2]
+            position = positions[i]
+            if position < len(docs) and (candidate is None or docs[position] < candidate):
+                candidate = docs[position]
+
+        if candidate is None:
+            break
+
+        dot_product = 0.0
+        for i in range(first_essential, len(terms)):
+            _, query_weight, docs, weights = terms[i]
+            position = positions[i]
+            if position < len(docs) and docs[position] == candidate:
+                dot_product += query_weight * weights[position]
+                positions[i] = position + 1
+
+        norm = index.norm(candidate)
+        if norm <= 0:
+            continue
+        score = dot_product / norm
+
+        # Необязательные леммы — от большей границы к меньшей, пока есть шанс обогнать порог
+        for i in range(first_essential - 1, -1, -1):
+            if score + bound_sums[i] + SCORE_EPSILON <= threshold:
+                break
+
+            _, query_weight, docs, weights = terms[i]
+            position = bisect_left(docs, candidate, positions[i])
+            positions[i] = position
+            if position < len(docs) and docs[position] == candidate:
+                score += query_weight * weights[position] / norm
+
+        if score <= 0:
+            continue
+
+        entry = (score, -candidate)
+        if len(heap) < k:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+        else:
+            continue
+
+        # Порог вырос — часть лемм может стать необязательной
+        if len(heap) == k:
+            threshold = heap[0][0]
+            while (first_essential < len(terms)
+                   and bound_sums[first_essential] + SCORE_EPSILON <= threshold):
+                first_essential += 1
+
+    scored = time.perf_counter()
+    results = [(-neg_doc, score) for score, neg_doc in sorted(heap, reverse=True)]
+
+    metrics.observe("search_stage_seconds", scored - analyzed, stage="score")
+    metrics.observe("search_stage_seconds", time.perf_counter() - scored, stage="sort")
+    return results
+
+
+# Поиск: [(doc_id, score)] по убыванию score
+def search(query, index, k=None):
+    return [(index.doc_id(doc), score) for doc, score in search_index(query, index, k)]
+
+
+# Поиск полным перебором документов через cosine_similarity (эталон для проверки)
+def search_exhaustive(query, doc_vectors, idf_values):
 
     query_vector = build_query_vector(query, idf_values)
 
@@ -97,11 +489,9 @@ def search(query, doc_vectors, idf_values):
     return sorted(scores.items(), key=lambda x: x[1], reverse=True)
 
 
-
 def main():
 
-    doc_urls = load_doc_urls()
-    doc_vectors, idf_values = load_document_vectors()
+    index = load_vector_index()
 
     print("Введите запрос или 'exit'.")
 
@@ -111,15 +501,19 @@ def main():
         if query.lower() == "exit":
             break
 
-        results = search(query, doc_vectors, idf_values)
+        # Сегменты могли обновиться — берём свежий снимок
+        if isinstance(index, SegmentedIndex):
+            index = index.refresh()
+
+        results = search_index(query, index, k=10)
 
         if not results:
             print("Ничего не найдено.")
             continue
 
         print("\nРезультаты:")
-        for doc_id, score in results[:10]:
-            print(f"{doc_urls.get(doc_id)} | score={score:.4f}")
+        for doc, score in results:
+            print(f"{index.doc_url(doc)} | score={score:.4f}")
 
 
 if __name__ == "__main__":